@@ -0,0 +1,38 @@
+# accumulation_renderer_visualisation_constats.py
+from PyQt5.QtGui import QPainter
+
+
+class AccumulationRendererVisualisationConstats:
+    """Rendu incrémental des frames cumulées d'une session d'export.
+
+    Les points déjà dessinés sont gardés dans un raster transparent : chaque frame n'y ajoute que
+    les couches de constats nouvelles, puis le raster est composé avec la page et le fond de carte en cache.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.points_image = session.map_image()
+        self.painted = []
+
+    def add_layers(self, layers):
+        """Ajoute au raster des points les couches pas encore dessinées ; retourne leur nombre."""
+        ids = [layer.id() for layer in layers]
+        if self.painted != ids[:len(self.painted)]:
+            # La frame n'étend pas la précédente : repartir d'un raster vide
+            self.points_image = self.session.map_image()
+            self.painted = []
+        new_layers = layers[len(self.painted):]
+        # Chaque mois est dessiné au-dessus des précédents
+        for layer in new_layers:
+            self.session.paint_layers(self.points_image, [layer])
+            self.painted.append(layer.id())
+        return len(new_layers)
+
+    def render(self, layers):
+        """Page sans étiquettes de la frame cumulée : page et fond de carte, puis points accumulés."""
+        self.add_layers(layers)
+        image = self.session.render_background().copy()
+        painter = QPainter(image)
+        painter.drawImage(self.session.map_rect.topLeft(), self.points_image)
+        painter.end()
+        return image
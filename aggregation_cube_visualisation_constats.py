@@ -0,0 +1,186 @@
+# aggregation_cube_visualisation_constats.py
+from qgis.core import QgsField, QgsFeature, QgsProject, QgsVectorFileWriter, QgsVectorLayer
+from PyQt5.QtCore import QVariant
+import csv
+import itertools
+import numpy as np
+from .utils_visualisation_constats import encode_column, normalize_elevage
+
+# Dimensions du cube et libellés affichés
+CUBE_DIMENSIONS = {
+    "annee": "Année",
+    "trimestre": "Trimestre",
+    "mois": "Mois",
+    "departement": "Département",
+    "commune": "Commune",
+    "espece": "Espèce",
+    "conclusion": "Conclusion",
+    "indemnisation": "Indemnisation",
+}
+# Dimensions de base lues sur chaque constat, dans l'ordre des colonnes du cube
+BASE_DIMENSIONS = ["annee", "mois", "commune", "espece", "conclusion", "indemnisation"]
+NON_JOINTE = "Non jointe"
+
+
+def quarter_of(month):
+    return f"T{(month - 1) // 3 + 1}"
+
+
+def department_of(commune):
+    return commune.split(" ", 1)[0][:2] if commune != NON_JOINTE else NON_JOINTE
+
+
+# Dimensions agrégées : (dimension de base, libellé agrégé d'un libellé de base)
+ROLLUPS = {
+    "trimestre": ("mois", quarter_of),
+    "departement": ("commune", department_of),
+}
+
+
+def indemnisation_label(value):
+    value = str(value or "").strip()
+    return value.capitalize() if value else "Non renseignée"
+
+
+class AggregationCubeVisualisationConstats:
+    """Cube d'agrégation des constats (année, mois, commune, espèce, conclusion, indemnisation).
+
+    Construit une fois après la jointure : chaque cellule non vide est stockée avec son nombre
+    de constats, chaque dimension codée en entiers. Un tableau croisé (lignes × colonnes, filtres)
+    s'obtient par un bincount sur les cellules retenues ; trimestre et département sont des
+    agrégations du mois et de la commune.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def build(self, matched_features, data_by_month):
+        """Compte les constats par cellule ; les constats sans commune appariée sont classés « Non jointe »."""
+        rows = []
+        for (year, month), features in data_by_month.items():
+            for feature in features:
+                match = matched_features.get(feature.id())
+                commune = f"{match['insee']} {match['nom_insee']}" if match else NON_JOINTE
+                rows.append((
+                    year, month, commune,
+                    normalize_elevage(str(feature["Elevage"] or "")),
+                    str(feature["C_tech_new"] or ""),
+                    indemnisation_label(feature["Indemnisation"])
+                ))
+        self.columns = {}
+        if not rows:
+            self.counts = np.zeros(0, dtype=np.int64)
+            print("Cube d'agrégation vide")
+            return False
+        codes = []
+        for name, values in zip(BASE_DIMENSIONS, zip(*rows)):
+            labels, column = encode_column(values)
+            self.columns[name] = (labels, column)
+            codes.append(column)
+        cells, self.counts = np.unique(np.stack(codes, axis=1), axis=0, return_counts=True)
+        for i, name in enumerate(BASE_DIMENSIONS):
+            self.columns[name] = (self.columns[name][0], cells[:, i])
+        print(f"Cube d'agrégation: {len(rows)} constats, {len(self.counts)} cellules non vides")
+        return True
+
+    def dimension(self, name):
+        """Retourne (libellés, code de chaque cellule) ; les dimensions agrégées sont calculées au premier appel."""
+        if name not in self.columns:
+            base, rollup = ROLLUPS[name]
+            labels, codes = self.dimension(base)
+            derived_labels, mapping = encode_column([rollup(label) for label in labels])
+            self.columns[name] = (derived_labels, mapping[codes])
+        return self.columns[name]
+
+    def labels(self, name):
+        return self.dimension(name)[0] if self.columns else []
+
+    def group(self, names, mask):
+        """Libellés (tuples) du produit des dimensions names et index de chaque cellule retenue."""
+        if not names:
+            return [()], np.zeros(int(mask.sum()), dtype=np.int64)
+        dims = [self.dimension(name) for name in names]
+        shape = tuple(len(labels) for labels, _ in dims)
+        index = np.ravel_multi_index(tuple(codes[mask] for _, codes in dims), shape)
+        return list(itertools.product(*(labels for labels, _ in dims))), index
+
+    def query(self, rows, columns=(), filters=None):
+        """Tableau croisé rows × columns des constats retenus par filters ({dimension: libellés}).
+
+        Retourne (libellés des lignes, libellés des colonnes, matrice) ; lignes et colonnes vides omises.
+        """
+        mask = np.ones(len(self.counts), dtype=bool)
+        for name, values in (filters or {}).items():
+            labels, codes = self.dimension(name)
+            wanted = set(values)
+            mask &= np.isin(codes, [i for i, label in enumerate(labels) if label in wanted])
+        row_labels, row_index = self.group(rows, mask)
+        column_labels, column_index = self.group(columns, mask)
+        size = len(row_labels) * len(column_labels)
+        matrix = np.bincount(
+            row_index * len(column_labels) + column_index, weights=self.counts[mask], minlength=size
+        ).reshape(len(row_labels), len(column_labels)).astype(np.int64)
+        keep_rows = np.flatnonzero(matrix.sum(axis=1))
+        keep_columns = np.flatnonzero(matrix.sum(axis=0))
+        return (
+            [row_labels[i] for i in keep_rows],
+            [column_labels[j] for j in keep_columns],
+            matrix[np.ix_(keep_rows, keep_columns)]
+        )
+
+
+def pivot_table(rows, columns, result):
+    """En-tête et lignes (avec totaux) d'un résultat de query, prêtes à écrire."""
+    row_labels, column_labels, matrix = result
+    header = [CUBE_DIMENSIONS[name] for name in rows] or [""]
+    header += [" / ".join(str(v) for v in label) or "Constats" for label in column_labels]
+    header.append("Total")
+    lines = []
+    for label, values in zip(row_labels, matrix):
+        lines.append([str(v) for v in label] + [int(v) for v in values] + [int(values.sum())])
+    totals = matrix.sum(axis=0)
+    width = max(len(rows), 1)
+    lines.append(["Total"] + [""] * (width - 1) + [int(v) for v in totals] + [int(totals.sum())])
+    return header, lines
+
+
+def write_pivot_csv(path, rows, columns, result):
+    header, lines = pivot_table(rows, columns, result)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(header)
+        writer.writerows(lines)
+    print(f"Tableau croisé exporté: {path}")
+
+
+def write_pivot_ods(path, rows, columns, result):
+    """Écrit le tableau croisé dans une feuille ODS via une couche mémoire sans géométrie."""
+    header, lines = pivot_table(rows, columns, result)
+    width = max(len(rows), 1)
+    layer = QgsVectorLayer("None", "Tableau croisé", "memory")
+    provider = layer.dataProvider()
+    names = []
+    for i, name in enumerate(header):
+        # Noms de champs uniques et non vides
+        name = name or f"champ_{i + 1}"
+        while name in names:
+            name += "_"
+        names.append(name)
+    provider.addAttributes([
+        QgsField(name, QVariant.String if i < width else QVariant.Int) for i, name in enumerate(names)
+    ])
+    layer.updateFields()
+    features = []
+    for line in lines:
+        feature = QgsFeature(layer.fields())
+        feature.setAttributes(line)
+        features.append(feature)
+    provider.addFeatures(features)
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "ODS"
+    options.layerName = "Tableau croisé"
+    error = QgsVectorFileWriter.writeAsVectorFormatV3(layer, path, QgsProject.instance().transformContext(), options)
+    if error[0] != QgsVectorFileWriter.NoError:
+        raise IOError(f"Impossible d'écrire {path} : {error[1]}")
+    print(f"Tableau croisé exporté: {path}")
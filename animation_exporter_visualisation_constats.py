@@ -1,314 +1,537 @@
-from qgis.core import (
-    QgsPrintLayout, QgsLayoutItemMap, QgsLayoutItemLabel, QgsLayoutExporter,
-    QgsLayoutPoint, QgsLayoutSize, QgsProject, QgsLayoutManager, QgsUnitTypes
-)
-from qgis.core import QgsTextFormat
+from qgis.core import QgsProject, QgsFeatureRequest
 from PyQt5.QtWidgets import QFileDialog, QMessageBox, QProgressBar
-from PyQt5.QtGui import QFont, QColor
-from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage
 import os
 import tempfile
 import shutil
 import subprocess
-import time
-from PyQt5.QtWidgets import QApplication
+from concurrent.futures import ThreadPoolExecutor
+from .render_pool_visualisation_constats import RenderPoolVisualisationConstats
+from .encoder_visualisation_constats import FfmpegPipeEncoderVisualisationConstats, encoding_extension
+from .export_session_visualisation_constats import ExportSessionVisualisationConstats, ExportCanceledVisualisationConstats
+from .accumulation_renderer_visualisation_constats import AccumulationRendererVisualisationConstats
+from .export_manifest_visualisation_constats import ExportManifestVisualisationConstats
+from .filter_engine_visualisation_constats import FilterEngineVisualisationConstats
+from .filter_presets_visualisation_constats import variant_slug
+from .export_sinks_visualisation_constats import create_sink, frame_png_name, VideoSinkVisualisationConstats
 
 class AnimationExporterVisualisationConstats:
     def __init__(self, iface):
         self.iface = iface
-
-    def record_animation_to_png(self, layers, dialog, output_dir, progress_callback=None):
-        """Exporte chaque frame en PNG avec layout portrait, étendue globale et couche Dates."""
-        if not output_dir:
-            QMessageBox.warning(dialog, "Attention", "Veuillez choisir un dossier de sortie.")
-            return
+        self.session = None
+        # Suivi d'un export en tâche de fond : on_frame(frames_rendues, total), on_encode(fraction encodée par ffmpeg),
+        # is_canceled() interrompt l'export en levant ExportCanceledVisualisationConstats
+        self.on_frame = None
+        self.on_encode = None
+        self.is_canceled = None
+        # Rendu toujours confié au pool de processus, même avec un seul processus (export hors du fil principal)
+        self.pooled = False
+
+    def get_session(self, extent, preset="final"):
+        """Session d'export (layout + exporteur) réutilisée tant que l'emprise et le préréglage ne changent pas."""
+        if self.session is None or not self.session.matches(extent, preset):
+            self.session = ExportSessionVisualisationConstats(extent, preset=preset)
+        return self.session
+
+    def uses_pool(self, workers, layers_for_frame=None):
+        """Vrai si les frames sont rendues par le pool de processus (jamais en mode choroplèthe ou densité)."""
+        return (workers > 1 or self.pooled) and not layers_for_frame
+
+    def check_canceled(self):
+        if self.is_canceled and self.is_canceled():
+            raise ExportCanceledVisualisationConstats()
+
+    def notify(self, dialog, title, message, critical=False):
+        """Message à l'utilisateur ; sans fenêtre (exécution en lot), il est seulement écrit dans la console."""
+        if dialog is None:
+            print(f"{'ERREUR' if critical else 'Attention'}: {message}")
+        elif critical:
+            QMessageBox.critical(dialog, title, message)
+        else:
+            QMessageBox.warning(dialog, title, message)
+
+    def prepare_export(self, layers, dialog, output, missing_output_message, communes_layer=None):
+        """Vérifie les entrées de l'export ; retourne la couche Communes et l'étendue globale, ou (None, None).
+
+        Sans communes_layer, la couche "Communes" est cherchée dans le projet.
+        """
+        if not output:
+            self.notify(dialog, "Attention", missing_output_message)
+            return None, None
         if not layers:
-            QMessageBox.warning(dialog, "Attention", "Aucune couche disponible pour l'export.")
-            return
-
-        # Récupérer les couches "Communes" et "Dates"
-        communes_layer = None
-        dates_layer = None
-        for layer in QgsProject.instance().mapLayers().values():
-            if layer.name() == "Communes":
-                communes_layer = layer
-            elif layer.name() == "Dates":
-                dates_layer = layer
+            self.notify(dialog, "Attention", "Aucune couche disponible pour l'export.")
+            return None, None
+
+        # Récupérer la couche "Communes"
+        if communes_layer is None:
+            for layer in QgsProject.instance().mapLayers().values():
+                if layer.name() == "Communes":
+                    communes_layer = layer
 
         if not communes_layer:
-            QMessageBox.warning(dialog, "Attention", "Couche 'Communes' introuvable. Utilisation de l'étendue par défaut.")
-            return
+            self.notify(dialog, "Attention", "Couche 'Communes' introuvable. Utilisation de l'étendue par défaut.")
+            return None, None
 
         # Calculer l'étendue globale (avec une marge de 10%)
         global_extent = communes_layer.extent()
         global_extent.scale(1.1)
+        return communes_layer, global_extent
 
-        # Créer le layout
-        project = QgsProject.instance()
-        manager = project.layoutManager()
-        layout_name = "Export_Constats_Loup"
-        layouts = manager.layouts()
-        for existing_layout in layouts:
-            if existing_layout.name() == layout_name:
-                manager.removeLayout(existing_layout)
-
-        layout = QgsPrintLayout(project)
-        layout.initializeDefaults()
-        layout.setName(layout_name)
-        manager.addLayout(layout)
-
-        # Configurer la page
-        pc = layout.pageCollection()
-        pc.pages()[0].setPageSize(QgsLayoutSize(210, 297, QgsUnitTypes.LayoutMillimeters))
-
-        # Ajouter la carte
-        map_item = QgsLayoutItemMap(layout)
-        map_item.attemptMove(QgsLayoutPoint(10, 30, QgsUnitTypes.LayoutMillimeters))
-        map_item.attemptResize(QgsLayoutSize(190, 250, QgsUnitTypes.LayoutMillimeters))
-        map_item.setExtent(global_extent)
-        layout.addLayoutItem(map_item)
-
-        # Ajouter le titre
-        # Nouveau code
-        title_item = QgsLayoutItemLabel(layout)
-        title_item.setText("Bilan des constats pour l'année YYYY, mois : MM")
-
-        # Créer un format de texte
-        text_format = QgsTextFormat()
-        text_format.setFont(QFont("Arial", 16))
-        text_format.setSize(16)
-        text_format.setColor(QColor("black"))
-
-        # Appliquer le format
-        title_item.setTextFormat(text_format)
+    def render_plan_in_pool(self, plan, communes_layer, extent, outputs, workers, progress_callback=None, progress_max=100,
+                            preset="final", rendered=None):
+        """Rend le plan dans un pool de processus QGIS et rapporte la progression sur progress_max.
+
+        Retourne les positions des frames écrites (voir RenderPoolVisualisationConstats.render).
         """
-        title_item = QgsLayoutItemLabel(layout)
-        title_item.setText("Bilan des constats pour l'année YYYY, mois : MM")
-        font = QFont("Arial", 16)
-        font.setBold(True)
-        title_item.setFont(font)
-        title_item.adjustSizeToText()
-        title_item.attemptMove(QgsLayoutPoint(10, 10, QgsUnitTypes.LayoutMillimeters))
-        layout.addLayoutItem(title_item)
+        def pool_progress(done, total):
+            if self.on_frame:
+                self.on_frame(done, total)
+            if progress_callback:
+                progress_callback(int((done / total) * progress_max))
+        return RenderPoolVisualisationConstats(workers).render(plan, communes_layer, extent, outputs, pool_progress, preset,
+                                                               self.is_canceled, rendered)
+
+    def build_frame_plan(self, layers, cumulative):
+        """Construit la liste explicite des frames à exporter (couches de constats, titre, date).
+
+        Le plan ne dépend ni du canevas ni de la visibilité dans l'arbre des couches.
+        La signature d'une frame (couches non vides après filtre) est identique à celle de la
+        précédente quand le mois n'apporte aucun constat visible.
         """
-        # S'assurer que la couche Dates est visible
-        root = QgsProject.instance().layerTreeRoot()
-        if dates_layer:
-            dates_tree_layer = root.findLayer(dates_layer.id())
-            if dates_tree_layer:
-                dates_tree_layer.setItemVisibilityChecked(True)
-
-        # Exporter les frames
-        total_frames = len(layers)
-        for i, (year, month, layer) in enumerate(layers):
+        valid_layers = []
+        for year, month, layer in layers:
             if not layer or not layer.isValid():
                 print(f"Couche {year}_{month:02d} non valide, ignorée")
                 continue
-            title_item.setText(f"Bilan des constats pour l'année {year}, mois : {month:02d}")
-
-            # Gérer l'affichage des couches en fonction du mode cumulatif
-            for l in layers:
-                tree_layer = root.findLayer(l[2].id())
-                if tree_layer:
-                    if dialog.png_cumulative_mode:
-                        # En mode cumulatif, afficher toutes les couches jusqu'à l'index actuel
-                        tree_layer.setItemVisibilityChecked(l in layers[:i + 1])
-                    else:
-                        # En mode non cumulatif, afficher uniquement la couche courante
-                        tree_layer.setItemVisibilityChecked(l == (year, month, layer))
-
-            # Synchroniser la couche Dates
-            if dates_layer:
-                month_key = f"{year}_{month:02d}"
-                dates_layer.setSubsetString(f"month_key = '{month_key}'")
-                dates_layer.triggerRepaint()
-
-            # Ajouter les couches à la carte
-            map_layers = [communes_layer]
-            if dialog.png_cumulative_mode:
-                map_layers.extend([l[2] for l in layers[:i + 1] if l[2] and l[2].isValid()])
-            else:
-                map_layers.append(layer)
-            if dates_layer:
-                map_layers.append(dates_layer)
-            map_item.setLayers(map_layers)
-
-            # Rafraîchir la carte
-            self.iface.mapCanvas().refresh()
-            time.sleep(0.5)
-            QApplication.processEvents()
-
-            # Exporter l'image
-            exporter = QgsLayoutExporter(layout)
-            output_path = os.path.join(output_dir, f"{i+1}_constats_{year:04d}_{month:02d}.png")
-            exporter.exportToImage(output_path, QgsLayoutExporter.ImageExportSettings())
-
-            # Mettre à jour la progression
+            valid_layers.append((year, month, layer))
+        non_empty = {layer.id(): layer.featureCount() > 0 for _, _, layer in valid_layers}
+        plan = []
+        for i, (year, month, layer) in enumerate(valid_layers):
+            constats_layers = [l for _, _, l in valid_layers[:i + 1]] if cumulative else [layer]
+            plan.append({
+                "index": i,
+                "year": year,
+                "month": month,
+                "layers": constats_layers,
+                "signature": tuple((l.id(), l.subsetString()) for l in constats_layers if non_empty[l.id()]),
+                "title": f"Bilan des constats pour l'année {year}, mois : {month:02d}",
+                "date": f"{year}_{month:02d}"
+            })
+        return plan
+
+    def add_frame_overlays(self, plan, overlays, cumulative):
+        """Ajoute à chaque frame les couches d'analyse (foyers, front de propagation) et leur filtre du mois.
+
+        overlays : [(couche, frame_expression(year, month, cumulative))], couches copiées pour l'export.
+        Une couche n'entre dans la signature de la frame que si son filtre retient au moins une entité.
+        """
+        if not overlays:
+            return plan
+        for layer, _ in overlays:
+            layer.setSubsetString("")
+        for frame in plan:
+            frame["overlays"] = [(layer, frame_expression(frame["year"], frame["month"], cumulative))
+                                 for layer, frame_expression in overlays]
+            frame["overlay_signature"] = tuple(
+                (layer.id(), expression) for layer, expression in frame["overlays"]
+                if any(True for _ in layer.getFeatures(QgsFeatureRequest().setFilterExpression(expression).setLimit(1)))
+            )
+            frame["signature"] = frame["signature"] + frame["overlay_signature"]
+        return plan
+
+    def variant_plan(self, plan, name, filter_engine):
+        """Frames du plan pour une variante de filtre : mêmes couches et dates, titre complété du nom de la variante.
+
+        Les signatures sont recalculées avec les effectifs du moteur de filtre, sans relire les couches.
+        """
+        frames = []
+        for frame in plan:
+            frames.append(dict(
+                frame,
+                title=f"{frame['title']} — {name}",
+                filter=filter_engine.expression,
+                signature=tuple((l.id(), filter_engine.expression) for l in frame["layers"] if filter_engine.count(l) > 0)
+                + frame.get("overlay_signature", ())
+            ))
+        return frames
+
+    def png_output(self, output_dir, frame):
+        return os.path.join(output_dir, frame_png_name(frame))
+
+    def frame_map_layers(self, frame, layers_for_frame=None):
+        """Couches dessinées sur le fond de carte pour une frame du plan (la première au-dessus).
+
+        Les couches d'analyse de la frame (add_frame_overlays) reçoivent leur filtre et passent au-dessus des constats.
+        """
+        if layers_for_frame:
+            return list(layers_for_frame(frame["index"], frame["year"], frame["month"]))
+        overlay_layers = []
+        for layer, expression in frame.get("overlays", []):
+            layer.setSubsetString(expression)
+            overlay_layers.append(layer)
+        return overlay_layers + frame["layers"]
+
+    def render_plan(self, plan, session, communes_layer, write_frame, progress_callback=None, progress_max=100,
+                    layers_for_frame=None, cumulative=False):
+        """Rend chaque frame du plan avec la session et la transmet à write_frame(i, frame, image).
+
+        Les frames sans nouveau constat visible réutilisent le fond de la précédente (hors mode choroplèthe,
+        où les couches de la frame sont recalculées par layers_for_frame). En mode cumulé, les points
+        déjà dessinés sont conservés et seul le nouveau mois est rendu.
+        """
+        total_frames = len(plan)
+        session.reset_cache()
+        # Les Communes sont rendues une fois en fond de carte, sous les couches de chaque frame
+        session.set_basemap([communes_layer])
+        accumulator = None
+        if cumulative and not layers_for_frame:
+            accumulator = AccumulationRendererVisualisationConstats(session)
+        for i, frame in enumerate(plan):
+            self.check_canceled()
+            signature = None if layers_for_frame else frame["signature"]
+            image = session.render_frame(frame, self.frame_map_layers(frame, layers_for_frame), signature, accumulator)
+            write_frame(i, frame, image)
+            print(f"Frame {i+1}/{total_frames} rendue: {frame['date']}")
+            if self.on_frame:
+                self.on_frame(i + 1, total_frames)
             if progress_callback:
-                progress_callback(int(((i + 1) / total_frames) * 100))
-
-        # Nettoyer
-        manager.removeLayout(layout)
-        print(f"Export PNG terminé: {total_frames} images générées dans {output_dir}")
-
-    def record_animation_to_mp4(self, layers, dialog, output_file, progress_callback=None):
-        """Enregistre l'animation en MP4 avec layout portrait, étendue globale et couche Dates."""
-        if not output_file:
-            QMessageBox.warning(dialog, "Attention", "Veuillez choisir un fichier de sortie.")
-            return
-        if not layers:
-            QMessageBox.warning(dialog, "Attention", "Aucune couche disponible pour l'export.")
-            return
-
-        # Récupérer les couches "Communes" et "Dates"
-        communes_layer = None
-        dates_layer = None
-        for layer in QgsProject.instance().mapLayers().values():
-            if layer.name() == "Communes":
-                communes_layer = layer
-            elif layer.name() == "Dates":
-                dates_layer = layer
-
+                progress_callback(int(((i + 1) / total_frames) * progress_max))
+        print(f"Frames sans nouveau constat (fond réutilisé): {session.reused_frames}/{total_frames}, "
+              f"rendus du fond de carte: {session.basemap.renders}")
+
+    def record_animation_to_png(self, layers, dialog, output_dir, progress_callback=None, layers_for_frame=None, workers=1,
+                                preset="final", cumulative=None, communes_layer=None, plan=None, overlays=None):
+        """Exporte chaque frame en PNG avec layout portrait, étendue globale et date incrustée.
+
+        layers_for_frame(i, year, month), si fourni, remplace les couches de constats de la frame (mode choroplèthe).
+        Avec workers > 1 (ou self.pooled), les frames sont rendues par un pool de processus (hors mode choroplèthe).
+        Hors mode choroplèthe, un manifeste dans output_dir permet de ne rendre que les images absentes ou modifiées.
+        cumulative vaut par défaut le mode cumulatif PNG du dialogue ; retourne False si l'export n'a pas pu démarrer.
+        Une annulation (is_canceled) lève ExportCanceledVisualisationConstats ; les images déjà écrites restent au manifeste.
+        plan : frames déjà construites (variantes de filtre), sinon construites depuis layers avec overlays
+        (couches d'analyse filtrées à chaque frame, voir add_frame_overlays).
+        """
+        communes_layer, global_extent = self.prepare_export(layers, dialog, output_dir,
+                                                            "Veuillez choisir un dossier de sortie.", communes_layer)
         if not communes_layer:
-            QMessageBox.warning(dialog, "Attention", "Couche 'Communes' introuvable. Utilisation de l'étendue par défaut.")
-            return
-
-        # Calculer l'étendue globale (avec une marge de 10%)
-        global_extent = communes_layer.extent()
-        global_extent.scale(1.1)
+            return False
+        if cumulative is None:
+            cumulative = dialog.png_cumulative_mode if dialog else False
+        plan = plan or self.add_frame_overlays(self.build_frame_plan(layers, cumulative), overlays, cumulative)
+        outputs = [self.png_output(output_dir, frame) for frame in plan]
+
+        # Les valeurs des communes en mode choroplèthe ne sont connues qu'au rendu : pas de reprise possible
+        manifest = None if layers_for_frame else ExportManifestVisualisationConstats(output_dir)
+        pending = list(range(len(plan)))
+        digests = []
+        if manifest:
+            digests = [manifest.frame_digest(frame, [communes_layer], global_extent, preset) for frame in plan]
+            pending = [i for i in pending if not manifest.is_current(outputs[i], digests[i])]
+            for i in pending:
+                manifest.forget(outputs[i])
+            print(f"Manifeste: {len(plan) - len(pending)} images à jour conservées, {len(pending)} à rendre")
+            if not pending:
+                if progress_callback:
+                    progress_callback(100)
+                return True
+        pending_plan = [plan[i] for i in pending]
+        pending_outputs = [outputs[i] for i in pending]
+
+        if self.uses_pool(workers, layers_for_frame):
+            # Supprimer les images obsolètes : seules celles réécrites par le pool seront inscrites au manifeste
+            for output in pending_outputs:
+                if os.path.isfile(output):
+                    os.remove(output)
+            rendered = set()
+            try:
+                self.render_plan_in_pool(pending_plan, communes_layer, global_extent, pending_outputs, workers,
+                                         progress_callback, preset=preset, rendered=rendered)
+            finally:
+                # Seules les frames signalées par le pool sont complètes : les autres seront rendues à la reprise
+                for position in rendered:
+                    manifest.record(pending_outputs[position], digests[pending[position]])
+                manifest.save()
+                for output in pending_outputs:
+                    if os.path.isfile(output + ".tmp"):
+                        os.remove(output + ".tmp")
+        else:
+            session = self.get_session(global_extent, preset)
+
+            def write_frame(i, frame, image):
+                session.save_png(image, pending_outputs[i])
+                if manifest:
+                    manifest.record(pending_outputs[i], digests[pending[i]])
+                    manifest.save()
+
+            self.render_plan(pending_plan, session, communes_layer, write_frame,
+                             progress_callback, 100, layers_for_frame, cumulative)
+        print(f"Export PNG terminé: {len(pending_plan)} images générées dans {output_dir}")
+        return True
+
+    def video_error_message(self, error, export_name="MP4"):
+        """Message lisible pour une erreur d'un export encodé par ffmpeg (les autres erreurs restent génériques)."""
+        if isinstance(error, subprocess.CalledProcessError):
+            return f"Échec de la création de la vidéo : {error.stderr.decode() if error.stderr else str(error)}"
+        if isinstance(error, FileNotFoundError) and "ffmpeg" in str(error).lower():
+            return "FFmpeg non trouvé. Installez FFmpeg et ajoutez-le au PATH système."
+        return f"Erreur lors de l'export {export_name} : {str(error)}"
+
+    def record_animation_to_mp4(self, layers, dialog, output_file, progress_callback=None, layers_for_frame=None, workers=1,
+                                preset="final", encoding=None, cumulative=None, communes_layer=None, plan=None,
+                                overlays=None):
+        """Enregistre l'animation (MP4, WebM, GIF ou APNG) avec layout portrait, étendue globale et date incrustée.
+
+        layers_for_frame(i, year, month), si fourni, remplace les couches de constats de la frame (mode choroplèthe).
+        Avec workers > 1 (ou self.pooled), les frames sont rendues par un pool de processus (hors mode choroplèthe).
+        encoding règle le format, la fréquence d'images, le CRF, la vitesse et la largeur (voir DEFAULT_ENCODING).
+        Retourne True si la vidéo a été écrite ; sans dialogue, les erreurs sont relancées après affichage.
+        Une annulation (is_canceled) supprime le fichier incomplet et lève ExportCanceledVisualisationConstats.
+        plan : frames déjà construites (variantes de filtre), sinon construites depuis layers avec overlays.
+        """
+        communes_layer, global_extent = self.prepare_export(layers, dialog, output_file,
+                                                            "Veuillez choisir un fichier de sortie.", communes_layer)
+        if not communes_layer:
+            return False
 
-        # Créer un dossier temporaire pour les frames
+        # Dossier temporaire réservé aux frames du rendu parallèle ; le rendu séquentiel est envoyé en flux à ffmpeg
         temp_dir = tempfile.mkdtemp()
+        encoder = FfmpegPipeEncoderVisualisationConstats(output_file, encoding)
+        encoder.on_progress = self.on_encode
+        encoder.is_canceled = self.is_canceled
         try:
-            # Créer le layout
-            project = QgsProject.instance()
-            manager = project.layoutManager()
-            layout_name = "Export_Constats_Loup_Video"
-            layouts = manager.layouts()
-            for existing_layout in layouts:
-                if existing_layout.name() == layout_name:
-                    manager.removeLayout(existing_layout)
-
-            layout = QgsPrintLayout(project)
-            layout.initializeDefaults()
-            layout.setName(layout_name)
-            manager.addLayout(layout)
-
-            pc = layout.pageCollection()
-            pc.pages()[0].setPageSize(QgsLayoutSize(210, 297, QgsUnitTypes.LayoutMillimeters))
-
-            map_item = QgsLayoutItemMap(layout)
-            map_item.attemptMove(QgsLayoutPoint(10, 30, QgsUnitTypes.LayoutMillimeters))
-            map_item.attemptResize(QgsLayoutSize(190, 250, QgsUnitTypes.LayoutMillimeters))
-            map_item.setExtent(global_extent)
-            layout.addLayoutItem(map_item)
-            
-            title_item = QgsLayoutItemLabel(layout)
-            title_item.setText("Bilan des constats pour l'année YYYY, mois : MM")
-
-            text_format = QgsTextFormat()
-            text_format.setFont(QFont("Arial", 16))
-            text_format.setSize(16)
-            text_format.setColor(QColor("black"))
-
-            title_item.setTextFormat(text_format)
-            title_item.adjustSizeToText()
-            title_item.attemptMove(QgsLayoutPoint(10, 10, QgsUnitTypes.LayoutMillimeters))
-            layout.addLayoutItem(title_item)
-
-            """
-            title_item = QgsLayoutItemLabel(layout)
-            title_item.setText("Bilan des constats pour l'année YYYY, mois : MM")
-            font = QFont("Arial", 16)
-            font.setBold(True)
-            title_item.setFont(font)
-            title_item.adjustSizeToText()
-            title_item.attemptMove(QgsLayoutPoint(10, 10, QgsUnitTypes.LayoutMillimeters))
-            layout.addLayoutItem(title_item)
-            """
-            # S'assurer que la couche Dates est visible
-            root = QgsProject.instance().layerTreeRoot()
-            if dates_layer:
-                dates_tree_layer = root.findLayer(dates_layer.id())
-                if dates_tree_layer:
-                    dates_tree_layer.setItemVisibilityChecked(True)
-
-            # Exporter les frames
-            total_frames = len(layers)
-            for i, (year, month, layer) in enumerate(layers):
-                if not layer or not layer.isValid():
-                    print(f"Couche {year}_{month:02d} non valide, ignorée")
-                    continue
-                title_item.setText(f"Bilan des constats pour l'année {year}, mois : {month:02d}")
-
-                # Gérer l'affichage des couches en fonction du mode cumulatif
-                for l in layers:
-                    tree_layer = root.findLayer(l[2].id())
-                    if tree_layer:
-                        if dialog.cumulative_mode:
-                            tree_layer.setItemVisibilityChecked(l in layers[:i + 1])
-                        else:
-                            tree_layer.setItemVisibilityChecked(l == (year, month, layer))
-
-                # Synchroniser la couche Dates
-                if dates_layer:
-                    month_key = f"{year}_{month:02d}"
-                    dates_layer.setSubsetString(f"month_key = '{month_key}'")
-                    dates_layer.triggerRepaint()
-
-                # Ajouter les couches à la carte
-                map_layers = [communes_layer]
-                if dialog.cumulative_mode:
-                    map_layers.extend([l[2] for l in layers[:i + 1] if l[2] and l[2].isValid()])
-                else:
-                    map_layers.append(layer)
-                if dates_layer:
-                    map_layers.append(dates_layer)
-                map_item.setLayers(map_layers)
-
-                # Rafraîchir la carte
-                self.iface.mapCanvas().refresh()
-                time.sleep(0.5)
-                QApplication.processEvents()
-
-                # Exporter l'image
-                exporter = QgsLayoutExporter(layout)
-                frame_path = os.path.join(temp_dir, f"frame_{i:04d}.png")
-                exporter.exportToImage(frame_path, QgsLayoutExporter.ImageExportSettings())
-
-                # Mettre à jour la progression (50% pour les frames)
-                if progress_callback:
-                    progress_callback(int(((i + 1) / total_frames) * 50))
-
-            # Nettoyer le layout
-            manager.removeLayout(layout)
-
-            # Créer la vidéo avec FFmpeg
-            ffmpeg_cmd = [
-                "ffmpeg",
-                "-y",  # Overwrite output
-                "-framerate", "2",
-                "-i", os.path.join(temp_dir, "frame_%04d.png"),
-                "-c:v", "libx264",
-                "-pix_fmt", "yuv420p",
-                output_file
-            ]
-
-            subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+            if cumulative is None:
+                cumulative = dialog.cumulative_mode if dialog else False
+            plan = plan or self.add_frame_overlays(self.build_frame_plan(layers, cumulative), overlays, cumulative)
+            encoder.total_frames = len(plan)
+            if self.uses_pool(workers, layers_for_frame):
+                outputs = [os.path.join(temp_dir, f"frame_{i:04d}.png") for i in range(len(plan))]
+                self.render_plan_in_pool(plan, communes_layer, global_extent, outputs, workers, progress_callback, 50, preset)
+                # Créer la vidéo avec FFmpeg
+                encoder.encode_images(os.path.join(temp_dir, "frame_%04d.png"), temp_dir)
+            else:
+                # Frames rendues en mémoire et envoyées brutes à ffmpeg : l'encodage suit le rendu
+                session = self.get_session(global_extent, preset)
+                self.render_plan(plan, session, communes_layer,
+                                 lambda i, frame, image: encoder.write(image),
+                                 progress_callback, 95, layers_for_frame, cumulative)
+                encoder.finish()
+
             # Mettre à jour la progression (100% après création de la vidéo)
             if progress_callback:
                 progress_callback(100)
-
-        except subprocess.CalledProcessError as e:
-            QMessageBox.critical(dialog, "Erreur", f"Échec de la création de la vidéo : {e.stderr.decode() if e.stderr else str(e)}")
-        except FileNotFoundError as e:
-            if "ffmpeg" in str(e).lower():
-                QMessageBox.critical(dialog, "Erreur", "FFmpeg non trouvé. Installez FFmpeg et ajoutez-le au PATH système.")
-            else:
-                QMessageBox.critical(dialog, "Erreur", f"Erreur lors de l'export MP4 : {str(e)}")
+            return True
+
+        except ExportCanceledVisualisationConstats:
+            encoder.abort()
+            if os.path.isfile(output_file):
+                os.remove(output_file)
+            print(f"Export vidéo annulé, fichier incomplet supprimé: {output_file}")
+            raise
         except Exception as e:
-            QMessageBox.critical(dialog, "Erreur", f"Erreur lors de l'export MP4 : {str(e)}")
+            self.notify(dialog, "Erreur", self.video_error_message(e), critical=True)
+            if dialog is None:
+                raise
+            return False
         finally:
+            encoder.abort()
             # Nettoyer le dossier temporaire
             shutil.rmtree(temp_dir, ignore_errors=True)
-            print(f"Nettoyage dossier temporaire: {temp_dir}")
\ No newline at end of file
+            print(f"Nettoyage dossier temporaire: {temp_dir}")
+
+    def record_animation_to_sinks(self, layers, dialog, sinks, progress_callback=None, layers_for_frame=None, workers=1,
+                                  preset="final", cumulative=False, communes_layer=None, overlays=None):
+        """Rend chaque frame une seule fois et la transmet à toutes les sorties demandées.
+
+        sinks : [{"type": "png" | "video" | "web", "output": dossier ou fichier, ...}] (voir create_sink),
+        par exemple la séquence PNG, la vidéo, un GIF et une copie web réduite en un seul passage.
+        Avec workers > 1 (ou self.pooled), les frames sont rendues par le pool dans un dossier temporaire
+        puis relues une fois, sans layout dans ce processus.
+        overlays : couches d'analyse filtrées à chaque frame (voir add_frame_overlays).
+        Retourne True si toutes les sorties ont été écrites ; sans dialogue, les erreurs sont relancées.
+        """
+        communes_layer, global_extent = self.prepare_export(layers, dialog, sinks,
+                                                            "Veuillez choisir au moins une sortie.", communes_layer)
+        if not communes_layer:
+            return False
+        plan = self.add_frame_overlays(self.build_frame_plan(layers, cumulative), overlays, cumulative)
+        sink_objects = [create_sink(spec) for spec in sinks]
+        video_sinks = [sink for sink in sink_objects if isinstance(sink, VideoSinkVisualisationConstats)]
+        fractions = [0.0] * len(video_sinks)
+        for v, sink in enumerate(video_sinks):
+            def encode_progress(fraction, v=v):
+                fractions[v] = fraction
+                if self.on_encode:
+                    self.on_encode(sum(fractions) / len(fractions))
+            sink.encoder.on_progress = encode_progress
+
+        def write_frame(i, frame, image):
+            for sink in sink_objects:
+                sink.write(frame, image)
+
+        temp_dir = None
+        try:
+            pooled = self.uses_pool(workers, layers_for_frame)
+            # Les frames du pool portent déjà la résolution : la sortie PNG les réécrit sans session
+            session = None if pooled else self.get_session(global_extent, preset)
+            for sink in sink_objects:
+                sink.open(session, len(plan))
+            # Images PNG réécrites hors manifeste : elles seront revérifiées par le prochain export PNG
+            for spec in sinks:
+                if spec["type"] == "png":
+                    manifest = ExportManifestVisualisationConstats(spec["output"])
+                    for frame in plan:
+                        manifest.forget(self.png_output(spec["output"], frame))
+                    manifest.save()
+            if pooled:
+                temp_dir = tempfile.mkdtemp()
+                outputs = [os.path.join(temp_dir, f"frame_{i:04d}.png") for i in range(len(plan))]
+                self.render_plan_in_pool(plan, communes_layer, global_extent, outputs, workers, progress_callback, 50, preset)
+                for i, frame in enumerate(plan):
+                    self.check_canceled()
+                    write_frame(i, frame, QImage(outputs[i]))
+                    if progress_callback:
+                        progress_callback(50 + int(((i + 1) / len(plan)) * 45))
+            else:
+                self.render_plan(plan, session, communes_layer, write_frame,
+                                 progress_callback, 95, layers_for_frame, cumulative)
+            for sink in sink_objects:
+                sink.close()
+            if progress_callback:
+                progress_callback(100)
+            print(f"Export combiné terminé: {len(plan)} frames rendues une fois pour {len(sink_objects)} sorties")
+            return True
+        except ExportCanceledVisualisationConstats:
+            print("Export combiné annulé")
+            raise
+        except Exception as e:
+            self.notify(dialog, "Erreur", self.video_error_message(e, "combiné"), critical=True)
+            if dialog is None:
+                raise
+            return False
+        finally:
+            # Vidéos non terminées : ffmpeg arrêté et fichier incomplet supprimé
+            for sink in sink_objects:
+                sink.abort()
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def record_variants(self, layers, variants, output_dir, kind, species_codes, conclusion_codes, workers=1,
+                        preset="final", encoding=None, cumulative=False, communes_layer=None, overlays=None):
+        """Exporte une animation par variante de filtre en une seule session de rendu.
+
+        variants : [{"name", "species": [codes], "conclusions": [codes]}], une liste de codes vide ne filtrant pas.
+        kind vaut "png" (un sous-dossier par variante) ou "video" (un fichier par variante dans output_dir).
+        Le plan de frames, le layout et le fond de carte sont partagés ; seul le filtre des couches de constats change.
+        Avec workers > 1 (ou self.pooled), les frames de toutes les variantes sont réparties dans un même pool.
+        overlays : couches d'analyse filtrées à chaque frame, communes à toutes les variantes.
+        Les filtres des couches sont modifiés : à appeler sur des copies (tâche d'export).
+        """
+        communes_layer, global_extent = self.prepare_export(layers, None, output_dir,
+                                                            "Veuillez choisir un dossier de sortie.", communes_layer)
+        if not communes_layer or not variants:
+            return False
+        # Filtre courant retiré : chaque variante applique le sien
+        for _, _, layer in layers:
+            layer.setSubsetString("")
+        filter_engine = FilterEngineVisualisationConstats()
+        filter_engine.build([layer for _, _, layer in layers], species_codes, conclusion_codes)
+        plan = self.add_frame_overlays(self.build_frame_plan(layers, cumulative), overlays, cumulative)
+        outputs = []
+        for variant in variants:
+            slug = variant_slug(variant["name"])
+            if kind == "png":
+                outputs.append(os.path.join(output_dir, slug))
+            else:
+                outputs.append(os.path.join(output_dir, f"animation_constats_loup_{slug}.{encoding_extension(encoding)}"))
+        if self.uses_pool(workers):
+            self.record_variants_in_pool(plan, variants, outputs, kind, filter_engine, communes_layer, global_extent,
+                                         workers, preset, encoding)
+            return True
+
+        on_frame, on_encode = self.on_frame, self.on_encode
+        total = len(variants) * len(plan)
+        try:
+            for v, variant in enumerate(variants):
+                filter_engine.compute(variant["species"], variant["conclusions"])
+                filter_engine.apply_all()
+                variant_plan = self.variant_plan(plan, variant["name"], filter_engine)
+                offset = v * len(plan)
+                # Progression ramenée à l'ensemble des variantes (frames à jour d'un export PNG comptées comme faites)
+                if on_frame:
+                    self.on_frame = lambda done, count: on_frame(offset + len(plan) - count + done, total)
+                if on_encode:
+                    self.on_encode = lambda fraction: on_encode((v + fraction) / len(variants))
+                print(f"Variante {v + 1}/{len(variants)} : {variant['name']} -> {outputs[v]}")
+                if kind == "png":
+                    os.makedirs(outputs[v], exist_ok=True)
+                    self.record_animation_to_png(layers, None, outputs[v], preset=preset, cumulative=cumulative,
+                                                 communes_layer=communes_layer, plan=variant_plan)
+                else:
+                    self.record_animation_to_mp4(layers, None, outputs[v], preset=preset, encoding=encoding,
+                                                 cumulative=cumulative, communes_layer=communes_layer, plan=variant_plan)
+        finally:
+            self.on_frame, self.on_encode = on_frame, on_encode
+        if self.session:
+            print(f"Export des variantes terminé: {len(variants)} variantes, rendus du fond de carte: {self.session.basemap.renders}")
+        else:
+            # Toutes les images PNG étaient à jour : aucune session ouverte
+            print(f"Export des variantes terminé: {len(variants)} variantes, aucune frame à rendre")
+        return True
+
+    def record_variants_in_pool(self, plan, variants, outputs, kind, filter_engine, communes_layer, extent, workers,
+                                preset, encoding):
+        """Rend les frames de toutes les variantes dans un seul pool, puis encode les vidéos en parallèle."""
+        # Couches écrites une fois sans filtre : chaque frame porte l'expression de sa variante
+        filter_engine.compute([], [])
+        filter_engine.apply_all()
+        temp_dir = tempfile.mkdtemp() if kind == "video" else None
+        encoders = []
+        try:
+            pool_plan, pool_outputs, frame_dirs = [], [], []
+            for v, variant in enumerate(variants):
+                filter_engine.compute(variant["species"], variant["conclusions"])
+                frame_dir = outputs[v] if kind == "png" else os.path.join(temp_dir, f"variante_{v:02d}")
+                os.makedirs(frame_dir, exist_ok=True)
+                frame_dirs.append(frame_dir)
+                for frame in self.variant_plan(plan, variant["name"], filter_engine):
+                    pool_plan.append(frame)
+                    if kind == "png":
+                        pool_outputs.append(self.png_output(frame_dir, frame))
+                    else:
+                        pool_outputs.append(os.path.join(frame_dir, f"frame_{frame['index']:04d}.png"))
+            if kind == "png":
+                # Images réécrites hors manifeste : elles seront revérifiées par le prochain export séquentiel
+                for frame_dir in frame_dirs:
+                    manifest = ExportManifestVisualisationConstats(frame_dir)
+                    for frame in plan:
+                        manifest.forget(self.png_output(frame_dir, frame))
+                    manifest.save()
+            self.render_plan_in_pool(pool_plan, communes_layer, extent, pool_outputs, workers, preset=preset)
+            if kind == "png":
+                return
+
+            # Un ffmpeg par variante, lancés en parallèle sur les séquences déjà rendues
+            fractions = [0.0] * len(variants)
+
+            def encode(v):
+                encoder = encoders[v]
+
+                def progress(fraction):
+                    fractions[v] = fraction
+                    if self.on_encode:
+                        self.on_encode(sum(fractions) / len(fractions))
+                encoder.on_progress = progress
+                encoder.encode_images(os.path.join(frame_dirs[v], "frame_%04d.png"), frame_dirs[v])
+
+            for output in outputs:
+                encoder = FfmpegPipeEncoderVisualisationConstats(output, encoding)
+                encoder.total_frames = len(plan)
+                encoder.is_canceled = self.is_canceled
+                encoders.append(encoder)
+            with ThreadPoolExecutor(max_workers=min(workers, len(variants))) as executor:
+                list(executor.map(encode, range(len(variants))))
+        finally:
+            for encoder in encoders:
+                encoder.abort()
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,73 @@
+# basemap_cache_visualisation_constats.py
+from qgis.core import QgsMapRendererCustomPainterJob
+from PyQt5.QtGui import QImage, QPainter, QColor
+
+
+class BasemapCacheVisualisationConstats:
+    """Raster des couches de fond (Communes) rendu une fois par emprise, taille, résolution et style.
+
+    L'image est invalidée quand le style, le rendu, le filtre ou le contenu affiché d'une couche change.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.image = None
+        self.layers = []
+        self.renders = 0
+
+    def watch(self, layers):
+        """Surveille les couches du fond pour invalider l'image."""
+        for layer in self.layers:
+            for signal in self.layer_signals(layer):
+                try:
+                    signal.disconnect(self.invalidate)
+                except TypeError:
+                    pass
+        self.layers = list(layers)
+        for layer in self.layers:
+            for signal in self.layer_signals(layer):
+                signal.connect(self.invalidate)
+
+    def layer_signals(self, layer):
+        signals = [layer.styleChanged, layer.repaintRequested]
+        # rendererChanged et subsetStringChanged n'existent que sur les couches vecteur
+        for name in ("rendererChanged", "subsetStringChanged"):
+            if hasattr(layer, name):
+                signals.append(getattr(layer, name))
+        return signals
+
+    def invalidate(self, *args):
+        self.image = None
+
+    def cache_key(self, settings):
+        size = settings.outputSize()
+        return (
+            tuple(layer.id() for layer in settings.layers()),
+            settings.extent().toString(),
+            settings.destinationCrs().authid(),
+            (size.width(), size.height()),
+            round(settings.outputDpi(), 3),
+            settings.backgroundColor().name(QColor.HexArgb)
+        )
+
+    def get(self, settings):
+        """Retourne l'image des couches de settings, rendue seulement si la clé ou le style a changé."""
+        key = self.cache_key(settings)
+        if self.image is not None and key == self.key:
+            return self.image
+        if [layer.id() for layer in self.layers] != list(key[0]):
+            self.watch(settings.layers())
+        size = settings.outputSize()
+        image = QImage(size.width(), size.height(), QImage.Format_ARGB32_Premultiplied)
+        image.fill(settings.backgroundColor())
+        painter = QPainter(image)
+        try:
+            job = QgsMapRendererCustomPainterJob(settings, painter)
+            job.renderSynchronously()
+        finally:
+            painter.end()
+        self.image = image
+        self.key = key
+        self.renders += 1
+        print(f"Fond de carte rendu: {', '.join(layer.name() for layer in self.layers)} ({size.width()}x{size.height()} px)")
+        return image
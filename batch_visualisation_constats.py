@@ -0,0 +1,193 @@
+# batch_visualisation_constats.py
+from qgis.core import QgsProject
+import json
+import os
+import time
+import traceback
+from .data_processor_visualisation_constats import DataProcessorVisualisationConstats
+from .layer_manager_visualisation_constats import LayerManagerVisualisationConstats
+from .animation_exporter_visualisation_constats import AnimationExporterVisualisationConstats
+from .filter_engine_visualisation_constats import FilterEngineVisualisationConstats
+from .encoder_visualisation_constats import encoding_extension
+from .utils_visualisation_constats import generate_crosstab_data, write_crosstab_to_csv, normalize_string
+
+# Clés facultatives du fichier de configuration et leurs valeurs par défaut ("ods", "shp" et "output_dir" sont obligatoires)
+DEFAULT_BATCH_CONFIG = {
+    "departements": ["21"],
+    "especes": [],
+    "conclusions": [],
+    "crosstab": True,
+    "png": {"enabled": True, "cumulative": False, "start_year": None, "preset": "final", "workers": 1},
+    "video": {"enabled": True, "cumulative": False, "start_year": None, "preset": "final", "workers": 1, "encoding": {}},
+}
+
+
+def load_batch_config(path):
+    """Lit la configuration JSON ; les chemins relatifs le sont au dossier du fichier.
+
+    Une section d'export ("png", "video") à false ou null désactive l'étape ; à true, elle garde ses valeurs par défaut.
+    """
+    with open(path, encoding='utf-8') as f:
+        user_config = json.load(f)
+    config = {}
+    for key, default in DEFAULT_BATCH_CONFIG.items():
+        value = user_config.get(key, default)
+        if isinstance(default, dict):
+            if value is None or value is False:
+                value = {"enabled": False}
+            elif value is True:
+                value = {}
+            elif not isinstance(value, dict):
+                raise ValueError(f"Section '{key}' invalide dans {path} : objet, true, false ou null attendu")
+            value = dict(default, **value)
+        config[key] = value
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for key in ("ods", "shp", "output_dir"):
+        if not user_config.get(key):
+            raise ValueError(f"Clé '{key}' manquante dans {path}")
+        config[key] = os.path.join(base_dir, user_config[key])
+    return config
+
+
+class BatchRunnerVisualisationConstats:
+    """Chaîne complète sans interface : chargement, jointure, regroupement, couches, TCD et exports.
+
+    Reprend les étapes de run_processing du dialogue et affiche la durée de chacune.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.data_processor = DataProcessorVisualisationConstats()
+        self.layer_manager = LayerManagerVisualisationConstats(None)
+        self.animation_exporter = AnimationExporterVisualisationConstats(None)
+        self.filter_engine = FilterEngineVisualisationConstats()
+        self.timings = []
+
+    def stage(self, name, func, *args):
+        """Exécute une étape et mémorise sa durée."""
+        print(f"--- Étape {name}")
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        self.timings.append((name, elapsed))
+        print(f"--- Étape {name} terminée en {elapsed:.2f} s")
+        return result
+
+    def selected_codes(self):
+        """Traduit les espèces et conclusions de la configuration en codes du moteur de filtre."""
+        species_codes = self.layer_manager.species_codes
+        selected_species = [species_codes[s] for s in self.config["especes"] if s in species_codes]
+        wanted = {normalize_string(c) for c in self.config["conclusions"]}
+        selected_conclusions = [code for conclusion, code in self.layer_manager.conclusion_codes.items()
+                                if normalize_string(conclusion) in wanted]
+        return selected_species, selected_conclusions
+
+    def export_layers(self, layers, settings):
+        layers = sorted(layers, key=lambda x: (x[0], x[1]))
+        if settings["cumulative"] and settings["start_year"] is not None:
+            layers = [(y, m, l) for y, m, l in layers if y >= int(settings["start_year"])]
+        return layers
+
+    def load(self):
+        ods_layer, communes_layer = self.data_processor.load_data(self.config["ods"], self.config["shp"])
+        if not ods_layer or not communes_layer:
+            raise RuntimeError("Couches ODS ou SHP non valides")
+        return ods_layer, communes_layer
+
+    def build_layers(self, temp_ods_layer, communes_layer, matched_features, data_by_month):
+        self.layer_manager.add_commune_layer(communes_layer)
+        layers = self.layer_manager.create_monthly_layers(temp_ods_layer, communes_layer, matched_features, data_by_month)
+        if not layers:
+            raise RuntimeError("Aucune couche mensuelle créée")
+        if not self.layer_manager.range_commune(communes_layer, self.config["departements"]):
+            raise RuntimeError("Filtre des communes par département impossible")
+        return layers
+
+    def apply_filters(self, layers):
+        self.filter_engine.build(
+            [layer for _, _, layer in layers],
+            self.layer_manager.species_codes,
+            self.layer_manager.conclusion_codes
+        )
+        self.filter_engine.compute(*self.selected_codes())
+        self.filter_engine.apply_all()
+
+    def export_crosstab(self, ods_layer):
+        output_path = os.path.join(self.config["output_dir"], "tableau_croise_dynamique.csv")
+        write_crosstab_to_csv(generate_crosstab_data(ods_layer), output_path)
+
+    def export_png(self, layers):
+        settings = self.config["png"]
+        output_dir = os.path.join(self.config["output_dir"], "png")
+        os.makedirs(output_dir, exist_ok=True)
+        if not self.animation_exporter.record_animation_to_png(
+                self.export_layers(layers, settings), None, output_dir, workers=settings["workers"],
+                preset=settings["preset"], cumulative=settings["cumulative"]):
+            raise RuntimeError("Export PNG non effectué")
+
+    def export_video(self, layers):
+        settings = self.config["video"]
+        encoding = settings["encoding"]
+        output_file = os.path.join(self.config["output_dir"], f"animation_constats_loup.{encoding_extension(encoding)}")
+        if not self.animation_exporter.record_animation_to_mp4(
+                self.export_layers(layers, settings), None, output_file, workers=settings["workers"],
+                preset=settings["preset"], encoding=encoding, cumulative=settings["cumulative"]):
+            raise RuntimeError("Export vidéo non effectué")
+
+    def export_combined(self, layers):
+        """Séquence PNG et vidéo produites par un seul rendu de chaque frame."""
+        png, video = self.config["png"], self.config["video"]
+        encoding = video["encoding"]
+        sinks = [
+            {"type": "png", "output": os.path.join(self.config["output_dir"], "png")},
+            {"type": "video", "encoding": encoding,
+             "output": os.path.join(self.config["output_dir"], f"animation_constats_loup.{encoding_extension(encoding)}")}
+        ]
+        if not self.animation_exporter.record_animation_to_sinks(
+                self.export_layers(layers, png), None, sinks, workers=png["workers"],
+                preset=png["preset"], cumulative=png["cumulative"]):
+            raise RuntimeError("Export PNG et vidéo non effectué")
+
+    def shares_render(self):
+        """Vrai si les exports PNG et vidéo demandés ont les mêmes frames : un seul rendu suffit."""
+        png, video = self.config["png"], self.config["video"]
+        keys = ("cumulative", "start_year", "preset", "workers")
+        return png["enabled"] and video["enabled"] and all(png[key] == video[key] for key in keys)
+
+    def run(self):
+        """Exécute toutes les étapes ; retourne 0 en cas de succès, 1 sinon."""
+        os.makedirs(self.config["output_dir"], exist_ok=True)
+        start = time.perf_counter()
+        try:
+            ods_layer, communes_layer = self.stage("chargement", self.load)
+            matched_features, unmatched_count, temp_ods_layer = self.stage(
+                "jointure", self.data_processor.process_data, ods_layer, communes_layer
+            )
+            if temp_ods_layer is None:
+                raise RuntimeError("Jointure des constats impossible")
+            print(f"Features appariées: {len(matched_features)}, non jointes: {unmatched_count}")
+            data_by_month = self.stage("regroupement", self.data_processor.group_data_by_month, temp_ods_layer)
+            if not data_by_month:
+                raise RuntimeError("Aucun groupe mensuel créé")
+            layers = self.stage("couches", self.build_layers, temp_ods_layer, communes_layer, matched_features, data_by_month)
+            self.stage("filtres", self.apply_filters, layers)
+            if self.config["crosstab"]:
+                self.stage("tableau croisé", self.export_crosstab, ods_layer)
+            if self.shares_render():
+                self.stage("export PNG + vidéo", self.export_combined, layers)
+            else:
+                if self.config["png"]["enabled"]:
+                    self.stage("export PNG", self.export_png, layers)
+                if self.config["video"]["enabled"]:
+                    self.stage("export vidéo", self.export_video, layers)
+            return 0
+        except Exception as e:
+            print(f"ERREUR traitement en lot: {str(e)}")
+            traceback.print_exc()
+            return 1
+        finally:
+            print("Durées des étapes :")
+            for name, elapsed in self.timings:
+                print(f"  {name:<16} {elapsed:8.2f} s")
+            print(f"  {'total':<16} {time.perf_counter() - start:8.2f} s")
+            QgsProject.instance().clear()
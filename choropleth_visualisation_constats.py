@@ -0,0 +1,153 @@
+# choropleth_visualisation_constats.py
+from qgis.core import (
+    QgsField, QgsFillSymbol, QgsGraduatedSymbolRenderer, QgsRendererRange, QgsGradientColorRamp
+)
+from PyQt5.QtCore import QVariant
+from PyQt5.QtGui import QColor
+from .utils_visualisation_constats import normalize_elevage
+import numpy as np
+
+INSEE_FIELDS = ["INSEE", "CODE_INSEE", "code_insee", "INSEE_COM"]
+COUNT_FIELD = "nb_constats"
+
+
+class CommuneMatrixVisualisationConstats:
+    """Matrice dense communes × mois des constats appariés, pour le mode choroplèthe.
+
+    Chaque constat est codé une fois (ligne commune, colonne mois, espèce, conclusion) ;
+    la matrice filtrée est obtenue par un bincount et mise en cache par sélection,
+    les cumuls par somme préfixe sur l'axe des mois.
+    """
+
+    def __init__(self):
+        self.months = []
+        self.month_index = {}
+        self.insee_codes = []
+        self.insee_rows = {}
+        self.row_fids = np.zeros(0, dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int32)
+        self.columns = np.zeros(0, dtype=np.int32)
+        self.species = np.zeros(0, dtype=np.int16)
+        self.conclusions = np.zeros(0, dtype=np.int16)
+        self.cache = {}
+        self.selection = ((), ())
+        self.last_values = None
+        self.layer = None
+
+    def build(self, communes_layer, matched_features, data_by_month, species_codes, conclusion_codes):
+        """Code les constats appariés sur les lignes de la couche Communes et un axe de mois continu."""
+        self.layer = None
+        insee_field = next((f for f in INSEE_FIELDS if f in communes_layer.fields().names()), None)
+        if not insee_field or not data_by_month:
+            print("Matrice communes × mois non construite: champ INSEE ou données manquants")
+            return False
+        self.layer = communes_layer
+        self.insee_codes, self.insee_rows, fids = [], {}, []
+        for feature in communes_layer.getFeatures():
+            insee = str(feature[insee_field] or "")
+            if insee and insee not in self.insee_rows:
+                self.insee_rows[insee] = len(self.insee_codes)
+                self.insee_codes.append(insee)
+                fids.append(feature.id())
+        self.row_fids = np.asarray(fids, dtype=np.int64)
+        first, last = min(data_by_month), max(data_by_month)
+        self.months = []
+        year, month = first
+        while (year, month) <= last:
+            self.months.append((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        self.month_index = {key: i for i, key in enumerate(self.months)}
+        rows, columns, species, conclusions = [], [], [], []
+        for key, features in data_by_month.items():
+            for feature in features:
+                match = matched_features.get(feature.id())
+                if not match or match['insee'] not in self.insee_rows:
+                    continue
+                rows.append(self.insee_rows[match['insee']])
+                columns.append(self.month_index[key])
+                species.append(species_codes.get(normalize_elevage(str(feature["Elevage"] or "")), -1))
+                conclusions.append(conclusion_codes.get(str(feature["C_tech_new"] or ""), -1))
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.columns = np.asarray(columns, dtype=np.int32)
+        self.species = np.asarray(species, dtype=np.int16)
+        self.conclusions = np.asarray(conclusions, dtype=np.int16)
+        self.cache = {}
+        self.last_values = None
+        print(f"Matrice communes × mois: {len(self.insee_codes)} communes, {len(self.months)} mois, {len(self.rows)} constats")
+        return True
+
+    def set_selection(self, selected_species, selected_conclusions):
+        """Mémorise la sélection des filtres (listes vides = pas de contrainte)."""
+        self.selection = (tuple(sorted(selected_species)), tuple(sorted(selected_conclusions)))
+
+    def matrix(self, cumulative=False):
+        """Retourne la matrice (communes, mois) pour la sélection courante."""
+        key = self.selection + (cumulative,)
+        if key not in self.cache:
+            selected_species, selected_conclusions = self.selection
+            mask = np.ones(len(self.rows), dtype=bool)
+            if selected_species:
+                mask &= np.isin(self.species, selected_species)
+            if selected_conclusions:
+                mask &= np.isin(self.conclusions, selected_conclusions)
+            shape = (len(self.insee_codes), len(self.months))
+            flat = np.ravel_multi_index((self.rows[mask], self.columns[mask]), shape)
+            counts = np.bincount(flat, minlength=shape[0] * shape[1]).reshape(shape)
+            self.cache[key] = np.cumsum(counts, axis=1) if cumulative else counts
+        return self.cache[key]
+
+    def column(self, year, month, cumulative=False):
+        index = self.month_index.get((year, month))
+        if index is None:
+            return np.zeros(len(self.insee_codes), dtype=np.int64)
+        return self.matrix(cumulative)[:, index]
+
+    def prepare_layer(self, cumulative=False):
+        """Ajoute le champ nb_constats et applique un rendu gradué à classes fixes sur toute l'animation."""
+        layer = self.layer
+        if layer.fields().indexFromName(COUNT_FIELD) < 0:
+            layer.dataProvider().addAttributes([QgsField(COUNT_FIELD, QVariant.Int)])
+            layer.updateFields()
+            self.last_values = None
+        vmax = int(self.matrix(cumulative).max()) if len(self.months) else 0
+        layer.setRenderer(self.graduated_renderer(vmax))
+        layer.triggerRepaint()
+
+    def graduated_renderer(self, vmax):
+        ramp = QgsGradientColorRamp(QColor("#fff3b0"), QColor("darkred"))
+        zero_symbol = QgsFillSymbol.createSimple({
+            'color': 'transparent',
+            'outline_color': 'lightgrey',
+            'outline_width': '0.4'
+        })
+        ranges = [QgsRendererRange(-0.5, 0.5, zero_symbol, "0")]
+        if vmax > 0:
+            breaks = sorted(set(int(b) for b in np.ceil(np.geomspace(1, vmax + 1, min(vmax, 6) + 1))))
+            bounds = list(zip(breaks[:-1], [b - 1 for b in breaks[1:]]))
+            for i, (lower, upper) in enumerate(bounds):
+                symbol = QgsFillSymbol.createSimple({
+                    'color': ramp.color(i / max(1, len(bounds) - 1)).name(),
+                    'outline_color': 'grey',
+                    'outline_width': '0.4'
+                })
+                label = str(lower) if lower == upper else f"{lower} - {upper}"
+                ranges.append(QgsRendererRange(lower - 0.5, upper + 0.5, symbol, label))
+        return QgsGraduatedSymbolRenderer(COUNT_FIELD, ranges)
+
+    def update_layer(self, year, month, cumulative=False):
+        """Écrit en un seul lot les effectifs de la frame dans nb_constats (communes modifiées uniquement)."""
+        layer = self.layer
+        field_idx = layer.fields().indexFromName(COUNT_FIELD)
+        if field_idx < 0:
+            return
+        values = self.column(year, month, cumulative)
+        if self.last_values is None:
+            changed = np.arange(len(values))
+        else:
+            changed = np.flatnonzero(values != self.last_values)
+        if len(changed):
+            layer.dataProvider().changeAttributeValues(
+                {int(self.row_fids[i]): {field_idx: int(values[i])} for i in changed}
+            )
+            layer.triggerRepaint()
+        self.last_values = values.copy()
@@ -0,0 +1,189 @@
+# clusters_visualisation_constats.py
+from qgis.core import (
+    QgsFeature, QgsFeatureRequest, QgsField, QgsFillSymbol, QgsGeometry, QgsPointXY, QgsProject,
+    QgsSingleSymbolRenderer, QgsVectorLayer
+)
+from PyQt5.QtCore import QVariant
+from collections import deque
+import datetime
+import numpy as np
+from .layer_manager_visualisation_constats import LayerManagerVisualisationConstats
+from .utils_visualisation_constats import DATE_FIELDS, parse_date
+
+CLUSTER_LAYER_NAME = "Foyers spatio-temporels"
+# Voisinage par défaut : distance (km), écart de dates (jours), effectif minimal d'un noyau
+CLUSTER_DISTANCE_KM = 10.0
+CLUSTER_DAYS = 30
+CLUSTER_MIN_CONSTATS = 3
+
+
+def st_dbscan(x, y, t, eps_space, eps_time, min_points):
+    """ST-DBSCAN : numéro de foyer de chaque point (-1 : isolé).
+
+    Deux points sont voisins s'ils sont à moins de eps_space et eps_time. Les voisins sont cherchés
+    dans les 9 cellules (de côté eps_space) autour du point, où les points sont triés par date :
+    une recherche dichotomique donne la fenêtre temporelle, sans comparer toutes les paires.
+    """
+    n = len(x)
+    cell_x = np.floor(x / eps_space).astype(np.int64)
+    cell_y = np.floor(y / eps_space).astype(np.int64)
+    grid = {}
+    order = np.lexsort((t, cell_y, cell_x))
+    keys = np.stack((cell_x[order], cell_y[order]), axis=1)
+    bounds = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+    for members in np.split(order, bounds):
+        if len(members):
+            grid[(int(cell_x[members[0]]), int(cell_y[members[0]]))] = (members, t[members])
+
+    def neighbours(i):
+        found = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                bucket = grid.get((int(cell_x[i]) + dx, int(cell_y[i]) + dy))
+                if bucket is None:
+                    continue
+                members, times = bucket
+                lo = np.searchsorted(times, t[i] - eps_time, side="left")
+                hi = np.searchsorted(times, t[i] + eps_time, side="right")
+                candidates = members[lo:hi]
+                close = (x[candidates] - x[i]) ** 2 + (y[candidates] - y[i]) ** 2 <= eps_space ** 2
+                found.append(candidates[close])
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+    unvisited, noise = -2, -1
+    labels = np.full(n, unvisited, dtype=np.int64)
+    cluster = 0
+    for i in range(n):
+        if labels[i] != unvisited:
+            continue
+        seeds = neighbours(i)
+        if len(seeds) < min_points:
+            labels[i] = noise
+            continue
+        labels[i] = cluster
+        queue = deque(seeds)
+        while queue:
+            j = queue.popleft()
+            if labels[j] == noise:
+                labels[j] = cluster
+            if labels[j] != unvisited:
+                continue
+            labels[j] = cluster
+            expansion = neighbours(j)
+            if len(expansion) >= min_points:
+                queue.extend(expansion)
+        cluster += 1
+    return labels
+
+
+def month_key(year, month):
+    return year * 100 + month
+
+
+class SpaceTimeClustersVisualisationConstats:
+    """Foyers de constats proches dans l'espace et dans le temps, détectés sur les constats placés.
+
+    Chaque foyer est une emprise (enveloppe convexe élargie) avec ses mois de début et de fin ;
+    la couche est filtrée à chaque frame pour n'afficher que les foyers actifs (ou apparus, en mode cumulé).
+    """
+
+    def __init__(self):
+        self.layer = None
+        self.applied = None
+
+    def read_constats(self, layers, expression=""):
+        """Coordonnées et date (jour) des constats des couches mensuelles retenus par l'expression de filtre."""
+        xs, ys, days = [], [], []
+        for year, month, layer in layers:
+            if not layer:
+                continue
+            date_fields = [f for f in DATE_FIELDS if f in layer.fields().names()]
+            request = QgsFeatureRequest()
+            if expression:
+                request.setFilterExpression(expression)
+            fallback = datetime.date(year, month, 15).toordinal()
+            for feature in layer.dataProvider().getFeatures(request):
+                geometry = feature.geometry()
+                if geometry.isEmpty():
+                    continue
+                point = geometry.asPoint()
+                date = None
+                for field in date_fields:
+                    date = parse_date(str(feature[field] or "").strip())
+                    if date:
+                        break
+                xs.append(point.x())
+                ys.append(point.y())
+                days.append(date.toordinal() if date else fallback)
+        return np.asarray(xs), np.asarray(ys), np.asarray(days, dtype=np.int64)
+
+    def detect(self, layers, expression="", distance_km=CLUSTER_DISTANCE_KM, days=CLUSTER_DAYS,
+               min_constats=CLUSTER_MIN_CONSTATS):
+        """Détecte les foyers et remplit la couche des foyers ; retourne le nombre de foyers."""
+        valid = [(y, m, l) for y, m, l in layers if l and l.isValid()]
+        if not valid:
+            return 0
+        crs = valid[0][2].crs()
+        x, y, t = self.read_constats(valid, expression)
+        # Distance en unités de carte (approximation pour les systèmes géographiques)
+        eps = distance_km / 111.32 if crs.isGeographic() else distance_km * 1000
+        labels = st_dbscan(x, y, t, eps, days, min_constats) if len(x) else np.zeros(0, dtype=np.int64)
+        layer = self.ensure_layer(crs)
+        provider = layer.dataProvider()
+        provider.truncate()
+        features = []
+        for cluster in range(int(labels.max()) + 1 if len(labels) else 0):
+            members = np.flatnonzero(labels == cluster)
+            points = [QgsPointXY(x[i], y[i]) for i in members]
+            hull = QgsGeometry.fromMultiPointXY(points).convexHull().buffer(eps / 5, 8)
+            start = datetime.date.fromordinal(int(t[members].min()))
+            end = datetime.date.fromordinal(int(t[members].max()))
+            feature = QgsFeature(layer.fields())
+            feature.setGeometry(hull)
+            feature.setAttributes([
+                cluster + 1, len(members), start.isoformat(), end.isoformat(),
+                month_key(start.year, start.month), month_key(end.year, end.month)
+            ])
+            features.append(feature)
+        provider.addFeatures(features)
+        layer.updateExtents()
+        self.applied = None
+        layer.setSubsetString("")
+        layer.triggerRepaint()
+        print(f"Foyers spatio-temporels: {len(features)} foyers, {int((labels >= 0).sum())} constats sur {len(labels)}")
+        return len(features)
+
+    def ensure_layer(self, crs):
+        """Couche mémoire des foyers, ajoutée au projet au premier appel."""
+        if self.layer is not None and QgsProject.instance().mapLayer(self.layer.id()):
+            return self.layer
+        layer = QgsVectorLayer(f"Polygon?crs={crs.authid()}", CLUSTER_LAYER_NAME, "memory")
+        layer.dataProvider().addAttributes([
+            QgsField("foyer", QVariant.Int),
+            QgsField("nb_constats", QVariant.Int),
+            QgsField("debut", QVariant.String),
+            QgsField("fin", QVariant.String),
+            QgsField("mois_debut", QVariant.Int),
+            QgsField("mois_fin", QVariant.Int),
+        ])
+        layer.updateFields()
+        layer.setRenderer(QgsSingleSymbolRenderer(QgsFillSymbol.createSimple({
+            'color': '255,0,0,60',
+            'outline_color': 'red',
+            'outline_width': '0.8'
+        })))
+        self.layer = LayerManagerVisualisationConstats.add_overlay_layer(layer)
+        return layer
+
+    def frame_expression(self, year, month, cumulative=False):
+        """Filtre des foyers actifs au mois de la frame (apparus depuis le début en mode cumulé)."""
+        key = month_key(year, month)
+        return f'"mois_debut" <= {key}' if cumulative else f'"mois_debut" <= {key} AND "mois_fin" >= {key}'
+
+    def update_frame(self, year, month, cumulative=False):
+        """Filtre la couche sur les foyers de la frame (voir frame_expression)."""
+        if self.layer is None:
+            return None
+        expression = self.frame_expression(year, month, cumulative)
+        self.applied = LayerManagerVisualisationConstats.apply_frame_filter(self.layer, expression, self.applied)
+        return self.layer
@@ -69,13 +69,22 @@ class DataProcessorVisualisationConstats:
         # QMessageBox.information(self, "Dictionnaire des communes créé:", str(dict_communes))
         return dict_communes
 
-    def match_ods_features(self, ods_layer, shp_layer):
-        """Effectue la jointure floue."""
+    def match_ods_features(self, ods_layer, shp_layer, progress_callback=None, is_canceled=None):
+        """Effectue la jointure floue.
+
+        progress_callback(pourcentage) suit l'avancement ; retourne (None, None) si is_canceled() devient vrai.
+        """
         dict_communes = self.prepare_dict_communes(shp_layer)
         dico_test = {}
         matched = {}
         unmatched = []
-        for feature in ods_layer.getFeatures():
+        total = max(1, ods_layer.featureCount())
+        for i, feature in enumerate(ods_layer.getFeatures()):
+            if is_canceled and is_canceled():
+                print("Jointure floue annulée")
+                return None, None
+            if progress_callback:
+                progress_callback(i * 100 / total)
             try:
                 commune_fields = ["commune", "Commune", "COMMUNE"]
                 commune_name = ""
@@ -121,7 +130,8 @@ class DataProcessorVisualisationConstats:
         return 0, "Aucun constat non joint trouvé."
 
 
-    def process_data(self, ods_layer, shp_layer):
+    def process_data(self, ods_layer, shp_layer, progress_callback=None, is_canceled=None):
+        """Standardise la couche ODS puis la joint aux communes ; retourne ({}, 0, None) en cas d'erreur ou d'annulation."""
         try:
             # Créer une copie en mémoire de la couche ODS pour standardiser les champs
             temp_ods_layer = QgsVectorLayer(
@@ -142,6 +152,9 @@ class DataProcessorVisualisationConstats:
             # Standardiser les champs dans la couche temporaire
             temp_ods_layer.startEditing()
             for feature in ods_layer.getFeatures():
+                if is_canceled and is_canceled():
+                    temp_ods_layer.rollBack()
+                    return {}, 0, None
                 new_feature = QgsFeature(temp_ods_layer.fields())
                 new_feature.setAttributes(feature.attributes() + [None])
 
@@ -180,7 +193,9 @@ class DataProcessorVisualisationConstats:
             dict_communes = self.prepare_dict_communes(shp_layer)
 
             # Effectuer la jointure floue sur la couche temporaire
-            matched, unmatched = self.match_ods_features(temp_ods_layer, shp_layer)
+            matched, unmatched = self.match_ods_features(temp_ods_layer, shp_layer, progress_callback, is_canceled)
+            if matched is None:
+                return {}, 0, None
             unmatched_count, unmatched_message = self.create_unmatched_report(unmatched)
 
             # Retourner la couche temporaire
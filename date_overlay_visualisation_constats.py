@@ -0,0 +1,48 @@
+# date_overlay_visualisation_constats.py
+from qgis.gui import QgsMapCanvasItem
+from PyQt5.QtCore import QRectF, QPointF
+from PyQt5.QtGui import QPainter, QPainterPath, QPen, QColor, QFont, QFontMetricsF
+
+
+class DateOverlayCanvasItemVisualisationConstats(QgsMapCanvasItem):
+    """Date de la frame affichée en haut à gauche du canevas, indépendamment de l'emprise.
+
+    Remplace la couche Dates : changer de frame ne fait que modifier le texte, sans moteur d'étiquetage.
+    """
+
+    def __init__(self, canvas, margin=12):
+        super().__init__(canvas)
+        self.canvas = canvas
+        self.margin = margin
+        self.text = ""
+        self.font = QFont("Arial", 16, QFont.Bold)
+        self.setZValue(110)
+        self.updatePosition()
+
+    def set_text(self, text):
+        if text != self.text:
+            self.prepareGeometryChange()
+            self.text = text
+            self.update()
+
+    def updatePosition(self):
+        # Position fixe dans le viewport : la scène du canevas est en pixels écran
+        self.setPos(QPointF(self.margin, self.margin))
+
+    def boundingRect(self):
+        metrics = QFontMetricsF(self.font)
+        return QRectF(-4, -4, metrics.width(self.text) + 8, metrics.height() + 8)
+
+    def paint(self, painter, option=None, widget=None):
+        if not self.text:
+            return
+        painter.setRenderHint(QPainter.Antialiasing, True)
+        path = QPainterPath()
+        path.addText(QPointF(0, QFontMetricsF(self.font).ascent()), self.font, self.text)
+        # Tampon blanc autour du texte rouge, comme l'ancienne étiquette de la couche Dates
+        painter.strokePath(path, QPen(QColor("white"), 4))
+        painter.fillPath(path, QColor("red"))
+
+    def remove(self):
+        if self.scene():
+            self.scene().removeItem(self)
@@ -0,0 +1,215 @@
+# density_visualisation_constats.py
+from qgis.core import (
+    QgsColorRampShader, QgsFeatureRequest, QgsProject, QgsRasterLayer, QgsRasterShader,
+    QgsSingleBandPseudoColorRenderer
+)
+from PyQt5.QtGui import QColor
+from osgeo import gdal
+import numpy as np
+from .layer_manager_visualisation_constats import LayerManagerVisualisationConstats
+
+DENSITY_LAYER_NAME = "Densité des constats"
+# Nombre de cellules sur le plus grand côté de l'emprise des Communes
+DENSITY_GRID_SIZE = 256
+# Rayon de lissage par défaut (écart-type du noyau gaussien, en km)
+DENSITY_BANDWIDTH_KM = 5.0
+# Nombre de mois convolués par lot (borne la mémoire des FFT)
+DENSITY_BATCH = 24
+DENSITY_COLORS = ["#fff3b0", "#fdae61", "#e34a33", "darkred"]
+
+
+def gaussian_kernel(sigma):
+    """Noyau gaussien normalisé, tronqué à 3 écarts-types (sigma en cellules)."""
+    radius = max(1, int(np.ceil(3 * sigma)))
+    axis = np.arange(-radius, radius + 1)
+    kernel = np.exp(-(axis[:, None] ** 2 + axis[None, :] ** 2) / (2 * sigma ** 2))
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def fft_convolve(grids, kernel):
+    """Convolution de chaque grille (mois, lignes, colonnes) par le noyau, par FFT, de même taille que les grilles."""
+    radius = kernel.shape[0] // 2
+    shape = (grids.shape[1] + 2 * radius, grids.shape[2] + 2 * radius)
+    spectrum = np.fft.rfft2(kernel, s=shape)
+    result = np.fft.irfft2(np.fft.rfft2(grids, s=shape) * spectrum, s=shape)
+    return result[:, radius:radius + grids.shape[1], radius:radius + grids.shape[2]].astype(np.float32)
+
+
+class DensityGridVisualisationConstats:
+    """Surface de densité lissée des constats appariés, pour le mode densité.
+
+    Les effectifs communes × mois de la matrice du mode choroplèthe (filtres courants compris) sont
+    portés au point représentatif de chaque commune sur une grille régulière couvrant les Communes,
+    lissés par un noyau gaussien (convolution FFT de tous les mois par lots), puis exprimés en constats
+    par km². Les grilles sont mises en cache par sélection ; chaque frame est un GeoTIFF en mémoire
+    (/vsimem) affiché par une unique couche raster, avec une rampe de couleurs commune à l'animation.
+    Seules les grilles et GeoTIFF de la sélection courante sont conservés.
+    """
+
+    def __init__(self, commune_matrix):
+        self.commune_matrix = commune_matrix
+        self.bandwidth_km = DENSITY_BANDWIDTH_KM
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.shape = (0, 0)
+        self.geotransform = None
+        self.crs = None
+        self.cell_area_km2 = 1.0
+        self.sigma = 1.0
+        self.cache = {}
+        self.maxima = {}
+        self.files = {}
+        self.file_count = 0
+        self.cached_selection = None
+        self.layer = None
+        self.current = None
+
+    def build(self):
+        """Calcule la grille sur l'emprise des Communes et la cellule du point représentatif de chaque commune."""
+        self.clear_files()
+        communes = self.commune_matrix.layer
+        if communes is None or not len(self.commune_matrix.insee_codes):
+            print("Grille de densité non construite: matrice communes × mois absente")
+            return False
+        extent = communes.extent()
+        cell = max(extent.width(), extent.height()) / DENSITY_GRID_SIZE
+        if cell <= 0:
+            return False
+        self.shape = (int(np.ceil(extent.height() / cell)) or 1, int(np.ceil(extent.width() / cell)) or 1)
+        self.geotransform = (extent.xMinimum(), cell, 0, extent.yMaximum(), 0, -cell)
+        self.crs = communes.crs()
+        # Longueur d'une unité de carte en km (approximation pour les systèmes géographiques)
+        unit_km = 111.32 if self.crs.isGeographic() else 0.001
+        self.cell_area_km2 = (cell * unit_km) ** 2
+        self.sigma = max(0.5, self.bandwidth_km / (cell * unit_km))
+        fid_rows = {int(fid): row for row, fid in enumerate(self.commune_matrix.row_fids)}
+        self.cells = np.full(len(fid_rows), -1, dtype=np.int64)
+        request = QgsFeatureRequest().setFilterFids(list(fid_rows))
+        for feature in communes.getFeatures(request):
+            geometry = feature.geometry()
+            if geometry.isEmpty():
+                continue
+            point = geometry.pointOnSurface().asPoint()
+            column = min(int((point.x() - extent.xMinimum()) / cell), self.shape[1] - 1)
+            row = min(int((extent.yMaximum() - point.y()) / cell), self.shape[0] - 1)
+            self.cells[fid_rows[feature.id()]] = row * self.shape[1] + column
+        print(f"Grille de densité: {self.shape[1]} × {self.shape[0]} cellules, noyau σ = {self.sigma:.1f} cellules")
+        return True
+
+    def set_bandwidth(self, bandwidth_km):
+        """Change le rayon de lissage : les grilles en cache sont recalculées à la demande."""
+        self.bandwidth_km = bandwidth_km
+        if self.commune_matrix.layer is not None:
+            self.build()
+
+    def evict_other_selections(self):
+        """Libère les grilles et GeoTIFF des sélections précédentes quand les filtres changent."""
+        selection = self.commune_matrix.selection
+        if selection == self.cached_selection:
+            return
+        self.cached_selection = selection
+        size = len(selection)
+        for key in [key for key in self.files if key[:size] != selection]:
+            path = self.files.pop(key)
+            # La frame affichée est libérée quand la couche passe à une autre (update_layer)
+            if path != self.current:
+                gdal.Unlink(path)
+        self.cache = {key: value for key, value in self.cache.items() if key[:size] == selection}
+        self.maxima = {key: value for key, value in self.maxima.items() if key[:size] == selection}
+
+    def grids(self, cumulative=False):
+        """Densités (mois, lignes, colonnes) en constats par km² pour la sélection courante."""
+        self.evict_other_selections()
+        key = self.commune_matrix.selection + (cumulative,)
+        if key not in self.cache:
+            if cumulative:
+                self.cache[key] = np.cumsum(self.grids(False), axis=0, dtype=np.float32)
+            else:
+                counts = self.commune_matrix.matrix()
+                valid = self.cells >= 0
+                cells, inverse = np.unique(self.cells[valid], return_inverse=True)
+                per_cell = np.zeros((len(cells), counts.shape[1]), dtype=np.float32)
+                np.add.at(per_cell, inverse, counts[valid].astype(np.float32))
+                kernel = gaussian_kernel(self.sigma)
+                result = np.zeros((counts.shape[1],) + self.shape, dtype=np.float32)
+                for start in range(0, counts.shape[1], DENSITY_BATCH):
+                    months = per_cell[:, start:start + DENSITY_BATCH]
+                    batch = np.zeros((months.shape[1], self.shape[0] * self.shape[1]), dtype=np.float32)
+                    batch[:, cells] = months.T
+                    result[start:start + len(batch)] = fft_convolve(batch.reshape((-1,) + self.shape), kernel)
+                # Les résidus d'arrondi de la FFT ne doivent pas colorer les zones sans constat
+                result[result < 1e-6] = 0
+                self.cache[key] = result / self.cell_area_km2
+        return self.cache[key]
+
+    def frame_file(self, year, month, cumulative=False):
+        """Chemin /vsimem du GeoTIFF de la frame, écrit au premier appel."""
+        self.evict_other_selections()
+        index = self.commune_matrix.month_index.get((year, month))
+        key = self.commune_matrix.selection + (cumulative, index)
+        if key not in self.files:
+            self.file_count += 1
+            path = f"/vsimem/densite_constats_{self.file_count}.tif"
+            grid = self.grids(cumulative)[index] if index is not None else np.zeros(self.shape, dtype=np.float32)
+            dataset = gdal.GetDriverByName("GTiff").Create(path, self.shape[1], self.shape[0], 1, gdal.GDT_Float32)
+            dataset.SetGeoTransform(self.geotransform)
+            dataset.SetProjection(self.crs.toWkt())
+            dataset.GetRasterBand(1).WriteArray(grid)
+            dataset.FlushCache()
+            dataset = None
+            self.files[key] = path
+        return self.files[key]
+
+    def renderer(self, vmax):
+        """Rampe de couleurs fixe de 0 à vmax (densité nulle transparente)."""
+        items = [QgsColorRampShader.ColorRampItem(0, QColor(0, 0, 0, 0), "0")]
+        for i, color in enumerate(DENSITY_COLORS):
+            value = vmax * (i + 1) / len(DENSITY_COLORS)
+            items.append(QgsColorRampShader.ColorRampItem(value, QColor(color), f"{value:.2f}"))
+        ramp = QgsColorRampShader(0, vmax)
+        ramp.setColorRampType(QgsColorRampShader.Interpolated)
+        ramp.setColorRampItemList(items)
+        shader = QgsRasterShader()
+        shader.setRasterShaderFunction(ramp)
+        renderer = QgsSingleBandPseudoColorRenderer(None, 1, shader)
+        renderer.setClassificationMin(0)
+        renderer.setClassificationMax(vmax)
+        return renderer
+
+    def update_layer(self, year, month, cumulative=False):
+        """Affiche la frame dans la couche raster de densité (créée au premier appel)."""
+        path = self.frame_file(year, month, cumulative)
+        key = self.commune_matrix.selection + (cumulative,)
+        if key not in self.maxima:
+            self.maxima[key] = float(self.grids(cumulative).max()) if self.commune_matrix.months else 0.0
+        vmax = self.maxima[key]
+        if self.layer is None:
+            self.layer = LayerManagerVisualisationConstats.add_overlay_layer(QgsRasterLayer(path, DENSITY_LAYER_NAME, "gdal"))
+        elif self.current != path:
+            self.layer.setDataSource(path, DENSITY_LAYER_NAME, "gdal")
+            # Frame précédente retirée du cache (build, changement de sélection) : plus rien ne la lit
+            if self.current and self.current not in self.files.values():
+                gdal.Unlink(self.current)
+        self.layer.setRenderer(self.renderer(vmax or 1.0))
+        self.layer.triggerRepaint()
+        self.current = path
+        return self.layer
+
+    def clear_files(self):
+        """Libère les grilles en cache et les GeoTIFF en mémoire."""
+        for path in self.files.values():
+            if path != self.current:
+                gdal.Unlink(path)
+        self.files = {}
+        self.cache = {}
+        self.maxima = {}
+        self.cached_selection = None
+
+    def remove_layer(self):
+        """Retire la couche de densité du projet."""
+        if self.layer is not None:
+            QgsProject.instance().removeMapLayer(self.layer.id())
+            self.layer = None
+        if self.current:
+            self.files = {key: path for key, path in self.files.items() if path != self.current}
+            gdal.Unlink(self.current)
+            self.current = None
@@ -1,7 +1,5 @@
 from qgis.core import (
-    QgsProject, QgsFeature, QgsLayerTreeLayer, QgsVectorLayer, QgsVectorFileWriter,
-    QgsExpression, QgsFeatureRequest, QgsTextFormat, QgsTextBufferSettings, QgsPalLayerSettings,
-    QgsVectorLayerSimpleLabeling
+    QgsProject, QgsFeature, QgsLayerTreeLayer, QgsVectorFileWriter, QgsApplication
 )
 from PyQt5.QtCore import QRectF, Qt
 from PyQt5.QtGui import QPixmap, QPainter, QPen, QBrush, QPainterPath, QColor 
@@ -11,13 +9,32 @@ from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QFileDialog, QLineEdit,
     QSlider, QLabel, QCheckBox, QGroupBox, QMessageBox, QWidget, QGridLayout,
     QTextEdit, QTabWidget, QFormLayout, QDoubleSpinBox, QApplication, QProgressBar, QComboBox,
-    QSizePolicy
+    QSizePolicy, QSpinBox, QListWidget, QListWidgetItem, QInputDialog
 )
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QFont, QColor
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QColor
 from .data_processor_visualisation_constats import DataProcessorVisualisationConstats
 from .layer_manager_visualisation_constats import LayerManagerVisualisationConstats
 from .animation_exporter_visualisation_constats import AnimationExporterVisualisationConstats
+from .playback_visualisation_constats import PlaybackEngineVisualisationConstats
+from .filter_engine_visualisation_constats import FilterEngineVisualisationConstats
+from .choropleth_visualisation_constats import CommuneMatrixVisualisationConstats
+from .time_series_visualisation_constats import RollingCountsVisualisationConstats
+from .density_visualisation_constats import DensityGridVisualisationConstats, DENSITY_BANDWIDTH_KM
+from .spread_visualisation_constats import SpreadFrontVisualisationConstats
+from .clusters_visualisation_constats import (
+    SpaceTimeClustersVisualisationConstats, CLUSTER_DISTANCE_KM, CLUSTER_DAYS, CLUSTER_MIN_CONSTATS
+)
+from .processing_task_visualisation_constats import ProcessingTaskVisualisationConstats
+from .pivot_dialog_visualisation_constats import PivotDialogVisualisationConstats
+from .export_task_visualisation_constats import ExportTaskVisualisationConstats
+from .filter_presets_visualisation_constats import species_presets, conclusion_group_presets, filter_preset
+from .export_sinks_visualisation_constats import WEB_COPY_WIDTH
+from .date_overlay_visualisation_constats import DateOverlayCanvasItemVisualisationConstats
+from .export_session_visualisation_constats import EXPORT_PRESETS
+from .encoder_visualisation_constats import (
+    VIDEO_FORMATS, SPEED_PRESETS, DEFAULT_ENCODING, GIF_DEFAULT_WIDTH, encoding_extension
+)
 from .utils_visualisation_constats import normalize_string, normalize_elevage
 import os
 import csv
@@ -32,13 +49,27 @@ class VisualisationConstatsLoupDialog(QDialog):
         self.data_processor = DataProcessorVisualisationConstats()
         self.layer_manager = LayerManagerVisualisationConstats(self.iface)
         self.animation_exporter = AnimationExporterVisualisationConstats(self.iface)
+        self.filter_engine = FilterEngineVisualisationConstats()
+        self.commune_matrix = CommuneMatrixVisualisationConstats()
+        self.rolling_counts = RollingCountsVisualisationConstats(self.commune_matrix)
+        self.density_grid = DensityGridVisualisationConstats(self.commune_matrix)
+        self.clusters = SpaceTimeClustersVisualisationConstats()
+        self.spread_front = SpreadFrontVisualisationConstats(self.commune_matrix)
+        self.communes_layer = None
+        self.choropleth_mode = False
+        self.density_mode = False
         self.layers = []
         self.all_layers = []
         self.effective_layers = []
         self.global_layer = None
-        self.dates_layer = None
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.next_frame)
+        self.aggregation_cube = None
+        self.processing_task = None
+        self.export_task = None
+        self.date_overlay = None
+        self.playback_engine = PlaybackEngineVisualisationConstats(self.iface.mapCanvas())
+        self.playback_engine.on_frame = self.playback_frame_shown
+        self.playback_engine.on_buffer = self.update_buffer_indicator
+        self.playback_engine.on_drop = self.update_dropped_frames
         self.current_frame = 0
         self.is_playing = False
         self.conclusion_checkboxes = {}
@@ -141,6 +172,16 @@ class VisualisationConstatsLoupDialog(QDialog):
         self.process_button = QPushButton("🚀 Lancer les traitements")
         self.process_button.clicked.connect(self.run_processing)
         path_layout.addRow(self.process_button)
+        self.process_progress_bar = QProgressBar()
+        self.process_progress_bar.setRange(0, 100)
+        self.process_progress_bar.setVisible(False)
+        self.cancel_process_button = QPushButton("Annuler le traitement")
+        self.cancel_process_button.clicked.connect(self.cancel_processing)
+        self.cancel_process_button.setVisible(False)
+        process_hlayout = QHBoxLayout()
+        process_hlayout.addWidget(self.process_progress_bar)
+        process_hlayout.addWidget(self.cancel_process_button)
+        path_layout.addRow(process_hlayout)
         layout.addLayout(path_layout)
         self.filters_group = QGroupBox("Filtres")
         filters_layout = QGridLayout()
@@ -161,6 +202,10 @@ class VisualisationConstatsLoupDialog(QDialog):
         self.save_button.clicked.connect(self.save_layers_and_project)
         self.save_button.setVisible(False)
         layout.addWidget(self.save_button)
+        self.pivot_button = QPushButton("📊 Tableau croisé à la carte…")
+        self.pivot_button.clicked.connect(self.open_pivot_dialog)
+        self.pivot_button.setEnabled(False)
+        layout.addWidget(self.pivot_button)
         animation_group = QGroupBox("Animation temporelle")
         animation_layout = QVBoxLayout()
         # Start year selection
@@ -182,12 +227,37 @@ class VisualisationConstatsLoupDialog(QDialog):
         cumulative_layout.addWidget(self.cumulative_checkbox)
         animation_layout.addLayout(cumulative_layout)
         print("Cumulative UI added: label, checkbox")
+        choropleth_layout = QHBoxLayout()
+        self.choropleth_label = QLabel("Mode choroplèthe (communes colorées par nombre de constats)")
+        self.choropleth_checkbox = QCheckBox()
+        self.choropleth_checkbox.setChecked(False)
+        self.choropleth_checkbox.setEnabled(False)
+        self.choropleth_checkbox.stateChanged.connect(self.toggle_choropleth_mode)
+        choropleth_layout.addWidget(self.choropleth_label)
+        choropleth_layout.addWidget(self.choropleth_checkbox)
+        animation_layout.addLayout(choropleth_layout)
+        density_layout = QHBoxLayout()
+        self.density_label = QLabel("Mode densité (surface lissée des constats) - rayon :")
+        self.density_bandwidth_spin = QDoubleSpinBox()
+        self.density_bandwidth_spin.setRange(0.5, 50.0)
+        self.density_bandwidth_spin.setValue(DENSITY_BANDWIDTH_KM)
+        self.density_bandwidth_spin.setSuffix(" km")
+        self.density_bandwidth_spin.editingFinished.connect(self.update_density_bandwidth)
+        self.density_checkbox = QCheckBox()
+        self.density_checkbox.setChecked(False)
+        self.density_checkbox.setEnabled(False)
+        self.density_checkbox.stateChanged.connect(self.toggle_density_mode)
+        density_layout.addWidget(self.density_label)
+        density_layout.addWidget(self.density_bandwidth_spin)
+        density_layout.addWidget(self.density_checkbox)
+        animation_layout.addLayout(density_layout)
         time_step_layout = QHBoxLayout()
         time_step_label = QLabel("Durée par frame :")
         self.time_step_spin = QDoubleSpinBox()
         self.time_step_spin.setRange(0.1, 60.0)
         self.time_step_spin.setValue(0.5)
         self.time_step_spin.setSuffix(" s")
+        self.time_step_spin.valueChanged.connect(lambda value: self.playback_engine.set_interval(value * 1000))
         time_step_layout.addWidget(time_step_label)
         time_step_layout.addWidget(self.time_step_spin)
         animation_layout.addLayout(time_step_layout)
@@ -208,12 +278,60 @@ class VisualisationConstatsLoupDialog(QDialog):
         play_layout.addWidget(play_label)
         play_layout.addWidget(self.play_button)
         animation_layout.addLayout(play_layout)
+        buffer_layout = QHBoxLayout()
+        buffer_label = QLabel("Tampon :")
+        self.buffer_bar = QProgressBar()
+        self.buffer_bar.setRange(0, self.playback_engine.buffer_size)
+        self.buffer_bar.setValue(0)
+        self.buffer_bar.setFormat("%v/%m frames")
+        self.dropped_frames_label = QLabel("Frames perdues : 0")
+        buffer_layout.addWidget(buffer_label)
+        buffer_layout.addWidget(self.buffer_bar)
+        buffer_layout.addWidget(self.dropped_frames_label)
+        animation_layout.addLayout(buffer_layout)
         animation_group.setLayout(animation_layout)
         layout.addWidget(animation_group)
+        clusters_group = QGroupBox("Foyers spatio-temporels")
+        clusters_layout = QHBoxLayout()
+        self.cluster_distance_spin = QDoubleSpinBox()
+        self.cluster_distance_spin.setRange(0.5, 100.0)
+        self.cluster_distance_spin.setValue(CLUSTER_DISTANCE_KM)
+        self.cluster_distance_spin.setSuffix(" km")
+        self.cluster_days_spin = QSpinBox()
+        self.cluster_days_spin.setRange(1, 365)
+        self.cluster_days_spin.setValue(CLUSTER_DAYS)
+        self.cluster_days_spin.setSuffix(" j")
+        self.cluster_min_spin = QSpinBox()
+        self.cluster_min_spin.setRange(2, 100)
+        self.cluster_min_spin.setValue(CLUSTER_MIN_CONSTATS)
+        self.cluster_min_spin.setSuffix(" constats")
+        self.detect_clusters_button = QPushButton("Détecter les foyers")
+        self.detect_clusters_button.setEnabled(False)
+        self.detect_clusters_button.clicked.connect(self.detect_clusters)
+        clusters_layout.addWidget(QLabel("Distance :"))
+        clusters_layout.addWidget(self.cluster_distance_spin)
+        clusters_layout.addWidget(QLabel("Écart :"))
+        clusters_layout.addWidget(self.cluster_days_spin)
+        clusters_layout.addWidget(QLabel("Minimum :"))
+        clusters_layout.addWidget(self.cluster_min_spin)
+        clusters_layout.addWidget(self.detect_clusters_button)
+        clusters_group.setLayout(clusters_layout)
+        layout.addWidget(clusters_group)
+        self.spread_button = QPushButton("Afficher le front de propagation (communes nouvellement touchées)")
+        self.spread_button.setEnabled(False)
+        self.spread_button.clicked.connect(self.show_spread_front)
+        layout.addWidget(self.spread_button)
         self.processing_tab = QWidget()
         self.processing_tab.setLayout(layout)
         print("Processing tab setup completed")
 
+    def open_pivot_dialog(self):
+        """Ouvre le tableau croisé à la carte sur le cube d'agrégation du dernier traitement."""
+        if self.aggregation_cube is None:
+            QMessageBox.warning(self, "Attention", "Lancez d'abord le traitement des constats.")
+            return
+        PivotDialogVisualisationConstats(self.aggregation_cube, self).exec_()
+
     def export_crosstab_to_csv(self):
         """Exporte le tableau croisé dynamique en CSV."""
         output_dir = self.crosstab_output_dir_edit.text()
@@ -236,9 +354,39 @@ class VisualisationConstatsLoupDialog(QDialog):
             QMessageBox.critical(self, "Erreur", f"Erreur lors de l'export du TCD : {str(e)}")
             print(f"ERREUR export_crosstab_to_csv: {str(e)}")
 
+    def export_rolling_counts_to_csv(self):
+        """Exporte les effectifs glissants par commune et par département en CSV (filtres courants)."""
+        output_dir = self.crosstab_output_dir_edit.text()
+        if not output_dir:
+            QMessageBox.warning(self, "Attention", "Veuillez choisir un dossier de sortie.")
+            return
+        output_path = os.path.join(output_dir, "effectifs_glissants.csv")
+        try:
+            self.rolling_counts.write_csv(output_path)
+            QMessageBox.information(self, "Succès", f"Effectifs glissants sauvegardés dans : {output_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "Erreur", f"Erreur lors de l'export des effectifs glissants : {str(e)}")
+            print(f"ERREUR export_rolling_counts_to_csv: {str(e)}")
+
     def setup_recording_tab(self):
         """Configure l'onglet d'enregistrement."""
         layout = QVBoxLayout()
+        render_group = QGroupBox("Rendu des exports")
+        render_layout = QHBoxLayout()
+        render_label = QLabel("Processus de rendu parallèles (1 = rendu dans QGIS) :")
+        self.render_workers_spin = QSpinBox()
+        self.render_workers_spin.setRange(1, max(1, os.cpu_count() or 1))
+        self.render_workers_spin.setValue(1)
+        render_layout.addWidget(render_label)
+        render_layout.addWidget(self.render_workers_spin)
+        quality_label = QLabel("Qualité :")
+        self.export_preset_combo = QComboBox()
+        for key, settings in EXPORT_PRESETS.items():
+            self.export_preset_combo.addItem(settings["label"], key)
+        render_layout.addWidget(quality_label)
+        render_layout.addWidget(self.export_preset_combo)
+        render_group.setLayout(render_layout)
+        layout.addWidget(render_group)
         png_group = QGroupBox("Exporter les cartes mensuelles en PNG")
         png_layout = QVBoxLayout()
         png_label = QLabel("Choisir le dossier d'export des cartes mensuelles :")
@@ -271,10 +419,16 @@ class VisualisationConstatsLoupDialog(QDialog):
         self.png_progress_bar.setRange(0, 100)
         self.png_progress_bar.setValue(0)
         self.png_progress_bar.setVisible(False)
-        png_layout.addWidget(self.png_progress_bar)
+        self.png_cancel_button = QPushButton("Annuler l'export")
+        self.png_cancel_button.clicked.connect(self.cancel_export)
+        self.png_cancel_button.setVisible(False)
+        png_progress_layout = QHBoxLayout()
+        png_progress_layout.addWidget(self.png_progress_bar)
+        png_progress_layout.addWidget(self.png_cancel_button)
+        png_layout.addLayout(png_progress_layout)
         png_group.setLayout(png_layout)
         layout.addWidget(png_group)
-        mp4_group = QGroupBox("Exporter l'animation en MP4")
+        mp4_group = QGroupBox("Exporter l'animation (MP4, WebM, GIF, APNG)")
         mp4_layout = QVBoxLayout()
         mp4_label = QLabel("Choisir le dossier d'export de la vidéo :")
         mp4_layout.addWidget(mp4_label)
@@ -287,20 +441,143 @@ class VisualisationConstatsLoupDialog(QDialog):
         mp4_dir_layout.addWidget(self.mp4_output_dir_edit)
         mp4_dir_layout.addWidget(mp4_browse_button)
         mp4_layout.addLayout(mp4_dir_layout)
-        self.record_button = QPushButton("🎥 Enregistrer en MP4")
+        encoding_layout = QHBoxLayout()
+        self.video_format_combo = QComboBox()
+        for key, settings in VIDEO_FORMATS.items():
+            self.video_format_combo.addItem(settings["label"], key)
+        self.video_speed_combo = QComboBox()
+        for key, settings in SPEED_PRESETS.items():
+            self.video_speed_combo.addItem(settings["label"], key)
+        self.video_speed_combo.setCurrentIndex(self.video_speed_combo.findData(DEFAULT_ENCODING["speed"]))
+        self.video_crf_spin = QSpinBox()
+        self.video_crf_spin.setRange(0, 51)
+        self.video_crf_spin.setValue(DEFAULT_ENCODING["crf"])
+        self.video_crf_spin.setToolTip("Qualité constante : plus la valeur est basse, meilleure est la qualité (MP4, WebM)")
+        self.video_width_spin = QSpinBox()
+        self.video_width_spin.setRange(0, 8000)
+        self.video_width_spin.setSingleStep(100)
+        self.video_width_spin.setSuffix(" px")
+        self.video_width_spin.setSpecialValueText("Native")
+        self.video_width_spin.setToolTip(f"Largeur de sortie (0 = taille des frames, {GIF_DEFAULT_WIDTH} px pour le GIF)")
+        encoding_layout.addWidget(QLabel("Format :"))
+        encoding_layout.addWidget(self.video_format_combo)
+        encoding_layout.addWidget(QLabel("Vitesse :"))
+        encoding_layout.addWidget(self.video_speed_combo)
+        encoding_layout.addWidget(QLabel("CRF :"))
+        encoding_layout.addWidget(self.video_crf_spin)
+        encoding_layout.addWidget(QLabel("Largeur :"))
+        encoding_layout.addWidget(self.video_width_spin)
+        mp4_layout.addLayout(encoding_layout)
+        self.record_button = QPushButton()
         self.record_button.clicked.connect(self.export_mp4_with_progress)
+        self.video_format_combo.currentIndexChanged.connect(self.update_record_button_label)
+        self.update_record_button_label()
         self.record_button.setEnabled(False)
         mp4_layout.addWidget(self.record_button)
         self.mp4_progress_bar = QProgressBar()
         self.mp4_progress_bar.setRange(0, 100)
         self.mp4_progress_bar.setValue(0)
         self.mp4_progress_bar.setVisible(False)
-        mp4_layout.addWidget(self.mp4_progress_bar)
+        self.mp4_cancel_button = QPushButton("Annuler l'export")
+        self.mp4_cancel_button.clicked.connect(self.cancel_export)
+        self.mp4_cancel_button.setVisible(False)
+        mp4_progress_layout = QHBoxLayout()
+        mp4_progress_layout.addWidget(self.mp4_progress_bar)
+        mp4_progress_layout.addWidget(self.mp4_cancel_button)
+        mp4_layout.addLayout(mp4_progress_layout)
         self.mp4_ffmpeg_label = QLabel("Vérification de FFmpeg en cours...")
         self.mp4_ffmpeg_label.setStyleSheet("color: orange; font-weight: bold;")
         mp4_layout.addWidget(self.mp4_ffmpeg_label)
         mp4_group.setLayout(mp4_layout)
         layout.addWidget(mp4_group)
+        variants_group = QGroupBox("Exporter des variantes de filtres (une animation par variante)")
+        variants_layout = QVBoxLayout()
+        self.variant_list = QListWidget()
+        self.variant_list.setMaximumHeight(120)
+        variants_layout.addWidget(self.variant_list)
+        variant_buttons_layout = QHBoxLayout()
+        for label, slot in (
+            ("Une par espèce", self.add_species_variants),
+            ("Groupes de conclusions", self.add_conclusion_variants),
+            ("Filtre actuel", self.add_current_variant),
+            ("Vider", self.variant_list.clear)
+        ):
+            button = QPushButton(label)
+            button.clicked.connect(slot)
+            variant_buttons_layout.addWidget(button)
+        variants_layout.addLayout(variant_buttons_layout)
+        variant_dir_layout = QHBoxLayout()
+        self.variant_kind_combo = QComboBox()
+        self.variant_kind_combo.addItem("Séquences PNG", "png")
+        self.variant_kind_combo.addItem("Vidéos (réglages d'encodage ci-dessus)", "video")
+        self.variant_output_dir_edit = QLineEdit()
+        self.variant_output_dir_edit.setPlaceholderText("Chemin du dossier de sortie...")
+        self.variant_output_dir_edit.setReadOnly(True)
+        variant_browse_button = QPushButton("Parcourir...")
+        variant_browse_button.clicked.connect(lambda: self.choose_output_dir(self.variant_output_dir_edit))
+        variant_dir_layout.addWidget(self.variant_kind_combo)
+        variant_dir_layout.addWidget(self.variant_output_dir_edit)
+        variant_dir_layout.addWidget(variant_browse_button)
+        variants_layout.addLayout(variant_dir_layout)
+        self.export_variants_button = QPushButton("🗂️ Exporter les variantes")
+        self.export_variants_button.clicked.connect(self.export_variants)
+        variants_layout.addWidget(self.export_variants_button)
+        self.variant_progress_bar = QProgressBar()
+        self.variant_progress_bar.setRange(0, 100)
+        self.variant_progress_bar.setValue(0)
+        self.variant_progress_bar.setVisible(False)
+        self.variant_cancel_button = QPushButton("Annuler l'export")
+        self.variant_cancel_button.clicked.connect(self.cancel_export)
+        self.variant_cancel_button.setVisible(False)
+        variant_progress_layout = QHBoxLayout()
+        variant_progress_layout.addWidget(self.variant_progress_bar)
+        variant_progress_layout.addWidget(self.variant_cancel_button)
+        variants_layout.addLayout(variant_progress_layout)
+        variants_group.setLayout(variants_layout)
+        layout.addWidget(variants_group)
+        sinks_group = QGroupBox("Export combiné (chaque frame rendue une seule fois)")
+        sinks_layout = QVBoxLayout()
+        sinks_choice_layout = QHBoxLayout()
+        self.sink_png_checkbox = QCheckBox("Séquence PNG")
+        self.sink_png_checkbox.setChecked(True)
+        self.sink_video_checkbox = QCheckBox("Vidéo (réglages d'encodage ci-dessus)")
+        self.sink_video_checkbox.setChecked(True)
+        self.sink_gif_checkbox = QCheckBox("GIF animé")
+        self.sink_web_checkbox = QCheckBox("Copie web, largeur :")
+        self.sink_web_width_spin = QSpinBox()
+        self.sink_web_width_spin.setRange(320, 3840)
+        self.sink_web_width_spin.setSingleStep(160)
+        self.sink_web_width_spin.setValue(WEB_COPY_WIDTH)
+        self.sink_web_width_spin.setSuffix(" px")
+        for widget in (self.sink_png_checkbox, self.sink_video_checkbox, self.sink_gif_checkbox,
+                       self.sink_web_checkbox, self.sink_web_width_spin):
+            sinks_choice_layout.addWidget(widget)
+        sinks_layout.addLayout(sinks_choice_layout)
+        sinks_dir_layout = QHBoxLayout()
+        self.sinks_output_dir_edit = QLineEdit()
+        self.sinks_output_dir_edit.setPlaceholderText("Chemin du dossier de sortie...")
+        self.sinks_output_dir_edit.setReadOnly(True)
+        sinks_browse_button = QPushButton("Parcourir...")
+        sinks_browse_button.clicked.connect(lambda: self.choose_output_dir(self.sinks_output_dir_edit))
+        sinks_dir_layout.addWidget(self.sinks_output_dir_edit)
+        sinks_dir_layout.addWidget(sinks_browse_button)
+        sinks_layout.addLayout(sinks_dir_layout)
+        self.export_sinks_button = QPushButton("📦 Export combiné")
+        self.export_sinks_button.clicked.connect(self.export_sinks)
+        sinks_layout.addWidget(self.export_sinks_button)
+        self.sinks_progress_bar = QProgressBar()
+        self.sinks_progress_bar.setRange(0, 100)
+        self.sinks_progress_bar.setValue(0)
+        self.sinks_progress_bar.setVisible(False)
+        self.sinks_cancel_button = QPushButton("Annuler l'export")
+        self.sinks_cancel_button.clicked.connect(self.cancel_export)
+        self.sinks_cancel_button.setVisible(False)
+        sinks_progress_layout = QHBoxLayout()
+        sinks_progress_layout.addWidget(self.sinks_progress_bar)
+        sinks_progress_layout.addWidget(self.sinks_cancel_button)
+        sinks_layout.addLayout(sinks_progress_layout)
+        sinks_group.setLayout(sinks_layout)
+        layout.addWidget(sinks_group)
         crosstab_group = QGroupBox("Exporter le tableau croisé dynamique (TCD) en CSV")
         crosstab_layout = QVBoxLayout()
         crosstab_label = QLabel("Choisir le dossier d'export du TCD :")
@@ -317,6 +594,10 @@ class VisualisationConstatsLoupDialog(QDialog):
         self.export_crosstab_button = QPushButton("📊 Exporter le TCD en CSV")
         self.export_crosstab_button.clicked.connect(self.export_crosstab_to_csv)
         crosstab_layout.addWidget(self.export_crosstab_button)
+        self.export_rolling_button = QPushButton("📈 Exporter les effectifs glissants (3 et 12 mois) en CSV")
+        self.export_rolling_button.clicked.connect(self.export_rolling_counts_to_csv)
+        self.export_rolling_button.setEnabled(False)
+        crosstab_layout.addWidget(self.export_rolling_button)
         crosstab_group.setLayout(crosstab_layout)
         layout.addWidget(crosstab_group)
         self.recording_tab = QWidget()
@@ -341,9 +622,117 @@ class VisualisationConstatsLoupDialog(QDialog):
         """Active ou désactive le mode cumulatif pour l'animation."""
         self.cumulative_mode = state == Qt.Checked
         self.year_combo.setEnabled(True)  # Always enable year combo
+        if self.choropleth_mode:
+            self.commune_matrix.prepare_layer(self.cumulative_mode)
         self.update_effective_layers()
         print(f"Mode cumulatif animation: {'Activé' if self.cumulative_mode else 'Désactivé'}")
 
+    def toggle_choropleth_mode(self, state):
+        """Active ou désactive le mode choroplèthe (communes graduées au lieu des points)."""
+        self.stop_playback()
+        self.choropleth_mode = state == Qt.Checked and self.commune_matrix.layer is not None
+        if self.choropleth_mode and self.density_checkbox.isChecked():
+            self.density_checkbox.setChecked(False)
+        if self.choropleth_mode:
+            self.commune_matrix.set_selection(*self.selected_filter_codes())
+            self.commune_matrix.prepare_layer(self.cumulative_mode)
+        elif self.communes_layer:
+            self.layer_manager.apply_commune_styling(self.communes_layer)
+        if self.effective_layers:
+            self.show_frame(self.current_frame)
+        print(f"Mode choroplèthe: {'Activé' if self.choropleth_mode else 'Désactivé'}")
+
+    def toggle_density_mode(self, state):
+        """Active ou désactive le mode densité (surface lissée au lieu des points)."""
+        self.stop_playback()
+        self.density_mode = state == Qt.Checked and self.commune_matrix.layer is not None
+        if self.density_mode and self.choropleth_checkbox.isChecked():
+            self.choropleth_checkbox.setChecked(False)
+        if self.density_grid.layer is not None:
+            node = QgsProject.instance().layerTreeRoot().findLayer(self.density_grid.layer.id())
+            if node:
+                node.setItemVisibilityChecked(self.density_mode)
+        if self.effective_layers:
+            self.show_frame(self.current_frame)
+        print(f"Mode densité: {'Activé' if self.density_mode else 'Désactivé'}")
+
+    def update_density_bandwidth(self):
+        """Recalcule la grille de densité avec le nouveau rayon de lissage."""
+        if abs(self.density_bandwidth_spin.value() - self.density_grid.bandwidth_km) < 1e-9:
+            return
+        self.density_grid.set_bandwidth(self.density_bandwidth_spin.value())
+        if self.density_mode and self.effective_layers:
+            self.stop_playback()
+            self.show_frame(self.current_frame)
+
+    def density_frame_layers(self, cumulative):
+        """Fonction de frame pour les exports en mode densité : la couche raster affiche la frame, aucun point."""
+        def layers_for_frame(i, year, month):
+            self.rolling_counts.update_layer(year, month)
+            return self.overlay_layers(year, month, cumulative) + [self.density_grid.update_layer(year, month, cumulative)]
+        return layers_for_frame
+
+    def detect_clusters(self):
+        """Détecte les foyers spatio-temporels parmi les constats retenus par les filtres courants."""
+        try:
+            count = self.clusters.detect(
+                self.layers, self.filter_engine.expression, self.cluster_distance_spin.value(),
+                self.cluster_days_spin.value(), self.cluster_min_spin.value()
+            )
+            if self.effective_layers:
+                year, month, _ = self.effective_layers[self.current_frame]
+                self.clusters.update_frame(year, month, self.cumulative_mode)
+            if self.is_playing:
+                self.playback_engine.invalidate()
+            QMessageBox.information(self, "Foyers spatio-temporels", f"{count} foyers détectés.")
+        except Exception as e:
+            QMessageBox.critical(self, "Erreur", f"Erreur lors de la détection des foyers : {str(e)}")
+            print(f"ERREUR detect_clusters: {str(e)}")
+
+    def show_spread_front(self):
+        """Calcule le graphe d'adjacence des communes (ou le lit en cache) et affiche le front de propagation."""
+        try:
+            if not self.spread_front.adjacency and not self.spread_front.build(self.shp_path_edit.text().strip()):
+                QMessageBox.warning(self, "Attention", "Aucune commune disponible pour le front de propagation.")
+                return
+            self.spread_front.update_layer()
+            if self.effective_layers:
+                year, month, _ = self.effective_layers[self.current_frame]
+                self.spread_front.update_frame(year, month, self.cumulative_mode)
+            if self.is_playing:
+                self.playback_engine.invalidate()
+        except Exception as e:
+            QMessageBox.critical(self, "Erreur", f"Erreur lors du calcul du front de propagation : {str(e)}")
+            print(f"ERREUR show_spread_front: {str(e)}")
+
+    def overlay_layers(self, year, month, cumulative):
+        """Couches filtrées à chaque frame et rendues au-dessus des constats (foyers, front de propagation)."""
+        layers = [self.clusters.update_frame(year, month, cumulative), self.spread_front.update_frame(year, month, cumulative)]
+        return [layer for layer in layers if layer is not None]
+
+    def export_overlays(self):
+        """Couches d'analyse présentes dans le projet et leur filtre par frame, pour les exports de points."""
+        return [
+            (overlay.layer, overlay.frame_expression) for overlay in (self.clusters, self.spread_front)
+            if overlay.layer is not None and QgsProject.instance().mapLayer(overlay.layer.id())
+        ]
+
+    def frame_layers_function(self, cumulative):
+        """Fonction de frame des modes choroplèthe et densité (None : couches de points)."""
+        if self.choropleth_mode:
+            return self.choropleth_frame_layers(cumulative)
+        if self.density_mode:
+            return self.density_frame_layers(cumulative)
+        return None
+
+    def choropleth_frame_layers(self, cumulative):
+        """Fonction de frame pour les exports en mode choroplèthe : met à jour les communes, aucun point."""
+        def layers_for_frame(i, year, month):
+            self.commune_matrix.update_layer(year, month, cumulative)
+            self.rolling_counts.update_layer(year, month)
+            return self.overlay_layers(year, month, cumulative)
+        return layers_for_frame
+
     def toggle_png_cumulative_mode(self, state):
         """Active ou désactive le mode cumulatif pour l'export PNG."""
         self.png_cumulative_mode = state == Qt.Checked
@@ -368,6 +757,7 @@ class VisualisationConstatsLoupDialog(QDialog):
         if not self.layers:
             print("Aucune couche dans self.layers pour update_effective_layers")
             return
+        self.stop_playback()
         self.all_layers = sorted(self.layers, key=lambda x: (x[0], x[1]))
         if self.start_year is not None:
             self.effective_layers = [l for l in self.all_layers if l[0] >= self.start_year]
@@ -411,21 +801,47 @@ class VisualisationConstatsLoupDialog(QDialog):
             self.png_progress_bar.setValue(value)
             QApplication.processEvents()
         if self.png_cumulative_mode and hasattr(self, 'png_start_year') and self.png_start_year is not None:
-            export_layers = [l for y, m, l in sorted(valid_layers, key=lambda x: (x[0], x[1])) if y >= self.png_start_year]
+            export_layers = [(y, m, l) for y, m, l in sorted(valid_layers, key=lambda x: (x[0], x[1])) if y >= self.png_start_year]
         else:
             export_layers = sorted(valid_layers, key=lambda x: (x[0], x[1]))
         if not export_layers:
             QMessageBox.warning(self, "Attention", "Aucune couche valide après filtrage pour l'export.")
             return
         print(f"Export PNG: {len(export_layers)} couches à exporter")
+        self.filter_engine.apply_all()
+        if not self.choropleth_mode and not self.density_mode:
+            self.start_export_task("png", export_layers, output_dir, {
+                "workers": self.render_workers_spin.value(),
+                "preset": self.export_preset_combo.currentData(),
+                "cumulative": self.png_cumulative_mode
+            }, self.png_progress_bar, self.png_cancel_button, f"Export PNG terminé. Les images sont dans : {output_dir}")
+            return
+        # Modes choroplèthe et densité : les couches du projet changent à chaque frame, l'export reste au premier plan
         try:
-            self.animation_exporter.record_animation_to_png(export_layers, self, output_dir, update_progress)
+            layers_for_frame = self.frame_layers_function(self.png_cumulative_mode)
+            self.animation_exporter.record_animation_to_png(export_layers, self, output_dir, update_progress, layers_for_frame,
+                                                            workers=self.render_workers_spin.value(),
+                                                            preset=self.export_preset_combo.currentData())
             self.png_progress_bar.setValue(100)
             QMessageBox.information(self, "Succès", f"Export PNG terminé. Les images sont dans : {output_dir}")
         except Exception as e:
             QMessageBox.critical(self, "Erreur", f"Erreur lors de l'export PNG : {str(e)}")
             self.png_progress_bar.setValue(0)
 
+    def update_record_button_label(self):
+        """Libellé du bouton d'enregistrement selon le format d'animation choisi."""
+        self.record_button.setText(f"🎥 Enregistrer en {self.video_format_combo.currentText()}")
+
+    def encoding_settings(self):
+        """Réglages d'encodage de l'animation ; la fréquence d'images suit le pas de temps de la lecture."""
+        return {
+            "format": self.video_format_combo.currentData(),
+            "framerate": 1.0 / self.time_step_spin.value(),
+            "crf": self.video_crf_spin.value(),
+            "speed": self.video_speed_combo.currentData(),
+            "width": self.video_width_spin.value()
+        }
+
     def export_mp4_with_progress(self):
         """Exporte la vidéo MP4 avec suivi de progression."""
         output_dir = self.mp4_output_dir_edit.text()
@@ -435,18 +851,33 @@ class VisualisationConstatsLoupDialog(QDialog):
         if not self.layers:
             QMessageBox.warning(self, "Attention", "Aucune couche disponible pour l'export.")
             return
-        output_file = os.path.join(output_dir, "animation_constats_loup.mp4")
+        encoding = self.encoding_settings()
+        output_file = os.path.join(output_dir, f"animation_constats_loup.{encoding_extension(encoding)}")
         self.mp4_progress_bar.setVisible(True)
         self.mp4_progress_bar.setValue(0)
         def update_progress(value):
             self.mp4_progress_bar.setValue(value)
             QApplication.processEvents()
         if self.cumulative_mode and self.start_year is not None:
-            export_layers = [l for y, m, l in self.all_layers if y >= self.start_year]
+            export_layers = [(y, m, l) for y, m, l in self.all_layers if y >= self.start_year]
         else:
             export_layers = self.all_layers
+        self.filter_engine.apply_all()
+        if not self.choropleth_mode and not self.density_mode:
+            self.start_export_task("video", export_layers, output_file, {
+                "workers": self.render_workers_spin.value(),
+                "preset": self.export_preset_combo.currentData(),
+                "encoding": encoding,
+                "cumulative": self.cumulative_mode
+            }, self.mp4_progress_bar, self.mp4_cancel_button, f"Vidéo enregistrée : {output_file}")
+            return
+        # Modes choroplèthe et densité : les couches du projet changent à chaque frame, l'export reste au premier plan
         try:
-            self.animation_exporter.record_animation_to_mp4(export_layers, self, output_file, update_progress)
+            layers_for_frame = self.frame_layers_function(self.cumulative_mode)
+            self.animation_exporter.record_animation_to_mp4(export_layers, self, output_file, update_progress, layers_for_frame,
+                                                            workers=self.render_workers_spin.value(),
+                                                            preset=self.export_preset_combo.currentData(),
+                                                            encoding=encoding)
             self.mp4_progress_bar.setValue(100)
             QMessageBox.information(self, "Succès", f"Vidéo enregistrée : {output_file}")
         except FileNotFoundError as e:
@@ -459,6 +890,169 @@ class VisualisationConstatsLoupDialog(QDialog):
             QMessageBox.critical(self, "Erreur", f"Erreur lors de l'export MP4 : {str(e)}")
             self.mp4_progress_bar.setValue(0)
 
+    def start_export_task(self, kind, export_layers, output, options, progress_bar, cancel_button, success_message):
+        """Lance l'export dans une QgsTask ; la barre affiche l'avancement et le temps restant estimé.
+
+        Les frames sont rendues par le pool de processus : aucun layout n'est rendu dans le fil principal.
+        """
+        if self.export_task is not None:
+            QMessageBox.warning(self, "Attention", "Un export est déjà en cours.")
+            return
+        communes_layer = self.communes_layer or next(
+            (layer for layer in QgsProject.instance().mapLayers().values() if layer.name() == "Communes"), None
+        )
+        if communes_layer is None:
+            QMessageBox.warning(self, "Attention", "Couche 'Communes' introuvable.")
+            return
+        task = ExportTaskVisualisationConstats(kind, export_layers, communes_layer, output, options,
+                                               overlays=self.export_overlays())
+
+        def update_progress(value):
+            remaining = task.tracker.remaining_text()
+            progress_bar.setValue(int(value))
+            progress_bar.setFormat(f"%p% — {remaining}" if remaining else "%p%")
+
+        def export_finished(task, result):
+            self.export_task = None
+            cancel_button.setVisible(False)
+            progress_bar.setFormat("%p%")
+            if task.isCanceled():
+                progress_bar.setValue(0)
+                self.iface.messageBar().pushInfo("Visualisation Constats Loup", "Export annulé")
+            elif result:
+                progress_bar.setValue(100)
+                QMessageBox.information(self, "Succès", success_message)
+            else:
+                progress_bar.setValue(0)
+                QMessageBox.critical(self, "Erreur", task.error or "Export non effectué")
+
+        task.on_finished = export_finished
+        task.progressChanged.connect(update_progress)
+        cancel_button.setEnabled(True)
+        cancel_button.setVisible(True)
+        self.export_task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def cancel_export(self):
+        if self.export_task is not None:
+            self.png_cancel_button.setEnabled(False)
+            self.mp4_cancel_button.setEnabled(False)
+            self.variant_cancel_button.setEnabled(False)
+            self.sinks_cancel_button.setEnabled(False)
+            self.export_task.cancel()
+
+    def add_variant_item(self, preset):
+        item = QListWidgetItem(preset["name"])
+        item.setData(Qt.UserRole, preset)
+        item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+        item.setCheckState(Qt.Checked)
+        self.variant_list.addItem(item)
+
+    def add_species_variants(self):
+        for preset in species_presets(list(self.elevage_checkboxes)):
+            self.add_variant_item(preset)
+
+    def add_conclusion_variants(self):
+        for preset in conclusion_group_presets(list(self.conclusion_checkboxes)):
+            self.add_variant_item(preset)
+
+    def add_current_variant(self):
+        """Ajoute les cases actuellement cochées comme variante nommée."""
+        name, ok = QInputDialog.getText(self, "Variante", "Nom de la variante :")
+        if not ok or not name.strip():
+            return
+        self.add_variant_item(filter_preset(
+            name.strip(),
+            especes=[s for s, cb in self.elevage_checkboxes.items() if cb.isChecked()],
+            conclusions=[c for c, cb in self.conclusion_checkboxes.items() if cb.isChecked()]
+        ))
+
+    def export_variants(self):
+        """Exporte une animation par variante cochée, dans une seule tâche de rendu."""
+        output_dir = self.variant_output_dir_edit.text()
+        if not output_dir:
+            QMessageBox.warning(self, "Attention", "Veuillez choisir un dossier de sortie.")
+            return
+        if not self.layers:
+            QMessageBox.warning(self, "Attention", "Aucune couche disponible pour l'export.")
+            return
+        if self.choropleth_mode or self.density_mode:
+            QMessageBox.warning(self, "Attention", "L'export des variantes n'est pas disponible en mode choroplèthe ou densité.")
+            return
+        items = [self.variant_list.item(i) for i in range(self.variant_list.count())]
+        presets = [item.data(Qt.UserRole) for item in items if item.checkState() == Qt.Checked]
+        if not presets:
+            QMessageBox.warning(self, "Attention", "Aucune variante cochée.")
+            return
+        variants = []
+        for preset in presets:
+            species, conclusions = self.filter_codes(preset["especes"], preset["conclusions"])
+            variants.append({"name": preset["name"], "species": species, "conclusions": conclusions})
+        kind = self.variant_kind_combo.currentData()
+        if kind == "png":
+            cumulative, start_year = self.png_cumulative_mode, self.png_start_year
+        else:
+            cumulative, start_year = self.cumulative_mode, self.start_year
+        export_layers = sorted([(y, m, l) for y, m, l in self.layers if l and l.isValid()], key=lambda x: (x[0], x[1]))
+        if cumulative and start_year is not None:
+            export_layers = [(y, m, l) for y, m, l in export_layers if y >= start_year]
+        options = {
+            "variants": variants,
+            "species_codes": dict(self.layer_manager.species_codes),
+            "conclusion_codes": dict(self.layer_manager.conclusion_codes),
+            "workers": self.render_workers_spin.value(),
+            "preset": self.export_preset_combo.currentData(),
+            "cumulative": cumulative
+        }
+        if kind == "video":
+            options["encoding"] = self.encoding_settings()
+        self.variant_progress_bar.setVisible(True)
+        self.variant_progress_bar.setValue(0)
+        self.start_export_task(kind, export_layers, output_dir, options, self.variant_progress_bar,
+                               self.variant_cancel_button, f"{len(variants)} variantes exportées dans : {output_dir}")
+
+    def export_sinks(self):
+        """PNG, vidéo, GIF et copie web produits par un seul rendu de chaque frame de l'animation."""
+        output_dir = self.sinks_output_dir_edit.text()
+        if not output_dir:
+            QMessageBox.warning(self, "Attention", "Veuillez choisir un dossier de sortie.")
+            return
+        if not self.layers:
+            QMessageBox.warning(self, "Attention", "Aucune couche disponible pour l'export.")
+            return
+        if self.choropleth_mode or self.density_mode:
+            QMessageBox.warning(self, "Attention", "L'export combiné n'est pas disponible en mode choroplèthe ou densité.")
+            return
+        encoding = self.encoding_settings()
+        sinks = []
+        if self.sink_png_checkbox.isChecked():
+            sinks.append({"type": "png", "output": os.path.join(output_dir, "png")})
+        if self.sink_video_checkbox.isChecked():
+            sinks.append({"type": "video", "encoding": encoding,
+                          "output": os.path.join(output_dir, f"animation_constats_loup.{encoding_extension(encoding)}")})
+        if self.sink_gif_checkbox.isChecked() and not (self.sink_video_checkbox.isChecked() and encoding["format"] == "gif"):
+            gif_encoding = dict(encoding, format="gif")
+            sinks.append({"type": "video", "encoding": gif_encoding,
+                          "output": os.path.join(output_dir, f"animation_constats_loup.{encoding_extension(gif_encoding)}")})
+        if self.sink_web_checkbox.isChecked():
+            sinks.append({"type": "web", "output": os.path.join(output_dir, "web"), "width": self.sink_web_width_spin.value()})
+        if not sinks:
+            QMessageBox.warning(self, "Attention", "Aucune sortie cochée.")
+            return
+        if self.cumulative_mode and self.start_year is not None:
+            export_layers = [(y, m, l) for y, m, l in self.all_layers if y >= self.start_year]
+        else:
+            export_layers = self.all_layers
+        self.filter_engine.apply_all()
+        self.sinks_progress_bar.setVisible(True)
+        self.sinks_progress_bar.setValue(0)
+        self.start_export_task("sinks", export_layers, output_dir, {
+            "sinks": sinks,
+            "workers": self.render_workers_spin.value(),
+            "preset": self.export_preset_combo.currentData(),
+            "cumulative": self.cumulative_mode
+        }, self.sinks_progress_bar, self.sinks_cancel_button, f"Export combiné terminé ({len(sinks)} sorties) dans : {output_dir}")
+
     def browse_file(self, line_edit, filter_str, status_label):
         """Ouvre une boîte de dialogue pour sélectionner un fichier."""
         file_path, _ = QFileDialog.getOpenFileName(self, "Sélectionner un fichier", line_edit.text(), filter_str)
@@ -656,45 +1250,76 @@ class VisualisationConstatsLoupDialog(QDialog):
         except Exception as e:
             print(f"ERREUR populate_elevage: {str(e)}")
 
+    def filter_codes(self, species_names, conclusion_names):
+        """Traduit des libellés de cases espèces / conclusions en codes pour le moteur de filtre."""
+        species_codes = self.layer_manager.species_codes
+        selected_species = [species_codes[s] for s in species_names if s in species_codes]
+        normalized_conclusion_map = {normalize_string(k): k for k in self.layer_manager.conclusion_colors.keys()}
+        wanted = set(conclusion_names)
+        selected_conclusions = []
+        for conclusion, code in self.layer_manager.conclusion_codes.items():
+            key = normalized_conclusion_map.get(normalize_string(conclusion), 'Inconnu')
+            if key in wanted:
+                selected_conclusions.append(code)
+        return selected_species, selected_conclusions
+
+    def selected_filter_codes(self):
+        """Traduit les cases cochées en codes espèces / conclusions pour le moteur de filtre."""
+        return self.filter_codes(
+            [s for s, cb in self.elevage_checkboxes.items() if cb.isChecked()],
+            [c for c, cb in self.conclusion_checkboxes.items() if cb.isChecked()]
+        )
+
+    def visible_constats_layers(self):
+        """Couches de constats actuellement affichées (frame courante et couche globale si cochée)."""
+        layers = []
+        if self.effective_layers and self.current_frame < len(self.effective_layers):
+            layers.extend(self.frame_layers(self.current_frame))
+        if self.global_layer:
+            global_node = QgsProject.instance().layerTreeRoot().findLayer(self.global_layer.id())
+            if global_node and global_node.isVisible():
+                layers.append(self.global_layer)
+        return layers
+
     def apply_filters_to_layers(self):
-        """Applique les filtres."""
+        """Applique les filtres : calcul vectorisé, puis filtre poussé aux seules couches visibles."""
         try:
-            elevage_filters = []
-            for s, cb in self.elevage_checkboxes.items():
-                if cb.isChecked():
-                    escaped_s = s.replace("'", "''")
-                    elevage_filters.append(f"\"Elevage\" ILIKE '{escaped_s}%'")
-            conclusion_filters = []
-            for c, cb in self.conclusion_checkboxes.items():
-                if cb.isChecked():
-                    escaped_c = c.replace("'", "''")
-                    conclusion_filters.append(f"\"C_tech_new\" = '{escaped_c}'")
-            elevage_filter = " OR ".join(elevage_filters) if elevage_filters else "1=1"
-            conclusion_filter = " OR ".join(conclusion_filters) if conclusion_filters else "1=1"
-            filter_expr = f"({elevage_filter}) AND ({conclusion_filter})"
-            print(f"Expression de filtre appliquée: {filter_expr}")
+            selected_species, selected_conclusions = self.selected_filter_codes()
+            self.filter_engine.compute(selected_species, selected_conclusions)
+            self.filter_engine.apply_to(self.visible_constats_layers())
+            self.commune_matrix.set_selection(selected_species, selected_conclusions)
+            if self.choropleth_mode:
+                self.commune_matrix.prepare_layer(self.cumulative_mode)
+                if self.effective_layers and not self.is_playing:
+                    year, month, _ = self.effective_layers[self.current_frame]
+                    self.commune_matrix.update_layer(year, month, self.cumulative_mode)
+            if self.density_mode and self.effective_layers and not self.is_playing:
+                year, month, _ = self.effective_layers[self.current_frame]
+                self.density_grid.update_layer(year, month, self.cumulative_mode)
+            if self.spread_front.layer is not None and self.spread_front.adjacency:
+                self.spread_front.update_layer()
+                if self.effective_layers:
+                    year, month, _ = self.effective_layers[self.current_frame]
+                    self.spread_front.update_frame(year, month, self.cumulative_mode)
             for _, _, layer in self.layers:
-                if not layer:
-                    continue
-                layer.setSubsetString(filter_expr)
-                print(f"Couche {layer.name()}: {layer.featureCount()} entités après filtre")
-                layer.triggerRepaint()
+                if layer:
+                    print(f"Couche {layer.name()}: {self.filter_engine.count(layer)} entités après filtre")
             if self.global_layer:
-                self.global_layer.setSubsetString(filter_expr)
-                print(f"Couche Constats_Globaux: {self.global_layer.featureCount()} entités après filtre")
-                self.global_layer.triggerRepaint()
-            self.iface.mapCanvas().refresh()
+                print(f"Couche Constats_Globaux: {self.filter_engine.count(self.global_layer)} entités après filtre")
+            if self.is_playing:
+                self.playback_engine.invalidate()
+            else:
+                self.iface.mapCanvas().refresh()
         except Exception as e:
             print(f"ERREUR apply_filters: {str(e)}")
 
-
-
     def closeEvent(self, event):
-        """Arrête le timer et supprime les fichiers temporaires."""
-        if self.is_playing:
-            self.timer.stop()
-            self.is_playing = False
-            self.play_button.setText("▶ Play")
+        """Arrête la lecture et le traitement en cours, supprime les fichiers temporaires."""
+        self.stop_playback()
+        self.cancel_processing()
+        if self.date_overlay:
+            self.date_overlay.remove()
+            self.date_overlay = None
         temp_files = [f for f in os.listdir(os.path.dirname(__file__)) if f.startswith("temp_")]
         for f in temp_files:
             try:
@@ -705,114 +1330,90 @@ class VisualisationConstatsLoupDialog(QDialog):
 
     def range_commune(self, communes_layer):
         """Déplace la couche 'Communes' dans un groupe dédié en bas de la légende avec filtre INSEE_DEP."""
-        if not communes_layer:
-            print("ERREUR: Couche Communes non fournie")
-            return None
-        try:
-            root = QgsProject.instance().layerTreeRoot()
-            group_name = "Communes"
-            group = root.findGroup(group_name)
-            if not group:
-                group = root.insertGroup(len(root.children()), group_name)
-
-            # Créer une couche mémoire filtrée
-            clone = QgsVectorLayer(
-                f"Polygon?crs={communes_layer.crs().authid()}",
-                "Communes",  # Keep original name for PNG export compatibility
-                "memory"
-            )
-            if not clone.isValid():
-                print("Erreur: Impossible de créer la couche clone des Communes")
-                return None
-
-            # Copier les champs
-            clone_data_provider = clone.dataProvider()
-            clone_data_provider.addAttributes(communes_layer.fields())
-            clone.updateFields()
-
-            # Créer une expression de filtre
-            expression = QgsExpression('"INSEE_DEP" = \'21\'')
-            if not expression.hasParserError():
-                # Appliquer l'expression et ajouter les entités filtrées
-                it = communes_layer.getFeatures(QgsFeatureRequest(expression))
-                clone.startEditing()
-                for feature in it:
-                    new_feature = QgsFeature(clone.fields())
-                    new_feature.setGeometry(feature.geometry())
-                    new_feature.setAttributes(feature.attributes())
-                    clone_data_provider.addFeature(new_feature)
-                clone.commitChanges()
-                print(f"Filtre appliqué à Communes: {clone.featureCount()} entités")
-            else:
-                print(f"Erreur dans l'expression: {expression.parserErrorString()}")
-                return None
-
-            # Supprimer l'ancienne couche
-            QgsProject.instance().removeMapLayer(communes_layer.id())
-
-            # Ajouter la nouvelle couche au groupe Communes
-            QgsProject.instance().addMapLayer(clone, False)
-            group.addLayer(clone)
-            self.layer_manager.apply_commune_styling(clone)
-
-            layer_node = group.findLayer(clone.id())
-            if layer_node:
-                layer_node.setItemVisibilityChecked(True)
-
-            print(f"Couche Communes clonée et filtrée ajoutée, {clone.featureCount()} entités")
-            return clone
-        except Exception as e:
-            print(f"ERREUR range_commune: {str(e)}")
-            return None
+        return self.layer_manager.range_commune(communes_layer)
 
     def run_processing(self):
+        """Lance les calculs dans une QgsTask ; l'ajout des couches au projet se fait à la fin, dans register_processing."""
         ods_path = self.ods_path_edit.text().strip()
         shp_path = self.shp_path_edit.text().strip()
         if not os.path.exists(ods_path) or not os.path.exists(shp_path):
             QMessageBox.critical(self, "Erreur", "Fichiers introuvables")
             return
+        if self.processing_task is not None:
+            return
         self.process_button.setEnabled(False)
-        QApplication.processEvents()
+        self.process_progress_bar.setValue(0)
+        self.process_progress_bar.setFormat("%p%")
+        self.process_progress_bar.setVisible(True)
+        self.cancel_process_button.setVisible(True)
+        self.cancel_process_button.setEnabled(True)
+        task = ProcessingTaskVisualisationConstats(
+            ods_path, shp_path, self.data_processor, self.layer_manager, self.processing_finished
+        )
+        task.progressChanged.connect(self.update_processing_progress)
+        # Garder une référence : la tâche est détruite par le gestionnaire à sa fin
+        self.processing_task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def update_processing_progress(self, value):
+        task = self.processing_task
+        if task is None:
+            return
+        self.process_progress_bar.setValue(int(value))
+        if task.stage_name:
+            self.process_progress_bar.setFormat(f"{task.stage_name} : %p%")
+
+    def cancel_processing(self):
+        if self.processing_task is not None:
+            self.cancel_process_button.setEnabled(False)
+            self.processing_task.cancel()
+
+    def processing_finished(self, task, result):
+        """Appelé dans le fil principal à la fin de la tâche de traitement."""
+        self.processing_task = None
+        self.process_progress_bar.setVisible(False)
+        self.cancel_process_button.setVisible(False)
         try:
-            ods_layer, communes_layer = self.data_processor.load_data(ods_path, shp_path)
-            self.ods_layer = ods_layer
-            if not ods_layer or not communes_layer:
-                QMessageBox.critical(self, "Erreur", "Couches ODS ou SHP non valides")
-                return
-            if ods_layer.featureCount() == 0:
-                QMessageBox.warning(self, "Attention", "La couche ODS est vide")
-                return
-            if communes_layer.featureCount() == 0:
-                QMessageBox.warning(self, "Attention", "La couche Communes est vide")
-                return
-            print(f"ODS chargé: {ods_layer.featureCount()} entités")
-
-            # Appel de process_data et décompression des trois valeurs retournées
-            matched_features, unmatched_count, temp_ods_layer = self.data_processor.process_data(ods_layer, communes_layer)
-            print(f"Features appariées: {len(matched_features)}")
-
-            # Utiliser temp_ods_layer pour regrouper les données par mois
-            data_by_month = self.data_processor.group_data_by_month(temp_ods_layer)
-            print(f"Groupes mensuels: {len(data_by_month)}")
+            if task.isCanceled():
+                self.iface.messageBar().pushInfo("Visualisation Constats Loup", "Traitement annulé")
+            elif not result:
+                if task.error_critical:
+                    QMessageBox.critical(self, "Erreur", task.error or "Traitement interrompu")
+                else:
+                    QMessageBox.warning(self, "Attention", task.error or "Traitement interrompu")
+            else:
+                self.register_processing(task)
+        finally:
+            self.process_button.setEnabled(True)
 
-            if not data_by_month:
-                QMessageBox.warning(self, "Attention", "Aucun groupe mensuel créé")
-                return
+    def register_processing(self, task):
+        """Crée les couches à partir des constats placés par la tâche et les enregistre dans le projet."""
+        try:
+            ods_layer = task.ods_layer
+            communes_layer = task.communes_layer
+            matched_features = task.matched_features
+            unmatched_count = task.unmatched_count
+            temp_ods_layer = task.temp_ods_layer
+            data_by_month = task.data_by_month
+            self.ods_layer = ods_layer
 
             self.layer_manager.add_commune_layer(communes_layer)
-            self.layers = self.layer_manager.create_monthly_layers(temp_ods_layer, communes_layer, matched_features, data_by_month)
+            self.layers = self.layer_manager.create_monthly_layers(
+                temp_ods_layer, communes_layer, matched_features, data_by_month, task.placed
+            )
             print(f"Couches mensuelles créées: {[(year, month, layer.name() if layer else 'None') for year, month, layer in self.layers]}")
 
-            global_layer = self.layer_manager.create_global_layer(temp_ods_layer, matched_features, data_by_month)
+            global_layer = self.layer_manager.create_global_layer(
+                temp_ods_layer, matched_features, data_by_month, task.global_features
+            )
             self.global_layer = global_layer
-
-            # Créer la couche Dates
-            self.dates_layer = self.layer_manager.create_dates_layer(self.layers, ods_layer.crs().authid())
-            if not self.dates_layer:
-                print("ERREUR: La couche Dates n'a pas pu être créée.")
-                QMessageBox.warning(self, "Attention", "La couche Dates n'a pas pu être créée.")
-                return
-            print(f"Couche Dates ajoutée avec {self.dates_layer.featureCount() if self.dates_layer else 0} entités")
+            self.aggregation_cube = task.cube
+            self.pivot_button.setEnabled(bool(len(task.cube.counts)))
+            self.filter_engine.build(
+                [layer for _, _, layer in self.layers] + [global_layer],
+                self.layer_manager.species_codes,
+                self.layer_manager.conclusion_codes
+            )
 
             self.layer_manager.zoom_to_communes(communes_layer)
             if not self.layers or not global_layer or not communes_layer:
@@ -820,6 +1421,19 @@ class VisualisationConstatsLoupDialog(QDialog):
                 return
             if communes_layer:
                 communes_layer = self.range_commune(communes_layer)
+                self.communes_layer = communes_layer
+            if communes_layer:
+                self.choropleth_checkbox.setEnabled(self.commune_matrix.build(
+                    communes_layer, matched_features, data_by_month,
+                    self.layer_manager.species_codes, self.layer_manager.conclusion_codes
+                ))
+                if self.choropleth_mode:
+                    self.commune_matrix.prepare_layer(self.cumulative_mode)
+                self.export_rolling_button.setEnabled(self.rolling_counts.build())
+                self.density_checkbox.setEnabled(self.density_grid.build())
+            self.detect_clusters_button.setEnabled(bool(self.layers))
+            self.spread_front.adjacency = {}
+            self.spread_button.setEnabled(self.commune_matrix.layer is not None)
             if global_layer:
                 root = QgsProject.instance().layerTreeRoot()
                 all_layers = QgsProject.instance().mapLayers().values()
@@ -829,11 +1443,6 @@ class VisualisationConstatsLoupDialog(QDialog):
                 if global_node:
                     global_node.setItemVisibilityChecked(False)
                 print("Couche Constats_Globaux masquée")
-            if self.dates_layer:
-                dates_node = root.findLayer(self.dates_layer.id())
-                if dates_node:
-                    dates_node.setItemVisibilityChecked(True)
-                print("Couche Dates rendue visible")
             constats_group = root.findGroup("Constats")
 
             self.available_years = sorted(set(year for year, _ in [(y, m) for y, m, _ in self.layers]))
@@ -869,11 +1478,9 @@ class VisualisationConstatsLoupDialog(QDialog):
                     except Exception as e:
                         print(f"Erreur suppression fichier temporaire {f}: {e}")
         except Exception as e:
-            print(f"ERREUR run_processing: {str(e)}")
+            print(f"ERREUR register_processing: {str(e)}")
             import traceback
             traceback.print_exc()
-        finally:
-            self.process_button.setEnabled(True)
 
 
     def save_layers_and_project(self):
@@ -882,6 +1489,7 @@ class VisualisationConstatsLoupDialog(QDialog):
         if not output_dir:
             return
         try:
+            self.filter_engine.apply_all()
             self.layer_manager.save_project(output_dir)
             QMessageBox.information(self, "Succès", f"Projet sauvegardé dans: {output_dir}")
         except Exception as e:
@@ -890,37 +1498,12 @@ class VisualisationConstatsLoupDialog(QDialog):
     def slider_changed(self, value):
         """Affiche la couche correspondante au slider."""
         self.current_frame = value
-        self.show_frame(value)
-
-    def refresh_dates_layer_labels(self):
-        """Reconfigure les étiquettes de la couche Dates."""
-        if not hasattr(self, 'dates_layer') or not self.dates_layer or not self.dates_layer.isValid():
-            print("ERREUR: Couche Dates non valide")
+        if self.is_playing:
+            # Reprendre le pré-rendu à partir de la nouvelle position
+            self.playback_engine.current_frame = value
+            self.playback_engine.invalidate()
             return
-
-        # Configurer les étiquettes
-        text_format = QgsTextFormat()
-        text_format.setFont(QFont("Arial", 16, QFont.Bold))
-        text_format.setColor(QColor("red"))
-        buffer = QgsTextBufferSettings()
-        buffer.setEnabled(True)
-        buffer.setSize(2)
-        buffer.setColor(QColor("white"))
-        text_format.setBuffer(buffer)
-        label_settings = QgsPalLayerSettings()
-        label_settings.fieldName = "month_key"
-        label_settings.enabled = True
-        label_settings.placement = QgsPalLayerSettings.OverPoint
-        label_settings.setFormat(text_format)
-
-        # Appliquer les paramètres d'étiquetage
-        self.dates_layer.setLabeling(QgsVectorLayerSimpleLabeling(label_settings))
-        self.dates_layer.setLabelsEnabled(True)
-
-        # Rafraîchir la couche et le canevas
-        self.dates_layer.triggerRepaint()
-        self.iface.mapCanvas().refresh()
-        print("Étiquettes de la couche Dates reconfigurées")
+        self.show_frame(value)
 
     def show_frame(self, index):
         """Affiche ou masque les couches selon l'index chronologique et met à jour l'affichage des dates."""
@@ -929,6 +1512,7 @@ class VisualisationConstatsLoupDialog(QDialog):
             return
         try:
             root = QgsProject.instance().layerTreeRoot()
+            self.filter_engine.apply_to(self.frame_layers(index))
 
             # Hide all layers first
             for _, _, layer in self.all_layers:
@@ -937,7 +1521,15 @@ class VisualisationConstatsLoupDialog(QDialog):
                     if layer_node:
                         layer_node.setItemVisibilityChecked(False)
 
-            if self.cumulative_mode:
+            year, month, _ = self.effective_layers[index]
+            self.rolling_counts.update_layer(year, month)
+            self.clusters.update_frame(year, month, self.cumulative_mode)
+            self.spread_front.update_frame(year, month, self.cumulative_mode)
+            if self.choropleth_mode:
+                self.commune_matrix.update_layer(year, month, self.cumulative_mode)
+            elif self.density_mode:
+                self.density_grid.update_layer(year, month, self.cumulative_mode)
+            elif self.cumulative_mode:
                 for i, (year, month, layer) in enumerate(self.all_layers):
                     if (year, month, layer) in self.effective_layers[:index + 1]:
                         if layer:
@@ -948,62 +1540,105 @@ class VisualisationConstatsLoupDialog(QDialog):
             else:
                 self.layer_manager.set_layer_visibility(index, self.effective_layers)
 
-            # Update Dates layer
-            if hasattr(self, 'dates_layer') and self.dates_layer and self.dates_layer.isValid():
-                year, month, _ = self.effective_layers[index]
-                month_key = f"{year}_{month:02d}"
-                self.dates_layer.setSubsetString(f"month_key = '{month_key}'")
-                self.dates_layer.triggerRepaint()
-                dates_node = root.findLayer(self.dates_layer.id())
-                if dates_node:
-                    dates_node.setItemVisibilityChecked(True)
-                    print(f"Couche Dates rendue visible pour {month_key}")
-
-                # Appeler refresh_dates_layer_labels sans argument
-                self.refresh_dates_layer_labels()
+            # Mettre à jour la date affichée sur le canevas
+            self.update_date_overlay(index)
 
             self.iface.mapCanvas().refresh()
             year, month, layer = self.effective_layers[index]
             mode = 'Cumulatif' if self.cumulative_mode else 'Mensuel'
-            print(f"Affichage frame {index}: {year}_{month:02d}, couche {layer.name()}, {layer.featureCount()} entités, Mode: {mode}")
+            print(f"Affichage frame {index}: {year}_{month:02d}, couche {layer.name()}, {self.filter_engine.count(layer)} entités, Mode: {mode}")
         except Exception as e:
             print(f"ERREUR show_frame: {str(e)}")
             import traceback
             traceback.print_exc()
 
 
+    def frame_layers(self, index):
+        """Retourne les couches de constats à afficher pour la frame (ordre de rendu, la plus récente au-dessus)."""
+        if self.choropleth_mode or self.density_mode:
+            return []
+        if self.cumulative_mode:
+            layers = [layer for _, _, layer in self.effective_layers[:index + 1] if layer]
+        else:
+            layers = [self.effective_layers[index][2]] if self.effective_layers[index][2] else []
+        return list(reversed(layers))
+
+    def playback_base_layers(self):
+        """Couches non animées du canevas, dont les Communes."""
+        animated_ids = {layer.id() for _, _, layer in self.all_layers if layer}
+        for layer in (self.density_grid.layer, self.clusters.layer, self.spread_front.layer):
+            if layer is not None:
+                animated_ids.add(layer.id())
+        return [layer for layer in self.iface.mapCanvas().layers() if layer.id() not in animated_ids]
+
+    def playback_layers(self, index):
+        """Couches rendues par le moteur de lecture pour une frame.
+
+        Hors modes choroplèthe et densité, les couches non animées forment le fond de carte en cache du moteur ;
+        en modes choroplèthe et densité, les Communes ou la surface de densité changent à chaque frame.
+        """
+        frame_layers = self.frame_layers(index)
+        self.filter_engine.apply_to(frame_layers)
+        year, month, _ = self.effective_layers[index]
+        self.rolling_counts.update_layer(year, month)
+        overlays = self.overlay_layers(year, month, self.cumulative_mode)
+        if self.choropleth_mode:
+            # Le rendu démarre aussitôt et capture les valeurs de nb_constats de cette frame
+            self.commune_matrix.update_layer(year, month, self.cumulative_mode)
+            return overlays + frame_layers + self.playback_base_layers()
+        if self.density_mode:
+            return overlays + [self.density_grid.update_layer(year, month, self.cumulative_mode)]
+        return overlays + frame_layers
+
+    def update_date_overlay(self, index):
+        """Affiche la date de la frame dans l'incrustation du canevas."""
+        if self.date_overlay is None:
+            self.date_overlay = DateOverlayCanvasItemVisualisationConstats(self.iface.mapCanvas())
+        year, month, _ = self.effective_layers[index]
+        self.date_overlay.set_text(f"{year}_{month:02d}")
+
     def toggle_play(self):
         """Bascule entre lecture et pause de l'animation."""
         if self.is_playing:
-            self.timer.stop()
-            self.is_playing = False
-            self.play_button.setText("▶ Play")
+            self.stop_playback()
+            # Resynchroniser le canevas sur la frame affichée
+            self.show_frame(self.current_frame)
             print("Animation arrêtée")
         else:
             if not self.effective_layers:
                 print("Aucune couche disponible pour l'animation")
                 return
+            interval = int(self.time_step_spin.value() * 1000)
+            self.dropped_frames_label.setText("Frames perdues : 0")
+            basemap_layers = [] if self.choropleth_mode else self.playback_base_layers()
+            if not self.playback_engine.start(len(self.effective_layers), self.current_frame, interval,
+                                              self.playback_layers, basemap_layers):
+                return
             self.is_playing = True
             self.play_button.setText("⏸ Pause")
-            interval = int(self.time_step_spin.value() * 1000)
-            self.timer.start(interval)
             print(f"Animation démarrée, intervalle: {interval}ms")
 
-    def next_frame(self):
-        """Passe à la frame suivante dans l'animation."""
-        if not self.effective_layers:
-            print("Aucune couche disponible dans next_frame")
-            self.timer.stop()
+    def stop_playback(self):
+        """Arrête le moteur de lecture s'il tourne."""
+        if self.is_playing:
+            self.playback_engine.stop()
             self.is_playing = False
             self.play_button.setText("▶ Play")
-            return
-        self.current_frame += 1
-        if self.current_frame >= len(self.effective_layers):
-            self.current_frame = 0
-            print("Fin de l'animation, retour au début")
-        self.slider.setValue(self.current_frame)
-        self.show_frame(self.current_frame)
-        print(f"Frame suivante affichée: index {self.current_frame}")
+
+    def playback_frame_shown(self, index):
+        """Synchronise le slider avec la frame affichée par le moteur, sans rendu du canevas."""
+        self.current_frame = index
+        self.update_date_overlay(index)
+        self.slider.blockSignals(True)
+        self.slider.setValue(index)
+        self.slider.blockSignals(False)
+
+    def update_buffer_indicator(self, filled, capacity):
+        self.buffer_bar.setMaximum(max(1, capacity))
+        self.buffer_bar.setValue(filled)
+
+    def update_dropped_frames(self, count):
+        self.dropped_frames_label.setText(f"Frames perdues : {count}")
 
     def create_point_for_feature(self, point_layer, feature, match):
         """Crée un point pour un constat."""
@@ -0,0 +1,207 @@
+# encoder_visualisation_constats.py
+from PyQt5.QtGui import QImage
+import os
+import subprocess
+import threading
+from .export_session_visualisation_constats import ExportCanceledVisualisationConstats
+
+# Formats de sortie de l'animation
+VIDEO_FORMATS = {
+    "mp4": {"label": "MP4 (H.264)", "extension": "mp4"},
+    "webm": {"label": "WebM (VP9)", "extension": "webm"},
+    "gif": {"label": "GIF animé", "extension": "gif"},
+    "apng": {"label": "PNG animé (APNG)", "extension": "png"},
+}
+
+# Vitesse d'encodage : preset x264 et réglages équivalents de libvpx-vp9
+SPEED_PRESETS = {
+    "ultrafast": {"label": "Brouillon (ultrafast)", "vp9": ["-deadline", "realtime", "-cpu-used", "8"]},
+    "veryfast": {"label": "Rapide (veryfast)", "vp9": ["-deadline", "good", "-cpu-used", "5"]},
+    "medium": {"label": "Standard (medium)", "vp9": ["-deadline", "good", "-cpu-used", "2"]},
+    "slow": {"label": "Finale (slow)", "vp9": ["-deadline", "good", "-cpu-used", "1"]},
+}
+
+# width = 0 : résolution des frames rendues
+DEFAULT_ENCODING = {"format": "mp4", "framerate": 2, "crf": 23, "speed": "medium", "width": 0}
+
+# Une frame A4 à 300 dpi donne un GIF de plusieurs centaines de Mo : largeur réduite par défaut
+GIF_DEFAULT_WIDTH = 800
+
+
+def encoding_extension(encoding):
+    return VIDEO_FORMATS[dict(DEFAULT_ENCODING, **(encoding or {}))["format"]]["extension"]
+
+
+class FfmpegPipeEncoderVisualisationConstats:
+    """Encode les frames rendues en les envoyant brutes (RGBA) à ffmpeg sur son entrée standard.
+
+    ffmpeg est lancé avant la première frame : l'encodage se fait pendant le rendu,
+    sans PNG intermédiaires sur le disque. Avec total_frames renseigné, on_progress(fraction)
+    relaie l'avancement lu sur la sortie -progress de ffmpeg.
+    """
+
+    def __init__(self, output_file, encoding=None):
+        self.output_file = output_file
+        self.encoding = dict(DEFAULT_ENCODING, **(encoding or {}))
+        self.framerate = self.encoding["framerate"]
+        self.width = None
+        self.height = None
+        self.process = None
+        self.command = None
+        self.stderr_lines = []
+        self.stderr_thread = None
+        self.progress_thread = None
+        self.broken = False
+        self.total_frames = 0
+        self.frames_encoded = 0
+        self.on_progress = None
+        self.is_canceled = None
+
+    def output_args(self):
+        """Filtres et codec du format choisi."""
+        fmt = self.encoding["format"]
+        width = self.encoding["width"]
+        if fmt == "gif":
+            scale = f"scale={width or GIF_DEFAULT_WIDTH}:-1:flags=lanczos,"
+            # Une seule palette calculée sur toutes les frames, puis appliquée à chacune
+            return [
+                "-filter_complex", f"{scale}split[a][b];[a]palettegen=stats_mode=full[p];[b][p]paletteuse=dither=bayer:bayer_scale=5",
+                "-loop", "0"
+            ]
+        if fmt == "apng":
+            args = ["-vf", f"scale={width}:-1:flags=lanczos"] if width else []
+            return args + ["-plays", "0", "-f", "apng"]
+        filters = [f"scale={width}:-2:flags=lanczos"] if width else []
+        # yuv420p impose des dimensions paires
+        filters.append("pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white")
+        args = ["-vf", ",".join(filters)]
+        if fmt == "webm":
+            return args + [
+                "-c:v", "libvpx-vp9", "-crf", str(self.encoding["crf"]), "-b:v", "0",
+                *SPEED_PRESETS[self.encoding["speed"]]["vp9"],
+                "-pix_fmt", "yuv420p"
+            ]
+        return args + [
+            "-c:v", "libx264", "-preset", self.encoding["speed"], "-crf", str(self.encoding["crf"]),
+            "-pix_fmt", "yuv420p"
+        ]
+
+    def launch(self, command, stdin=None):
+        """Démarre ffmpeg ; sa progression (-progress) est lue sur stdout, ses erreurs sur stderr."""
+        self.command = command
+        self.stderr_lines = []
+        self.frames_encoded = 0
+        creationflags = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
+        self.process = subprocess.Popen(
+            command, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            creationflags=creationflags
+        )
+        self.stderr_thread = threading.Thread(target=self.read_stderr, daemon=True)
+        self.stderr_thread.start()
+
+    def start(self, width, height):
+        self.width, self.height = width, height
+        self.launch([
+            "ffmpeg",
+            "-y",  # Overwrite output
+            "-loglevel", "error",
+            "-progress", "pipe:1", "-nostats",
+            "-f", "rawvideo",
+            "-pix_fmt", "rgba",
+            "-s", f"{width}x{height}",
+            "-framerate", f"{self.framerate:.6g}",
+            "-i", "-",
+            *self.output_args(),
+            self.output_file
+        ], stdin=subprocess.PIPE)
+        self.progress_thread = threading.Thread(target=self.read_progress, daemon=True)
+        self.progress_thread.start()
+        print(f"FFmpeg démarré en flux: {width}x{height} @ {self.framerate:.6g} i/s, "
+              f"{self.encoding['format']} -> {self.output_file}")
+
+    def run_pass(self, args, pass_index=0, passes=1):
+        """Exécute une passe ffmpeg sur des fichiers en relayant sa progression ; lève CalledProcessError en cas d'échec."""
+        self.launch(["ffmpeg", "-y", "-loglevel", "error", "-progress", "pipe:1", "-nostats"] + args)
+        for line in self.process.stdout:
+            if self.is_canceled and self.is_canceled():
+                self.abort()
+                raise ExportCanceledVisualisationConstats()
+            self.parse_progress(line, pass_index, passes)
+        self.process.stdout.close()
+        returncode = self.process.wait()
+        self.stderr_thread.join(timeout=5)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command, stderr=b"".join(self.stderr_lines))
+
+    def encode_images(self, pattern, work_dir):
+        """Encode une séquence de PNG déjà écrits (rendu parallèle).
+
+        Pour le GIF, la palette est calculée une fois dans work_dir puis réutilisée pour toutes les frames.
+        """
+        input_args = ["-framerate", f"{self.framerate:.6g}", "-i", pattern]
+        if self.encoding["format"] == "gif":
+            palette = os.path.join(work_dir, "palette.png")
+            scale = f"scale={self.encoding['width'] or GIF_DEFAULT_WIDTH}:-1:flags=lanczos"
+            self.run_pass(input_args + ["-vf", f"{scale},palettegen=stats_mode=full", palette], 0, 2)
+            self.run_pass(input_args + ["-i", palette, "-lavfi", f"{scale}[x];[x][1:v]paletteuse=dither=bayer:bayer_scale=5",
+                                        "-loop", "0", self.output_file], 1, 2)
+        else:
+            self.run_pass(input_args + self.output_args() + [self.output_file])
+        print(f"Encodage terminé: {self.output_file}")
+
+    def parse_progress(self, line, pass_index=0, passes=1):
+        """Lit une ligne clé=valeur de -progress et relaie la part des frames encodées."""
+        key, _, value = line.decode(errors="replace").strip().partition("=")
+        if key != "frame" or not value.isdigit():
+            return
+        self.frames_encoded = int(value)
+        if self.on_progress and self.total_frames:
+            self.on_progress((pass_index + min(1.0, self.frames_encoded / self.total_frames)) / passes)
+
+    def read_progress(self):
+        for line in self.process.stdout:
+            self.parse_progress(line)
+        self.process.stdout.close()
+
+    def read_stderr(self):
+        for line in self.process.stderr:
+            self.stderr_lines.append(line)
+        self.process.stderr.close()
+
+    def write(self, image):
+        """Envoie une frame (QImage) ; ffmpeg est démarré à la taille de la première frame."""
+        if self.process is None:
+            self.start(image.width(), image.height())
+        if self.broken:
+            return
+        if image.width() != self.width or image.height() != self.height:
+            image = image.scaled(self.width, self.height)
+        image = image.convertToFormat(QImage.Format_RGBA8888)
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        try:
+            self.process.stdin.write(bytes(bits))
+        except (BrokenPipeError, OSError):
+            # ffmpeg s'est arrêté : l'erreur est remontée par finish()
+            self.broken = True
+
+    def finish(self):
+        """Ferme le flux et attend la fin de l'encodage ; lève CalledProcessError en cas d'échec."""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        returncode = self.process.wait()
+        for thread in (self.stderr_thread, self.progress_thread):
+            if thread:
+                thread.join(timeout=5)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command, stderr=b"".join(self.stderr_lines))
+        print(f"Encodage terminé: {self.output_file}")
+
+    def abort(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
@@ -0,0 +1,86 @@
+# export_manifest_visualisation_constats.py
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = "manifest_export_constats.json"
+
+
+class ExportManifestVisualisationConstats:
+    """Manifeste d'un dossier d'export PNG : empreinte des entrées de chaque image déjà écrite.
+
+    Une nouvelle exécution ne rend que les images absentes ou dont les entrées ont changé.
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.output_dir = output_dir
+        self.frames = {}
+        self.layer_fingerprints = {}
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.frames = json.load(f).get("frames", {})
+        except (OSError, ValueError) as e:
+            print(f"ERREUR lecture manifeste {self.path}: {str(e)}")
+            self.frames = {}
+
+    def save(self):
+        """Écrit le manifeste via un fichier temporaire pour qu'un arrêt brutal ne le corrompe pas."""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, mode='w', encoding='utf-8') as f:
+            json.dump({"version": 1, "frames": self.frames}, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def layer_fingerprint(self, layer):
+        """Nom, filtre, nombre d'entités, contenu et rendu de la couche, calculés une fois par export."""
+        if layer.id() not in self.layer_fingerprints:
+            renderer = layer.renderer()
+            self.layer_fingerprints[layer.id()] = [
+                layer.name(),
+                layer.subsetString(),
+                layer.featureCount(),
+                self.content_digest(layer),
+                renderer.dump() if renderer else ""
+            ]
+        return self.layer_fingerprints[layer.id()]
+
+    def content_digest(self, layer):
+        """Empreinte des entités retenues par le filtre : identifiant, attributs et géométrie (WKB).
+
+        Les points replacés au hasard par un nouveau traitement changent l'empreinte, même à effectifs égaux.
+        """
+        digest = hashlib.sha1()
+        for feature in layer.getFeatures():
+            digest.update(str(feature.id()).encode('utf-8'))
+            digest.update(repr(feature.attributes()).encode('utf-8'))
+            if feature.hasGeometry():
+                digest.update(bytes(feature.geometry().asWkb()))
+        return digest.hexdigest()
+
+    def frame_digest(self, frame, basemap_layers, extent, preset):
+        """Empreinte SHA-1 des entrées d'une frame : couches, filtres, styles, emprise, rendu et textes."""
+        content = {
+            "basemap": [self.layer_fingerprint(layer) for layer in basemap_layers],
+            "layers": [self.layer_fingerprint(layer) for layer in frame["layers"]],
+            "overlays": [self.layer_fingerprint(layer) + [expression] for layer, expression in frame.get("overlays", [])],
+            "extent": extent.toString(),
+            "preset": preset,
+            "title": frame["title"],
+            "date": frame["date"]
+        }
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_current(self, output, digest):
+        """Vrai si l'image existe et a été rendue avec les mêmes entrées."""
+        return self.frames.get(os.path.basename(output)) == digest and os.path.isfile(output)
+
+    def record(self, output, digest):
+        self.frames[os.path.basename(output)] = digest
+
+    def forget(self, output):
+        self.frames.pop(os.path.basename(output), None)
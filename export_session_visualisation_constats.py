@@ -0,0 +1,239 @@
+# export_session_visualisation_constats.py
+from qgis.core import (
+    QgsPrintLayout, QgsLayoutItemMap, QgsLayoutItemLabel, QgsLayoutExporter, QgsLayoutRenderContext,
+    QgsLayoutPoint, QgsLayoutSize, QgsProject, QgsUnitTypes, QgsTextFormat, QgsTextBufferSettings,
+    QgsMapRendererCustomPainterJob
+)
+from PyQt5.QtGui import QFont, QColor, QImage, QPainter
+from PyQt5.QtCore import QSize, QSizeF, QRect, QRectF, Qt
+import math
+from .basemap_cache_visualisation_constats import BasemapCacheVisualisationConstats
+
+PAGE_WIDTH_MM = 210
+PAGE_HEIGHT_MM = 297
+
+# Préréglages de rendu : "preview" sacrifie la résolution et les effets avancés pour un brouillon rapide
+EXPORT_PRESETS = {
+    "final": {"label": "Finale (300 dpi)", "dpi": 300, "advanced_effects": True},
+    "preview": {"label": "Aperçu rapide (96 dpi)", "dpi": 96, "advanced_effects": False},
+}
+
+
+class ExportCanceledVisualisationConstats(Exception):
+    """Export interrompu à la demande de l'utilisateur."""
+
+
+class ExportSessionVisualisationConstats:
+    """Layout A4 (carte, titre, date) et exporteur créés une fois et réutilisés pour toutes les frames.
+
+    Seuls le texte des étiquettes et la liste des couches de la carte changent d'une frame à l'autre.
+    La page est composée de la page vide et du fond de carte (Communes) en cache, des couches de la frame
+    dessinées dans l'emprise de la carte, puis des étiquettes rendues seules par-dessus.
+    """
+
+    def __init__(self, extent, project=None, preset="final", dpi=None, width=None):
+        self.extent = extent
+        self.project = project or QgsProject.instance()
+        self.preset = preset if preset in EXPORT_PRESETS else "final"
+        settings = EXPORT_PRESETS[self.preset]
+        if width:
+            # Largeur en pixels imposée : la résolution s'en déduit
+            dpi = width / (PAGE_WIDTH_MM / 25.4)
+        self.dpi = dpi or settings["dpi"]
+        self.image_size = QSize(
+            int(round(PAGE_WIDTH_MM / 25.4 * self.dpi)),
+            int(round(PAGE_HEIGHT_MM / 25.4 * self.dpi))
+        )
+        self.layout, self.map_item, self.title_item, self.date_item = self.create_layout()
+        flags = QgsLayoutRenderContext.FlagAntialiasing
+        if settings["advanced_effects"]:
+            flags |= QgsLayoutRenderContext.FlagUseAdvancedEffects
+        self.layout.renderContext().setFlags(flags)
+        self.layout.renderContext().setDpi(self.dpi)
+        self.exporter = QgsLayoutExporter(self.layout)
+        scale = self.dpi / 25.4
+        rect = self.map_item.sceneBoundingRect()
+        left, top = int(round(rect.left() * scale)), int(round(rect.top() * scale))
+        self.map_rect = QRect(left, top, int(round(rect.right() * scale)) - left, int(round(rect.bottom() * scale)) - top)
+        self.basemap = BasemapCacheVisualisationConstats()
+        self.basemap_layers = []
+        self.page_image = None
+        self.background = None
+        self.background_basemap = None
+        self.base_signature = None
+        self.base_image = None
+        self.reused_frames = 0
+        print(f"Session d'export créée: {self.image_size.width()}x{self.image_size.height()} px, {self.dpi:.0f} dpi ({self.preset})")
+
+    def matches(self, extent, preset):
+        return self.extent == extent and self.preset == preset
+
+    def create_layout(self):
+        """Construit le layout A4 portrait hors gestionnaire de layouts du projet."""
+        layout = QgsPrintLayout(self.project)
+        layout.initializeDefaults()
+        layout.pageCollection().pages()[0].setPageSize(
+            QgsLayoutSize(PAGE_WIDTH_MM, PAGE_HEIGHT_MM, QgsUnitTypes.LayoutMillimeters)
+        )
+        map_item = QgsLayoutItemMap(layout)
+        map_item.attemptMove(QgsLayoutPoint(10, 30, QgsUnitTypes.LayoutMillimeters))
+        map_item.attemptResize(QgsLayoutSize(190, 250, QgsUnitTypes.LayoutMillimeters))
+        map_item.setExtent(self.extent)
+        map_item.setKeepLayerSet(True)
+        layout.addLayoutItem(map_item)
+
+        title_item = QgsLayoutItemLabel(layout)
+        title_item.setText("Bilan des constats pour l'année YYYY, mois : MM")
+        text_format = QgsTextFormat()
+        text_format.setFont(QFont("Arial", 16))
+        text_format.setSize(16)
+        text_format.setColor(QColor("black"))
+        title_item.setTextFormat(text_format)
+        title_item.attemptResize(QgsLayoutSize(190, 12, QgsUnitTypes.LayoutMillimeters))
+        title_item.attemptMove(QgsLayoutPoint(10, 10, QgsUnitTypes.LayoutMillimeters))
+        layout.addLayoutItem(title_item)
+
+        # Date rouge à tampon blanc en haut à gauche de la carte
+        date_item = QgsLayoutItemLabel(layout)
+        date_item.setText("YYYY_MM")
+        date_format = QgsTextFormat()
+        date_format.setFont(QFont("Arial", 16, QFont.Bold))
+        date_format.setSize(16)
+        date_format.setColor(QColor("red"))
+        buffer = QgsTextBufferSettings()
+        buffer.setEnabled(True)
+        buffer.setSize(1)
+        buffer.setColor(QColor("white"))
+        date_format.setBuffer(buffer)
+        date_item.setTextFormat(date_format)
+        date_item.attemptResize(QgsLayoutSize(50, 10, QgsUnitTypes.LayoutMillimeters))
+        date_item.attemptMove(QgsLayoutPoint(14, 34, QgsUnitTypes.LayoutMillimeters))
+        layout.addLayoutItem(date_item)
+        return layout, map_item, title_item, date_item
+
+    def reset_cache(self):
+        self.base_signature = None
+        self.base_image = None
+        self.reused_frames = 0
+
+    def set_basemap(self, layers):
+        """Couches de fond (Communes) dessinées sous les couches de chaque frame."""
+        self.basemap_layers = list(layers)
+
+    def map_settings(self, layers):
+        """Réglages de rendu de la carte du layout, à la taille en pixels de la session."""
+        settings = self.map_item.mapSettings(
+            self.map_item.extent(), QSizeF(self.map_rect.width(), self.map_rect.height()), self.dpi, True
+        )
+        settings.setLayers(layers)
+        return settings
+
+    def map_image(self):
+        image = QImage(self.map_rect.width(), self.map_rect.height(), QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        return image
+
+    def paint_layers(self, image, layers, offset=None):
+        """Dessine les couches sur l'image, dans l'emprise de la carte si offset est la position de la carte."""
+        settings = self.map_settings(layers)
+        settings.setBackgroundColor(QColor(0, 0, 0, 0))
+        painter = QPainter(image)
+        try:
+            if offset is not None:
+                painter.translate(offset)
+                painter.setClipRect(0, 0, self.map_rect.width(), self.map_rect.height())
+            job = QgsMapRendererCustomPainterJob(settings, painter)
+            job.renderSynchronously()
+        finally:
+            painter.end()
+
+    def render_background(self):
+        """Page sans étiquettes avec le fond de carte ; recomposée seulement si le fond a été invalidé."""
+        if self.page_image is None:
+            self.page_image = self.render_page()
+        if not self.basemap_layers:
+            return self.page_image
+        basemap = self.basemap.get(self.map_settings(self.basemap_layers))
+        if self.background is None or basemap is not self.background_basemap:
+            self.background = self.page_image.copy()
+            painter = QPainter(self.background)
+            painter.drawImage(self.map_rect.topLeft(), basemap)
+            painter.end()
+            self.background_basemap = basemap
+        return self.background
+
+    def render_base(self, map_layers):
+        """Rend la page et la carte sans les étiquettes."""
+        image = self.render_background().copy()
+        if map_layers:
+            self.paint_layers(image, map_layers, self.map_rect.topLeft())
+        return image
+
+    def render_page(self):
+        """Rend la page seule, sans carte ni étiquettes."""
+        self.map_item.setVisible(False)
+        self.title_item.setVisible(False)
+        self.date_item.setVisible(False)
+        try:
+            return self.exporter.renderPageToImage(0, self.image_size, self.dpi)
+        finally:
+            self.map_item.setVisible(True)
+            self.title_item.setVisible(True)
+            self.date_item.setVisible(True)
+
+    def render_labels(self, frame, image):
+        """Rend uniquement le titre et la date de la frame, région par région, sur l'image."""
+        self.title_item.setText(frame["title"])
+        self.date_item.setText(frame["date"])
+        page = self.layout.pageCollection().pages()[0]
+        scale = self.dpi / 25.4
+        # Sans la page ni la carte, la région rendue est transparente hors du texte
+        page.setVisible(False)
+        self.map_item.setVisible(False)
+        painter = QPainter(image)
+        try:
+            for item in (self.title_item, self.date_item):
+                rect = item.sceneBoundingRect()
+                left, top = math.floor(rect.left() * scale), math.floor(rect.top() * scale)
+                width = math.ceil(rect.right() * scale) - left
+                height = math.ceil(rect.bottom() * scale) - top
+                region = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+                region.fill(Qt.transparent)
+                region_painter = QPainter(region)
+                self.exporter.renderRegion(region_painter, QRectF(left / scale, top / scale, width / scale, height / scale))
+                region_painter.end()
+                painter.drawImage(left, top, region)
+        finally:
+            painter.end()
+            page.setVisible(True)
+            self.map_item.setVisible(True)
+        return image
+
+    def render_frame(self, frame, map_layers, signature=None, accumulator=None):
+        """Rend la page de la frame en QImage à la taille de la session.
+
+        Si signature (ensemble des entités visibles) est identique à celle de la frame précédente,
+        le fond en cache est réutilisé et seules les étiquettes sont rendues.
+        Avec un accumulator (frames cumulées), seules les couches nouvelles de la frame sont dessinées ;
+        les autres couches de map_layers (couches d'analyse) sont redessinées par-dessus à chaque frame.
+        """
+        if signature is not None and signature == self.base_signature:
+            self.reused_frames += 1
+        else:
+            if accumulator:
+                self.base_image = accumulator.render(frame["layers"])
+                overlays = [layer for layer in map_layers if layer not in frame["layers"]]
+                if overlays:
+                    self.paint_layers(self.base_image, overlays, self.map_rect.topLeft())
+            else:
+                self.base_image = self.render_base(map_layers)
+            self.base_signature = signature
+        return self.render_labels(frame, self.base_image.copy())
+
+    def save_png(self, image, path):
+        """Enregistre une frame rendue en PNG en conservant la résolution dans les métadonnées."""
+        dots_per_meter = int(round(self.dpi / 0.0254))
+        image.setDotsPerMeterX(dots_per_meter)
+        image.setDotsPerMeterY(dots_per_meter)
+        if not image.save(path, "PNG"):
+            raise IOError(f"Impossible d'écrire {path}")
@@ -0,0 +1,98 @@
+# export_sinks_visualisation_constats.py
+from PyQt5.QtCore import Qt
+import os
+from .encoder_visualisation_constats import FfmpegPipeEncoderVisualisationConstats
+
+# Largeur (pixels) de la copie web des frames
+WEB_COPY_WIDTH = 1280
+
+
+def frame_png_name(frame):
+    return f"{frame['index']+1}_constats_{frame['year']:04d}_{frame['month']:02d}.png"
+
+
+class PngSinkVisualisationConstats:
+    """Séquence PNG numérotée, à la résolution du rendu (sans session : images du pool, déjà résolues)."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.session = None
+
+    def open(self, session, total_frames):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.session = session
+
+    def write(self, frame, image):
+        path = os.path.join(self.output_dir, frame_png_name(frame))
+        if self.session:
+            self.session.save_png(image, path)
+        elif not image.save(path, "PNG"):
+            raise IOError(f"Impossible d'écrire {path}")
+
+    def close(self):
+        print(f"Sortie PNG terminée: {self.output_dir}")
+
+    def abort(self):
+        pass
+
+
+class VideoSinkVisualisationConstats:
+    """Vidéo (MP4, WebM, GIF ou APNG) encodée en flux par ffmpeg pendant le rendu."""
+
+    def __init__(self, output_file, encoding=None):
+        self.output_file = output_file
+        self.encoder = FfmpegPipeEncoderVisualisationConstats(output_file, encoding)
+        self.finished = False
+
+    def open(self, session, total_frames):
+        self.encoder.total_frames = total_frames
+
+    def write(self, frame, image):
+        self.encoder.write(image)
+
+    def close(self):
+        self.encoder.finish()
+        self.finished = True
+
+    def abort(self):
+        """Arrête ffmpeg et supprime la vidéo incomplète (sans effet après close)."""
+        if self.finished:
+            return
+        self.encoder.abort()
+        if os.path.isfile(self.output_file):
+            os.remove(self.output_file)
+
+
+class WebCopySinkVisualisationConstats:
+    """Copie JPEG réduite de chaque frame, pour publication web."""
+
+    def __init__(self, output_dir, width=WEB_COPY_WIDTH, quality=85):
+        self.output_dir = output_dir
+        self.width = width
+        self.quality = quality
+
+    def open(self, session, total_frames):
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def write(self, frame, image):
+        path = os.path.join(self.output_dir, os.path.splitext(frame_png_name(frame))[0] + ".jpg")
+        if not image.scaledToWidth(self.width, Qt.SmoothTransformation).save(path, "JPG", self.quality):
+            raise IOError(f"Impossible d'écrire {path}")
+
+    def close(self):
+        print(f"Copie web terminée: {self.output_dir} ({self.width} px)")
+
+    def abort(self):
+        pass
+
+
+def create_sink(spec):
+    """Sortie d'export décrite par {"type": "png" | "video" | "web", "output": dossier ou fichier, ...}."""
+    kind = spec["type"]
+    if kind == "png":
+        return PngSinkVisualisationConstats(spec["output"])
+    if kind == "video":
+        return VideoSinkVisualisationConstats(spec["output"], spec.get("encoding"))
+    if kind == "web":
+        return WebCopySinkVisualisationConstats(spec["output"], spec.get("width", WEB_COPY_WIDTH))
+    raise ValueError(f"Type de sortie inconnu : {kind}")
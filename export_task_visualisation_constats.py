@@ -0,0 +1,139 @@
+# export_task_visualisation_constats.py
+from qgis.core import QgsTask
+import time
+import traceback
+from .animation_exporter_visualisation_constats import AnimationExporterVisualisationConstats
+from .export_session_visualisation_constats import ExportCanceledVisualisationConstats
+
+# Part (en %) du rendu des frames dans la progression d'un export vidéo, le reste revenant à l'encodage ffmpeg
+VIDEO_RENDER_SHARE = 80
+
+
+class ExportProgressVisualisationConstats:
+    """Avancement global d'un export et temps restant estimé.
+
+    Pendant le rendu, le temps restant se déduit du temps moyen mesuré par frame ;
+    ensuite, de la vitesse d'encodage lue sur la sortie -progress de ffmpeg.
+    """
+
+    def __init__(self, render_share=100):
+        self.render_share = render_share
+        self.started = time.perf_counter()
+        self.render_end = None
+        self.frames_done = 0
+        self.total_frames = 0
+        self.encoded = 0.0
+
+    def frame_done(self, done, total):
+        self.frames_done, self.total_frames = done, total
+        if done >= total:
+            self.render_end = time.perf_counter()
+
+    def encode_progress(self, fraction):
+        self.encoded = fraction
+
+    def percent(self):
+        rendered = self.frames_done / self.total_frames if self.total_frames else 0.0
+        return rendered * self.render_share + self.encoded * (100 - self.render_share)
+
+    def remaining(self):
+        """Secondes restantes estimées, ou None tant qu'aucune mesure n'est disponible."""
+        now = time.perf_counter()
+        if self.render_end is None:
+            if not self.frames_done:
+                return None
+            frame_time = (now - self.started) / self.frames_done
+            return frame_time * (self.total_frames - self.frames_done)
+        if self.render_share == 100:
+            return 0
+        if self.encoded <= 0:
+            return None
+        return (now - self.render_end) * (1 - self.encoded) / self.encoded
+
+    def remaining_text(self):
+        remaining = self.remaining()
+        if remaining is None:
+            return ""
+        minutes, seconds = divmod(int(round(remaining)), 60)
+        return f"reste ~ {minutes} min {seconds:02d} s" if minutes else f"reste ~ {seconds} s"
+
+
+class ExportTaskVisualisationConstats(QgsTask):
+    """Export PNG ou vidéo en tâche de fond, sur des copies des couches : QGIS reste utilisable pendant l'export.
+
+    kind vaut "png" (output : dossier) ou "video" (output : fichier) ; options reprend les paramètres nommés
+    de record_animation_to_png / record_animation_to_mp4 (workers, preset, cumulative, encoding).
+    Avec "variants" dans options, record_variants exporte une animation par variante dans le dossier output ;
+    avec "sinks" (kind "sinks"), record_animation_to_sinks rend chaque frame une fois pour toutes les sorties.
+    overlays : [(couche, frame_expression)] des couches d'analyse (foyers, front), copiées et filtrées à chaque frame.
+    Les layouts ne pouvant être utilisés hors du fil principal, les frames sont toujours rendues par le pool
+    de processus (un seul processus si workers vaut 1) ; la tâche attend le pool et lance ffmpeg.
+    """
+
+    def __init__(self, kind, layers, communes_layer, output, options, on_finished=None, overlays=()):
+        label = {"png": "PNG", "video": "vidéo", "sinks": "combiné"}.get(kind, kind)
+        super().__init__(f"Export {label} des constats loup", QgsTask.CanCancel)
+        self.kind = kind
+        self.output = output
+        self.options = options
+        self.on_finished = on_finished
+        self.error = None
+        # Copies (entités, filtre, style) faites dans le fil principal : les couches du projet restent modifiables
+        self.layers = [(year, month, layer.clone()) for year, month, layer in layers]
+        self.communes_layer = communes_layer.clone()
+        self.overlays = [(layer.clone(), frame_expression) for layer, frame_expression in overlays]
+        self.exporter = AnimationExporterVisualisationConstats(None)
+        self.exporter.pooled = True
+        self.exporter.on_frame = self.frame_done
+        self.exporter.on_encode = self.encode_progress
+        self.exporter.is_canceled = self.isCanceled
+        encodes = kind == "video" or any(spec["type"] == "video" for spec in options.get("sinks", []))
+        self.tracker = ExportProgressVisualisationConstats(VIDEO_RENDER_SHARE if encodes else 100)
+
+    def frame_done(self, done, total):
+        self.tracker.frame_done(done, total)
+        self.setProgress(self.tracker.percent())
+
+    def encode_progress(self, fraction):
+        self.tracker.encode_progress(fraction)
+        self.setProgress(self.tracker.percent())
+
+    def run(self):
+        try:
+            if "variants" in self.options:
+                result = self.exporter.record_variants(
+                    self.layers, output_dir=self.output, kind=self.kind, communes_layer=self.communes_layer,
+                    overlays=self.overlays, **self.options
+                )
+            elif self.kind == "sinks":
+                result = self.exporter.record_animation_to_sinks(
+                    self.layers, None, communes_layer=self.communes_layer, overlays=self.overlays, **self.options
+                )
+            elif self.kind == "png":
+                result = self.exporter.record_animation_to_png(
+                    self.layers, None, self.output, communes_layer=self.communes_layer, overlays=self.overlays,
+                    **self.options
+                )
+            else:
+                result = self.exporter.record_animation_to_mp4(
+                    self.layers, None, self.output, communes_layer=self.communes_layer, overlays=self.overlays,
+                    **self.options
+                )
+            if not result:
+                self.error = "Export non effectué"
+            return result
+        except ExportCanceledVisualisationConstats:
+            print(f"Export annulé: {self.output}")
+            return False
+        except Exception as e:
+            print(f"ERREUR ExportTask: {str(e)}")
+            traceback.print_exc()
+            if self.kind == "png":
+                self.error = f"Erreur lors de l'export PNG : {str(e)}"
+            else:
+                self.error = self.exporter.video_error_message(e, "combiné" if self.kind == "sinks" else "MP4")
+            return False
+
+    def finished(self, result):
+        if self.on_finished:
+            self.on_finished(self, result)
@@ -0,0 +1,105 @@
+# filter_engine_visualisation_constats.py
+from qgis.core import QgsFeatureRequest
+import numpy as np
+
+
+class FilterEngineVisualisationConstats:
+    """Filtres espèces/conclusions calculés sur des tableaux de codes entiers.
+
+    Les codes de chaque constat sont lus une seule fois après la création des couches ;
+    un changement de filtre ne coûte ensuite qu'un masque vectorisé, et l'expression
+    "IN (...)" n'est poussée qu'aux couches affichées, les autres étant filtrées à la demande.
+    """
+
+    def __init__(self):
+        self.layers = []
+        self.layer_positions = {}
+        self.species = np.zeros(0, dtype=np.int16)
+        self.conclusions = np.zeros(0, dtype=np.int16)
+        self.layer_index = np.zeros(0, dtype=np.int32)
+        self.species_count = 0
+        self.conclusion_count = 0
+        self.expression = ""
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.applied = {}
+
+    def build(self, layers, species_codes, conclusion_codes):
+        """Lit les champs Code_Elev / Code_Concl de chaque couche (avant tout filtre)."""
+        self.layers = [layer for layer in layers if layer and layer.isValid()]
+        self.layer_positions = {layer.id(): i for i, layer in enumerate(self.layers)}
+        self.species_count = max(species_codes.values(), default=-1) + 1
+        self.conclusion_count = max(conclusion_codes.values(), default=-1) + 1
+        species, conclusions, layer_index = [], [], []
+        for i, layer in enumerate(self.layers):
+            fields = layer.fields()
+            species_idx = fields.indexFromName("Code_Elev")
+            conclusion_idx = fields.indexFromName("Code_Concl")
+            if species_idx < 0 or conclusion_idx < 0:
+                print(f"Couche {layer.name()} sans champs de codes, ignorée par le moteur de filtre")
+                continue
+            request = QgsFeatureRequest()
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setSubsetOfAttributes([species_idx, conclusion_idx])
+            for feature in layer.dataProvider().getFeatures(request):
+                species.append(feature[species_idx] if feature[species_idx] is not None else -1)
+                conclusions.append(feature[conclusion_idx] if feature[conclusion_idx] is not None else -1)
+                layer_index.append(i)
+        self.species = np.asarray(species, dtype=np.int16)
+        self.conclusions = np.asarray(conclusions, dtype=np.int16)
+        self.layer_index = np.asarray(layer_index, dtype=np.int32)
+        self.expression = ""
+        self.counts = np.bincount(self.layer_index, minlength=len(self.layers))
+        self.applied = {}
+        print(f"Moteur de filtre initialisé: {len(self.layers)} couches, {len(self.species)} constats")
+
+    def compute(self, selected_species, selected_conclusions):
+        """Calcule le masque de sélection, les effectifs par couche et l'expression de filtre.
+
+        Une liste de sélection vide n'impose aucune contrainte sur la dimension correspondante.
+        """
+        species_mask = self.selection_mask(selected_species, self.species_count)
+        conclusion_mask = self.selection_mask(selected_conclusions, self.conclusion_count)
+        # Les codes -1 (valeur absente) ne sont retenus que si la dimension n'est pas filtrée
+        species_ok = np.append(species_mask, species_mask.all())[self.species]
+        conclusion_ok = np.append(conclusion_mask, conclusion_mask.all())[self.conclusions]
+        mask = species_ok & conclusion_ok
+        self.counts = np.bincount(self.layer_index[mask], minlength=len(self.layers))
+        clauses = []
+        if not species_mask.all():
+            clauses.append(f"\"Code_Elev\" IN ({', '.join(str(c) for c in np.flatnonzero(species_mask))})")
+        if not conclusion_mask.all():
+            clauses.append(f"\"Code_Concl\" IN ({', '.join(str(c) for c in np.flatnonzero(conclusion_mask))})")
+        self.expression = " AND ".join(clauses)
+        print(f"Expression de filtre calculée: {self.expression or '(aucune)'}, {int(mask.sum())} constats retenus")
+        return self.expression
+
+    def selection_mask(self, selected, size):
+        mask = np.zeros(size, dtype=bool)
+        codes = [c for c in selected if 0 <= c < size]
+        if not selected:
+            mask[:] = True
+        elif codes:
+            mask[codes] = True
+        return mask
+
+    def count(self, layer):
+        """Nombre de constats retenus pour la couche, sans relire ses entités."""
+        position = self.layer_positions.get(layer.id()) if layer else None
+        if position is None:
+            return layer.featureCount() if layer else 0
+        return int(self.counts[position])
+
+    def apply_to(self, layers):
+        """Pousse l'expression courante aux couches données si elles ne l'ont pas déjà."""
+        for layer in layers:
+            if not layer or layer.id() not in self.layer_positions:
+                continue
+            if self.applied.get(layer.id(), "") == self.expression:
+                continue
+            layer.setSubsetString(self.expression)
+            self.applied[layer.id()] = self.expression
+            layer.triggerRepaint()
+
+    def apply_all(self):
+        """Applique le filtre en attente à toutes les couches (export, sauvegarde)."""
+        self.apply_to(self.layers)
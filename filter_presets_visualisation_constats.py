@@ -0,0 +1,40 @@
+# filter_presets_visualisation_constats.py
+import re
+from .utils_visualisation_constats import normalize_string
+
+# Groupes de conclusions publiés chacun dans une animation (libellés des cases de conclusion)
+CONCLUSION_GROUPS = {
+    "Loup non écarté": ["Loup non écarté"],
+    "Grands prédateurs non écartés": ["Loup non écarté", "Lynx non écarté"],
+    "Cause indéterminée": [
+        "Cause mortalité indéterminée - dégâts indemnisés",
+        "Cause mortalité indéterminée - Sans indemnisation",
+        "Indéterminé"
+    ],
+    "Prédateurs écartés ou prédation exclue": ["Grands prédateurs écartés", "Prédation exclue"],
+}
+
+
+def filter_preset(name, especes=(), conclusions=()):
+    """Préréglage de filtre : libellés des cases espèces et conclusions cochées (liste vide : pas de filtre)."""
+    return {"name": name, "especes": list(especes), "conclusions": list(conclusions)}
+
+
+def species_presets(species):
+    """Une variante par espèce, toutes conclusions confondues."""
+    return [filter_preset(s, especes=[s]) for s in species]
+
+
+def conclusion_group_presets(conclusions):
+    """Une variante par groupe de CONCLUSION_GROUPS, limitée aux conclusions présentes."""
+    presets = []
+    for name, group in CONCLUSION_GROUPS.items():
+        present = [c for c in group if c in conclusions]
+        if present:
+            presets.append(filter_preset(name, conclusions=present))
+    return presets
+
+
+def variant_slug(name):
+    """Nom de fichier ou de dossier d'une variante."""
+    return re.sub(r"[^a-z0-9]+", "_", normalize_string(name)).strip("_") or "variante"
@@ -5,7 +5,7 @@ from qgis.core import (
     QgsTextFormat, QgsTextBufferSettings, QgsGeometry, QgsPointXY, QgsPalLayerSettings,
     QgsVectorLayerSimpleLabeling
 )
-from qgis.core import QgsExpression
+from qgis.core import QgsExpression, QgsFeatureRequest, QgsFields
 from PyQt5.QtWidgets import QMessageBox
 from PyQt5.QtGui import QColor, QFont
 from .utils_visualisation_constats import normalize_elevage, normalize_string
@@ -40,6 +40,121 @@ class LayerManagerVisualisationConstats:
             "Canin": "cross",
             "Autres": "circle"
         }
+        # Codes entiers utilisés par le moteur de filtre (champs Code_Elev / Code_Concl)
+        self.species_codes = {species: code for code, species in enumerate(self.species_shapes)}
+        self.conclusion_codes = {}
+
+    def prepare_conclusion_codes(self, ods_layer):
+        """Attribue un code entier à chaque valeur de C_tech_new (conclusions connues en premier)."""
+        values = set()
+        for feature in ods_layer.getFeatures():
+            value = str(feature["C_tech_new"] or "")
+            if value:
+                values.add(value)
+        ordered = [c for c in self.conclusion_colors if c in values] + sorted(values - set(self.conclusion_colors))
+        for value in ordered:
+            self.conclusion_codes.setdefault(value, len(self.conclusion_codes))
+        print(f"Codes conclusions: {self.conclusion_codes}")
+        return self.conclusion_codes
+
+    def extra_fields(self, ods_layer):
+        """Champs ajoutés aux couches de constats, sans doublon avec ceux de la couche ODS standardisée."""
+        fields = [
+            QgsField("Nom_init", QVariant.String),
+            QgsField("Nom_Insee", QVariant.String),
+            QgsField("C_tech_new", QVariant.String),
+            QgsField("Code_Elev", QVariant.Int),
+            QgsField("Code_Concl", QVariant.Int)
+        ]
+        existing = ods_layer.fields().names()
+        return [field for field in fields if field.name() not in existing]
+
+    def layer_fields(self, ods_layer):
+        """Champs des couches de constats : ceux de la couche ODS standardisée suivis de extra_fields."""
+        fields = QgsFields(ods_layer.fields())
+        for field in self.extra_fields(ods_layer):
+            fields.append(field)
+        return fields
+
+    def constat_attributes(self, fields, feature):
+        """Attributs d'un constat rangés par nom de champ dans fields, codes de filtre renseignés."""
+        attributes = [None] * fields.count()
+        for name, value in zip(feature.fields().names(), feature.attributes()):
+            index = fields.indexFromName(name)
+            if index >= 0:
+                attributes[index] = value
+        species_code, conclusion_code = self.code_attributes(feature)
+        attributes[fields.indexFromName("Code_Elev")] = species_code
+        attributes[fields.indexFromName("Code_Concl")] = conclusion_code
+        return attributes
+
+    def code_attributes(self, feature):
+        """Retourne [Code_Elev, Code_Concl] pour un constat de la couche ODS standardisée."""
+        species_code = self.species_codes.get(normalize_elevage(str(feature["Elevage"] or "")))
+        conclusion_code = self.conclusion_codes.get(str(feature["C_tech_new"] or ""))
+        return [species_code, conclusion_code]
+
+    def month_features(self, fields, month_features, matched_features):
+        """Constats appariés d'un mois, placés en points répartis dans leur commune, avec les champs fields."""
+        nom_init_idx = fields.indexFromName("Nom_init")
+        nom_insee_idx = fields.indexFromName("Nom_Insee")
+        c_tech_new_idx = fields.indexFromName("C_tech_new")
+
+        # Grouper les features par commune (nom_insee)
+        commune_to_features = defaultdict(list)
+        for feature in month_features:
+            if feature.id() in matched_features:
+                nom_insee = matched_features[feature.id()]['nom_insee']
+                commune_to_features[nom_insee].append(feature)
+
+        new_features = []
+        for nom_insee, features_list in commune_to_features.items():
+            if not features_list:
+                continue
+            # Récupérer la géométrie de la commune (identique pour toutes les features de cette commune)
+            first_feature_id = features_list[0].id()
+            matched_commune = matched_features[first_feature_id]['feature']
+            poly_geom = matched_commune.geometry()
+            num_points = len(features_list)
+            points = self.generate_distributed_points(poly_geom, num_points)
+
+            for i, feature in enumerate(features_list):
+                new_feature = QgsFeature(fields)
+                new_feature.setAttributes(self.constat_attributes(fields, feature))
+                nom_init = matched_features[feature.id()]['nom_init']
+                nom_insee = matched_features[feature.id()]['nom_insee']
+                new_feature.setAttribute(nom_init_idx, nom_init)
+                new_feature.setAttribute(nom_insee_idx, nom_insee)
+                c_tech_new = feature["C_tech_new"]
+                new_feature.setAttribute(c_tech_new_idx, c_tech_new)
+                if points[i] is None or points[i].isNull():
+                    print(f"Géométrie vide pour commune {nom_insee}, skip feature ID {feature.id()}")
+                    continue
+                new_feature.setGeometry(points[i])
+                new_features.append(new_feature)
+                print(f"Constat placé: ID={feature.id()}, Nom_init={nom_init}, Nom_Insee={nom_insee}, C_tech_new={c_tech_new}")
+        return new_features
+
+    def place_monthly_features(self, ods_layer, matched_features, data_by_month, progress_callback=None, is_canceled=None):
+        """Place les constats de chaque mois, sans créer de couche : utilisable hors du fil principal.
+
+        Retourne {(année, mois): [QgsFeature]}, ou None si is_canceled() devient vrai.
+        """
+        self.prepare_conclusion_codes(ods_layer)
+        fields = self.layer_fields(ods_layer)
+        placed = {}
+        keys = sorted(data_by_month.keys())
+        for i, key in enumerate(keys):
+            if is_canceled and is_canceled():
+                return None
+            placed[key] = self.month_features(fields, data_by_month[key], matched_features)
+            if progress_callback:
+                progress_callback((i + 1) * 100 / len(keys))
+        return placed
+
+    def global_features(self, fields, matched_features, data_by_month):
+        """Tous les constats appariés, placés en points répartis par commune (couche Constats_Globaux)."""
+        return self.month_features(fields, [f for fs in data_by_month.values() for f in fs], matched_features)
 
     def random_point_in_polygon(self, geom):
         """Génère un point aléatoire à l'intérieur du polygone."""
@@ -102,6 +217,27 @@ class LayerManagerVisualisationConstats:
             print(f"ERREUR add_layer_to_project: {str(e)}")
             return False
 
+    @staticmethod
+    def add_overlay_layer(layer):
+        """Ajoute une couche d'analyse (densité, foyers, front) au-dessus de toutes les autres.
+
+        La couche est placée en tête de la légende et, si le projet en a un, de l'ordre de rendu personnalisé.
+        """
+        QgsProject.instance().addMapLayer(layer, False)
+        root = QgsProject.instance().layerTreeRoot()
+        root.insertLayer(0, layer)
+        if root.hasCustomLayerOrder():
+            root.setCustomLayerOrder([layer] + [l for l in root.customLayerOrder() if l != layer])
+        return layer
+
+    @staticmethod
+    def apply_frame_filter(layer, expression, applied):
+        """Applique le filtre d'une frame s'il diffère du filtre déjà appliqué ; retourne le filtre en place."""
+        if expression != applied:
+            layer.setSubsetString(expression)
+            layer.triggerRepaint()
+        return expression
+
     def apply_commune_styling(self, layer):
         """Applique un style simple aux communes."""
         try:
@@ -131,13 +267,16 @@ class LayerManagerVisualisationConstats:
         except Exception as e:
             print(f"ERREUR add_commune_layer: {str(e)}")
    
-    def create_monthly_layers(self, ods_layer, communes_layer, matched_features, data_by_month):
+    def create_monthly_layers(self, ods_layer, communes_layer, matched_features, data_by_month, placed=None):
+        """Crée et ajoute au projet une couche par mois ; placed : constats déjà placés (place_monthly_features)."""
         layers = []
         try:
             sorted_keys = sorted(data_by_month.keys(), key=lambda x: (x[0], x[1]), reverse=True)
             print(f"Clés mensuelles triées: {sorted_keys}")
             ods_filename = os.path.basename(ods_layer.source())
             print(f"Nom du fichier ODS: {ods_filename}")
+            if placed is None:
+                placed = self.place_monthly_features(ods_layer, matched_features, data_by_month)
             for year, month in sorted_keys:
                 layer_name = f"constats_{year}_{month:02d}"
                 layer = QgsVectorLayer(
@@ -150,53 +289,12 @@ class LayerManagerVisualisationConstats:
                     continue
                 provider = layer.dataProvider()
                 provider.addAttributes(ods_layer.fields())
-                provider.addAttributes([
-                    QgsField("Nom_init", QVariant.String),
-                    QgsField("Nom_Insee", QVariant.String),
-                    QgsField("C_tech_new", QVariant.String)
-                ])
+                provider.addAttributes(self.extra_fields(ods_layer))
                 layer.updateFields()
                 layer.startEditing()
-                feature_count = 0
-                nom_init_idx = layer.fields().indexFromName("Nom_init")
-                nom_insee_idx = layer.fields().indexFromName("Nom_Insee")
-                c_tech_new_idx = layer.fields().indexFromName("C_tech_new")
-
-                # Grouper les features par commune (nom_insee)
-                commune_to_features = defaultdict(list)
-                for feature in data_by_month[(year, month)]:
-                    if feature.id() in matched_features:
-                        nom_insee = matched_features[feature.id()]['nom_insee']
-                        commune_to_features[nom_insee].append(feature)
-
-                for nom_insee, features_list in commune_to_features.items():
-                    if not features_list:
-                        continue
-                    # Récupérer la géométrie de la commune (identique pour toutes les features de cette commune)
-                    first_feature_id = features_list[0].id()
-                    matched_commune = matched_features[first_feature_id]['feature']
-                    poly_geom = matched_commune.geometry()
-                    num_points = len(features_list)
-                    points = self.generate_distributed_points(poly_geom, num_points)
-
-                    for i, feature in enumerate(features_list):
-                        new_feature = QgsFeature(layer.fields())
-                        attributes = feature.attributes() + [None, None, None]
-                        new_feature.setAttributes(attributes)
-                        nom_init = matched_features[feature.id()]['nom_init']
-                        nom_insee = matched_features[feature.id()]['nom_insee']
-                        new_feature.setAttribute(nom_init_idx, nom_init)
-                        new_feature.setAttribute(nom_insee_idx, nom_insee)
-                        c_tech_new = feature["C_tech_new"]
-                        new_feature.setAttribute(c_tech_new_idx, c_tech_new)
-                        if points[i] is None or points[i].isNull():
-                            print(f"Géométrie vide pour commune {nom_insee}, skip feature ID {feature.id()}")
-                            continue
-                        new_feature.setGeometry(points[i])
-                        provider.addFeature(new_feature)
-                        feature_count += 1
-                        print(f"Ajout entité à {layer_name}: ID={feature.id()}, Nom_init={nom_init}, Nom_Insee={nom_insee}, C_tech_new={c_tech_new}")
-
+                features = placed.get((year, month), [])
+                provider.addFeatures(features)
+                feature_count = len(features)
                 layer.commitChanges()
                 self.apply_combined_styling(layer)
                 QgsProject.instance().addMapLayer(layer, False)
@@ -214,7 +312,8 @@ class LayerManagerVisualisationConstats:
             traceback.print_exc()
             return []
 
-    def create_global_layer(self, ods_layer, matched_features, data_by_month):
+    def create_global_layer(self, ods_layer, matched_features, data_by_month, features=None):
+        """Crée la couche Constats_Globaux ; features : constats déjà placés (global_features)."""
         try:
             layer = QgsVectorLayer(
                 f"Point?crs={ods_layer.crs().authid()}",
@@ -226,57 +325,17 @@ class LayerManagerVisualisationConstats:
                 return None
             provider = layer.dataProvider()
             provider.addAttributes(ods_layer.fields())
-            provider.addAttributes([
-                QgsField("Nom_init", QVariant.String),
-                QgsField("Nom_Insee", QVariant.String),
-                QgsField("C_tech_new", QVariant.String)
-            ])
+            provider.addAttributes(self.extra_fields(ods_layer))
             layer.updateFields()
             layer.startEditing()
-            feature_count = 0
             ods_filename = os.path.basename(ods_layer.source())
             print(f"Nom du fichier ODS pour Constats_Globaux: {ods_filename}")
-            nom_init_idx = layer.fields().indexFromName("Nom_init")
-            nom_insee_idx = layer.fields().indexFromName("Nom_Insee")
-            c_tech_new_idx = layer.fields().indexFromName("C_tech_new")
-
-            # Grouper toutes les features par commune (nom_insee)
-            commune_to_features = defaultdict(list)
-            for feature_id, matched_info in matched_features.items():
-                for (year, month), features in data_by_month.items():
-                    for feature in features:
-                        if feature.id() == feature_id:
-                            nom_insee = matched_info['nom_insee']
-                            commune_to_features[nom_insee].append((feature, matched_info))
-                            break
-
-            for nom_insee, feat_list in commune_to_features.items():
-                if not feat_list:
-                    continue
-                # Récupérer la géométrie de la commune
-                matched_commune = feat_list[0][1]['feature']
-                poly_geom = matched_commune.geometry()
-                num_points = len(feat_list)
-                points = self.generate_distributed_points(poly_geom, num_points)
-
-                for i, (feature, matched_info) in enumerate(feat_list):
-                    new_feature = QgsFeature(layer.fields())
-                    attributes = feature.attributes() + [None, None, None]
-                    new_feature.setAttributes(attributes)
-                    nom_init = matched_info['nom_init']
-                    nom_insee = matched_info['nom_insee']
-                    new_feature.setAttribute(nom_init_idx, nom_init)
-                    new_feature.setAttribute(nom_insee_idx, nom_insee)
-                    c_tech_new = feature["C_tech_new"]
-                    new_feature.setAttribute(c_tech_new_idx, c_tech_new)
-                    if points[i] is None or points[i].isNull():
-                        print(f"Géométrie vide pour commune {nom_insee}, skip feature ID {feature.id()}")
-                        continue
-                    new_feature.setGeometry(points[i])
-                    provider.addFeature(new_feature)
-                    feature_count += 1
-                    print(f"Ajout entité à Constats_Globaux: ID={feature.id()}, Nom_init={nom_init}, Nom_Insee={nom_insee}, C_tech_new={c_tech_new}")
-
+            if features is None:
+                if not self.conclusion_codes:
+                    self.prepare_conclusion_codes(ods_layer)
+                features = self.global_features(layer.fields(), matched_features, data_by_month)
+            provider.addFeatures(features)
+            feature_count = len(features)
             layer.commitChanges()
             self.apply_combined_styling(layer)
             QgsProject.instance().addMapLayer(layer, False)
@@ -336,87 +395,69 @@ class LayerManagerVisualisationConstats:
         except Exception as e:
             print(f"ERREUR apply_combined_styling: {str(e)}")
 
-    def create_dates_layer(self, layers, crs):
-        """Crée une couche de points pour les dates avec étiquettes."""
+    def range_commune(self, communes_layer, departements=("21",)):
+        """Déplace la couche 'Communes' dans un groupe dédié en bas de la légende avec filtre INSEE_DEP."""
+        if not communes_layer:
+            print("ERREUR: Couche Communes non fournie")
+            return None
         try:
-            # Créer la couche
-            dates_layer = QgsVectorLayer("Point?crs=EPSG:2154", "Dates", "memory")
-            if not dates_layer.isValid():
-                print("Erreur: Impossible de créer la couche Dates")
-                return None
-            # Ajouter les champs
-            provider = dates_layer.dataProvider()
-            provider.addAttributes([
-                QgsField("year", QVariant.Int),
-                QgsField("month", QVariant.Int),
-                QgsField("month_key", QVariant.String)
-            ])
-            dates_layer.updateFields()
-            # Créer les entités
-            dates_layer.startEditing()
-            point_geom = QgsGeometry.fromPointXY(QgsPointXY(863800, 6764000))
-            created_dates = []
-            for year, month, constats_layer in layers:
-                if not constats_layer or not constats_layer.isValid():
-                    print(f"Couche constats_{year}_{month:02d} est None ou non valide, ignorée")
-                    continue
-                month_key = f"{year}_{month:02d}"
-                feature = QgsFeature(dates_layer.fields())
-                feature.setAttributes([year, month, month_key])
-                feature.setGeometry(point_geom)
-                provider.addFeature(feature)
-                created_dates.append(month_key)
-            dates_layer.commitChanges()
-            if not created_dates:
-                print("AVERTISSEMENT: Aucune entité ajoutée à la couche Dates")
-                return None
-            # Configurer les étiquettes
-            text_format = QgsTextFormat()
-            text_format.setFont(QFont("Arial", 16, QFont.Bold))
-            text_format.setColor(QColor("red"))
-            buffer = QgsTextBufferSettings()
-            buffer.setEnabled(True)
-            buffer.setSize(1)
-            buffer.setColor(QColor("white"))
-            text_format.setBuffer(buffer)
-            label_settings = QgsPalLayerSettings()
-            label_settings.fieldName = "to_string(\"year\") || '_' || lpad(to_string(\"month\"), 2, '0')"
-            label_settings.enabled = True
-            label_settings.placement = QgsPalLayerSettings.Placement.OverPoint
-            label_settings.setFormat(text_format)
-            dates_layer.setLabeling(QgsVectorLayerSimpleLabeling(label_settings))
-            dates_layer.setLabelsEnabled(True)
-            # Symbole invisible
-            symbol = QgsMarkerSymbol.createSimple({
-                'name': 'circle',
-                'color': 'red',
-                'size': '0',
-                'outline_color': 'black',
-                'outline_width': '0.5'
-            })
-            renderer = QgsSingleSymbolRenderer(symbol)
-            dates_layer.setRenderer(renderer)
-            dates_layer.updateExtents()
-            dates_layer.triggerRepaint()
-            # Ajouter la couche au projet
-            QgsProject.instance().addMapLayer(dates_layer, False)
             root = QgsProject.instance().layerTreeRoot()
-            group = root.findGroup("Constats")
+            group_name = "Communes"
+            group = root.findGroup(group_name)
             if not group:
-                group = root.insertGroup(0, "Constats")
-            group.addLayer(dates_layer)
-            layer_node = root.findLayer(dates_layer.id())
+                group = root.insertGroup(len(root.children()), group_name)
+
+            # Créer une couche mémoire filtrée
+            clone = QgsVectorLayer(
+                f"Polygon?crs={communes_layer.crs().authid()}",
+                "Communes",  # Keep original name for PNG export compatibility
+                "memory"
+            )
+            if not clone.isValid():
+                print("Erreur: Impossible de créer la couche clone des Communes")
+                return None
+
+            # Copier les champs
+            clone_data_provider = clone.dataProvider()
+            clone_data_provider.addAttributes(communes_layer.fields())
+            clone.updateFields()
+
+            # Créer une expression de filtre
+            codes = ", ".join(QgsExpression.quotedString(str(code)) for code in departements)
+            expression = QgsExpression(f'"INSEE_DEP" IN ({codes})')
+            if not expression.hasParserError():
+                # Appliquer l'expression et ajouter les entités filtrées
+                it = communes_layer.getFeatures(QgsFeatureRequest(expression))
+                clone.startEditing()
+                for feature in it:
+                    new_feature = QgsFeature(clone.fields())
+                    new_feature.setGeometry(feature.geometry())
+                    new_feature.setAttributes(feature.attributes())
+                    clone_data_provider.addFeature(new_feature)
+                clone.commitChanges()
+                print(f"Filtre appliqué à Communes: {clone.featureCount()} entités")
+            else:
+                print(f"Erreur dans l'expression: {expression.parserErrorString()}")
+                return None
+
+            # Supprimer l'ancienne couche
+            QgsProject.instance().removeMapLayer(communes_layer.id())
+
+            # Ajouter la nouvelle couche au groupe Communes
+            QgsProject.instance().addMapLayer(clone, False)
+            group.addLayer(clone)
+            self.apply_commune_styling(clone)
+
+            layer_node = group.findLayer(clone.id())
             if layer_node:
                 layer_node.setItemVisibilityChecked(True)
-            self.iface.mapCanvas().refresh()
-            print(f"Couche Dates ajoutée au projet, {dates_layer.featureCount()} entités")
-            return dates_layer
+
+            print(f"Couche Communes clonée et filtrée ajoutée, {clone.featureCount()} entités")
+            return clone
         except Exception as e:
-            print(f"ERREUR create_dates_layer: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            print(f"ERREUR range_commune: {str(e)}")
             return None
-           
+
     def zoom_to_communes(self, communes_layer):
         """Zoom sur l'emprise des communes."""
         try:
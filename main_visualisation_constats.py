@@ -1,20 +1,28 @@
 # main_visualisation_constats.py
 from qgis.utils import iface
-from qgis.core import Qgis
+from qgis.core import Qgis, QgsApplication
 from PyQt5.QtWidgets import QAction
 from PyQt5.QtGui import QIcon
 import os
 from .dialog_visualisation_constats import VisualisationConstatsLoupDialog
+from .processing_provider_visualisation_constats import ProcessingProviderVisualisationConstats
 
 class MainPluginVisualisationConstatsLoup:
     def __init__(self, iface):
         self.iface = iface
         self.action = None
         self.dialog = None
+        self.provider = None
         print("MainPluginVisualisationConstatsLoup initialized")  # Debug
 
+    def initProcessing(self):
+        """Enregistre le fournisseur Processing du plugin."""
+        self.provider = ProcessingProviderVisualisationConstats()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
     def initGui(self):
         """Initialise l'interface du plugin."""
+        self.initProcessing()
         self.action = QAction("Visualisation Constats Loup", self.iface.mainWindow())
         plugin_dir = os.path.dirname(__file__)
         icon_path = os.path.join(plugin_dir, "loup1.ico")
@@ -34,8 +42,11 @@ class MainPluginVisualisationConstatsLoup:
         if self.action:
             self.iface.removeToolBarIcon(self.action)
             self.action.deleteLater()
+        if self.provider:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
         self.dialog = None
         self.action = None
+        self.provider = None
         print("Plugin unloaded")  # Debug
 
     def run(self):
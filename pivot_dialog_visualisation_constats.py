@@ -0,0 +1,134 @@
+# pivot_dialog_visualisation_constats.py
+from PyQt5.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QFormLayout, QComboBox, QPushButton, QLabel,
+    QTableWidget, QTableWidgetItem, QFileDialog, QMessageBox
+)
+import time
+from .aggregation_cube_visualisation_constats import (
+    CUBE_DIMENSIONS, pivot_table, write_pivot_csv, write_pivot_ods
+)
+
+# Dimensions proposées en filtre (une valeur ou toutes)
+FILTER_DIMENSIONS = ["annee", "trimestre", "departement", "espece", "conclusion", "indemnisation"]
+ALL_VALUES = "(toutes)"
+
+
+class PivotDialogVisualisationConstats(QDialog):
+    """Tableau croisé à la carte sur le cube d'agrégation : lignes, colonnes, filtres, export CSV ou ODS."""
+
+    def __init__(self, cube, parent=None):
+        super().__init__(parent)
+        self.cube = cube
+        self.result = None
+        self.setWindowTitle("Tableau croisé des constats")
+        self.resize(900, 600)
+        layout = QVBoxLayout()
+        form = QFormLayout()
+        self.row_combos = [self.dimension_combo(), self.dimension_combo(allow_none=True)]
+        self.row_combos[0].setCurrentIndex(self.row_combos[0].findData("commune"))
+        self.column_combos = [self.dimension_combo(allow_none=True), self.dimension_combo(allow_none=True)]
+        self.column_combos[0].setCurrentIndex(self.column_combos[0].findData("annee"))
+        form.addRow("Lignes :", self.combo_row(self.row_combos))
+        form.addRow("Colonnes :", self.combo_row(self.column_combos))
+        self.filter_combos = {}
+        for name in FILTER_DIMENSIONS:
+            combo = QComboBox()
+            combo.addItem(ALL_VALUES)
+            for label in self.cube.labels(name):
+                combo.addItem(str(label), label)
+            combo.currentIndexChanged.connect(self.refresh)
+            self.filter_combos[name] = combo
+            form.addRow(f"{CUBE_DIMENSIONS[name]} :", combo)
+        layout.addLayout(form)
+        self.table = QTableWidget()
+        layout.addWidget(self.table)
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+        buttons = QHBoxLayout()
+        self.csv_button = QPushButton("Exporter en CSV")
+        self.csv_button.clicked.connect(lambda: self.export("csv"))
+        self.ods_button = QPushButton("Exporter en ODS")
+        self.ods_button.clicked.connect(lambda: self.export("ods"))
+        close_button = QPushButton("Fermer")
+        close_button.clicked.connect(self.accept)
+        buttons.addWidget(self.csv_button)
+        buttons.addWidget(self.ods_button)
+        buttons.addStretch()
+        buttons.addWidget(close_button)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+        for combo in self.row_combos + self.column_combos:
+            combo.currentIndexChanged.connect(self.refresh)
+        self.refresh()
+
+    def dimension_combo(self, allow_none=False):
+        combo = QComboBox()
+        if allow_none:
+            combo.addItem("—", None)
+        for name, label in CUBE_DIMENSIONS.items():
+            combo.addItem(label, name)
+        return combo
+
+    def combo_row(self, combos):
+        row = QHBoxLayout()
+        for combo in combos:
+            row.addWidget(combo)
+        return row
+
+    def selected(self, combos):
+        """Dimensions choisies, sans doublon ni case vide."""
+        names = []
+        for combo in combos:
+            name = combo.currentData()
+            if name and name not in names:
+                names.append(name)
+        return tuple(names)
+
+    def filters(self):
+        return {
+            name: [combo.currentData()] for name, combo in self.filter_combos.items()
+            if combo.currentIndex() > 0
+        }
+
+    def refresh(self):
+        """Recalcule le tableau croisé et l'affiche."""
+        try:
+            rows, columns = self.selected(self.row_combos), self.selected(self.column_combos)
+            columns = tuple(name for name in columns if name not in rows)
+            start = time.perf_counter()
+            self.result = (rows, columns, self.cube.query(rows, columns, self.filters()))
+            elapsed = (time.perf_counter() - start) * 1000
+            header, lines = pivot_table(*self.result)
+            self.table.clear()
+            self.table.setColumnCount(len(header))
+            self.table.setRowCount(len(lines))
+            self.table.setHorizontalHeaderLabels(header)
+            for i, line in enumerate(lines):
+                for j, value in enumerate(line):
+                    self.table.setItem(i, j, QTableWidgetItem(str(value)))
+            self.status_label.setText(f"{len(lines) - 1} lignes, calculé en {elapsed:.1f} ms")
+        except Exception as e:
+            self.result = None
+            self.status_label.setText(f"Erreur : {str(e)}")
+            print(f"ERREUR PivotDialog.refresh: {str(e)}")
+
+    def export(self, kind):
+        """Exporte le tableau affiché en CSV ou en ODS."""
+        if not self.result:
+            QMessageBox.warning(self, "Attention", "Aucun tableau croisé à exporter.")
+            return
+        file_filter = "Fichier CSV (*.csv)" if kind == "csv" else "Fichier ODS (*.ods)"
+        path, _ = QFileDialog.getSaveFileName(self, "Exporter le tableau croisé", f"tableau_croise.{kind}", file_filter)
+        if not path:
+            return
+        if not path.lower().endswith(f".{kind}"):
+            path += f".{kind}"
+        try:
+            if kind == "csv":
+                write_pivot_csv(path, *self.result)
+            else:
+                write_pivot_ods(path, *self.result)
+            QMessageBox.information(self, "Succès", f"Tableau croisé sauvegardé dans : {path}")
+        except Exception as e:
+            QMessageBox.critical(self, "Erreur", f"Erreur lors de l'export du tableau croisé : {str(e)}")
+            print(f"ERREUR PivotDialog.export: {str(e)}")
@@ -0,0 +1,200 @@
+# playback_visualisation_constats.py
+from qgis.core import QgsMapRendererParallelJob, QgsMapSettings
+from qgis.gui import QgsMapCanvasItem
+from PyQt5.QtCore import QTimer, QRectF, QPointF
+from PyQt5.QtGui import QColor
+from collections import deque
+from .basemap_cache_visualisation_constats import BasemapCacheVisualisationConstats
+
+
+class FrameCanvasItemVisualisationConstats(QgsMapCanvasItem):
+    """Affiche une image pré-rendue, sur son fond de carte éventuel, par-dessus tout le viewport du canevas."""
+
+    def __init__(self, canvas):
+        super().__init__(canvas)
+        self.canvas = canvas
+        self.image = None
+        self.basemap = None
+        self.setZValue(100)
+        self.updatePosition()
+
+    def set_image(self, image, basemap=None):
+        self.image = image
+        self.basemap = basemap
+        self.update()
+
+    def updatePosition(self):
+        # Les coordonnées de scène du canevas sont celles du viewport : on reste collé en (0, 0)
+        self.prepareGeometryChange()
+        self.setPos(QPointF(0, 0))
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.canvas.width(), self.canvas.height())
+
+    def paint(self, painter, option=None, widget=None):
+        if self.image is None or self.image.isNull():
+            return
+        if self.basemap is not None:
+            painter.drawImage(self.boundingRect(), self.basemap)
+        painter.drawImage(self.boundingRect(), self.image)
+
+
+class PlaybackEngineVisualisationConstats:
+    """Lecture fluide de l'animation : les frames à venir sont rendues en avance dans un tampon circulaire.
+
+    Les couches de fond (non animées) sont rendues une fois dans un cache et les frames sur fond transparent.
+    """
+
+    def __init__(self, canvas, buffer_size=8, max_jobs=2):
+        self.canvas = canvas
+        self.buffer_size = buffer_size
+        self.max_jobs = max_jobs
+        self.buffer = {}
+        self.buffer_order = deque()
+        self.jobs = {}
+        self.frame_count = 0
+        self.layers_for_frame = None
+        self.basemap_layers = []
+        self.basemap = BasemapCacheVisualisationConstats()
+        self.current_frame = 0
+        self.render_cursor = 0
+        self.dropped_frames = 0
+        self.is_playing = False
+        self.is_buffering = False
+        self.settings = None
+        self.canvas_item = None
+        self.on_frame = None
+        self.on_buffer = None
+        self.on_drop = None
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.tick)
+
+    def start(self, frame_count, start_frame, interval_ms, layers_for_frame, basemap_layers=None):
+        """Démarre la lecture à partir de start_frame.
+
+        layers_for_frame(index) retourne la liste des couches à rendre (ordre QgsMapSettings, la première au-dessus).
+        basemap_layers, dessinées sous chaque frame, ne doivent pas changer d'une frame à l'autre.
+        """
+        self.stop()
+        if frame_count <= 0:
+            return False
+        self.frame_count = frame_count
+        self.layers_for_frame = layers_for_frame
+        self.basemap_layers = list(basemap_layers or [])
+        self.current_frame = start_frame % frame_count
+        self.render_cursor = (self.current_frame + 1) % frame_count
+        self.dropped_frames = 0
+        self.settings = QgsMapSettings(self.canvas.mapSettings())
+        self.canvas_item = FrameCanvasItemVisualisationConstats(self.canvas)
+        self.canvas.extentsChanged.connect(self.invalidate)
+        self.is_playing = True
+        self.is_buffering = True
+        self.timer.start(max(1, int(interval_ms)))
+        self.fill_buffer()
+        self.notify_buffer()
+        print(f"Lecture démarrée: {frame_count} frames, tampon {self.buffer_size}, intervalle {interval_ms}ms")
+        return True
+
+    def stop(self):
+        """Arrête la lecture, annule les rendus en cours et retire l'image du canevas."""
+        self.timer.stop()
+        if self.is_playing:
+            try:
+                self.canvas.extentsChanged.disconnect(self.invalidate)
+            except TypeError:
+                pass
+        self.is_playing = False
+        self.is_buffering = False
+        for job in list(self.jobs.values()):
+            job.cancelWithoutBlocking()
+        self.jobs.clear()
+        self.buffer.clear()
+        self.buffer_order.clear()
+        if self.canvas_item:
+            self.canvas.scene().removeItem(self.canvas_item)
+            self.canvas_item = None
+        self.notify_buffer()
+
+    def set_interval(self, interval_ms):
+        if self.is_playing:
+            self.timer.setInterval(max(1, int(interval_ms)))
+
+    def invalidate(self):
+        """Vide le tampon (emprise ou données modifiées) et relance le pré-rendu."""
+        if not self.is_playing:
+            return
+        for job in list(self.jobs.values()):
+            job.cancelWithoutBlocking()
+        self.jobs.clear()
+        self.buffer.clear()
+        self.buffer_order.clear()
+        self.settings = QgsMapSettings(self.canvas.mapSettings())
+        self.render_cursor = (self.current_frame + 1) % self.frame_count
+        self.is_buffering = True
+        self.fill_buffer()
+        self.notify_buffer()
+
+    def fill_buffer(self):
+        """Lance des rendus parallèles jusqu'à remplir le tampon."""
+        while (self.is_playing and len(self.jobs) < self.max_jobs
+               and len(self.buffer) + len(self.jobs) < min(self.buffer_size, self.frame_count)):
+            index = self.render_cursor
+            if index in self.buffer or index in self.jobs:
+                break
+            self.render_cursor = (self.render_cursor + 1) % self.frame_count
+            settings = QgsMapSettings(self.settings)
+            settings.setLayers(self.layers_for_frame(index))
+            if self.basemap_layers:
+                settings.setBackgroundColor(QColor(0, 0, 0, 0))
+            job = QgsMapRendererParallelJob(settings)
+            job.finished.connect(lambda index=index, job=job: self.job_finished(index, job))
+            self.jobs[index] = job
+            job.start()
+
+    def job_finished(self, index, job):
+        if self.jobs.get(index) is not job:
+            return
+        del self.jobs[index]
+        self.buffer[index] = job.renderedImage()
+        self.buffer_order.append(index)
+        while len(self.buffer_order) > self.buffer_size:
+            self.buffer.pop(self.buffer_order.popleft(), None)
+        if self.is_buffering and len(self.buffer) >= min(self.buffer_size, self.frame_count) // 2 + 1:
+            self.is_buffering = False
+        self.fill_buffer()
+        self.notify_buffer()
+
+    def tick(self):
+        """Affiche la frame suivante si elle est prête, sinon compte une frame perdue."""
+        next_frame = (self.current_frame + 1) % self.frame_count
+        image = self.buffer.pop(next_frame, None) if not self.is_buffering else None
+        if image is None:
+            if not self.is_buffering:
+                self.dropped_frames += 1
+                if self.on_drop:
+                    self.on_drop(self.dropped_frames)
+            self.fill_buffer()
+            self.notify_buffer()
+            return
+        try:
+            self.buffer_order.remove(next_frame)
+        except ValueError:
+            pass
+        self.current_frame = next_frame
+        self.canvas_item.set_image(image, self.basemap_image())
+        if self.on_frame:
+            self.on_frame(next_frame)
+        self.fill_buffer()
+        self.notify_buffer()
+
+    def basemap_image(self):
+        """Fond de carte à l'emprise courante, rendu seulement après un changement d'emprise ou de style."""
+        if not self.basemap_layers:
+            return None
+        settings = QgsMapSettings(self.settings)
+        settings.setLayers(self.basemap_layers)
+        return self.basemap.get(settings)
+
+    def notify_buffer(self):
+        if self.on_buffer:
+            self.on_buffer(len(self.buffer), min(self.buffer_size, self.frame_count) if self.frame_count else self.buffer_size)
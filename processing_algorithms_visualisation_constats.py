@@ -0,0 +1,261 @@
+# processing_algorithms_visualisation_constats.py
+from qgis.core import (
+    QgsProcessing, QgsProcessingAlgorithm, QgsProcessingException, QgsProcessingParameterFile,
+    QgsProcessingParameterFeatureSource, QgsProcessingParameterVectorLayer, QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFileDestination, QgsProcessingParameterFolderDestination, QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum, QgsProcessingParameterNumber, QgsProcessingOutputNumber, QgsProcessingOutputFile,
+    QgsFeature, QgsFeatureRequest, QgsField, QgsFields, QgsFeatureSink, QgsWkbTypes
+)
+from PyQt5.QtCore import QVariant
+import os
+from .data_processor_visualisation_constats import DataProcessorVisualisationConstats
+from .layer_manager_visualisation_constats import LayerManagerVisualisationConstats
+from .animation_exporter_visualisation_constats import AnimationExporterVisualisationConstats
+from .export_session_visualisation_constats import EXPORT_PRESETS
+from .encoder_visualisation_constats import VIDEO_FORMATS, encoding_extension
+from .utils_visualisation_constats import generate_crosstab_data, write_crosstab_to_csv
+
+ODS_FILTER = "Tableur des constats (*.ods *.xlsx *.xls *.csv)"
+
+
+class ConstatsAlgorithmVisualisationConstats(QgsProcessingAlgorithm):
+    """Base commune des algorithmes du plugin."""
+
+    def group(self):
+        return "Constats loup"
+
+    def groupId(self):
+        return "constats_loup"
+
+    def createInstance(self):
+        return type(self)()
+
+    def load_ods(self, path):
+        ods_layer = DataProcessorVisualisationConstats().load_ods_layer(path)
+        if not ods_layer:
+            raise QgsProcessingException(f"Fichier des constats illisible : {path}")
+        return ods_layer
+
+    def match(self, parameters, context, feedback):
+        """Charge les constats, les standardise et les apparie aux communes (jointure floue)."""
+        ods_layer = self.load_ods(self.parameterAsFile(parameters, "INPUT_ODS", context))
+        communes = self.parameterAsSource(parameters, "COMMUNES", context)
+        if communes is None:
+            raise QgsProcessingException("Couche des communes invalide")
+        feedback.pushInfo(f"{ods_layer.featureCount()} constats chargés")
+        matched, unmatched_count, temp_ods_layer = DataProcessorVisualisationConstats().process_data(
+            ods_layer, communes, progress_callback=feedback.setProgress, is_canceled=feedback.isCanceled
+        )
+        if temp_ods_layer is None:
+            if feedback.isCanceled():
+                raise QgsProcessingException("Jointure annulée")
+            raise QgsProcessingException("Jointure des constats impossible")
+        feedback.pushInfo(f"{len(matched)} constats appariés, {unmatched_count} non joints")
+        return matched, unmatched_count, temp_ods_layer, communes
+
+    def add_input_parameters(self):
+        self.addParameter(QgsProcessingParameterFile("INPUT_ODS", "Fichier des constats", fileFilter=ODS_FILTER))
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            "COMMUNES", "Communes", [QgsProcessing.TypeVectorPolygon]
+        ))
+
+
+class JoinCommunesAlgorithmVisualisationConstats(ConstatsAlgorithmVisualisationConstats):
+    """Jointure floue des constats sur les communes, un point par constat au centre de sa commune."""
+
+    def name(self):
+        return "jointure_communes"
+
+    def displayName(self):
+        return "Jointure des constats aux communes"
+
+    def shortHelpString(self):
+        return ("Standardise les conclusions et les espèces des constats, puis les apparie aux communes par nom "
+                "(jointure floue). Les constats appariés sont placés au centre de leur commune.")
+
+    def initAlgorithm(self, config=None):
+        self.add_input_parameters()
+        self.addParameter(QgsProcessingParameterFeatureSink("OUTPUT", "Constats appariés", QgsProcessing.TypeVectorPoint))
+        self.addOutput(QgsProcessingOutputNumber("UNMATCHED", "Constats non joints"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        matched, unmatched_count, temp_ods_layer, communes = self.match(parameters, context, feedback)
+        fields = QgsFields(temp_ods_layer.fields())
+        for name in ("Nom_init", "Nom_Insee", "INSEE"):
+            if fields.indexFromName(name) < 0:
+                fields.append(QgsField(name, QVariant.String))
+        sink, dest_id = self.parameterAsSink(parameters, "OUTPUT", context, fields, QgsWkbTypes.Point, communes.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, "OUTPUT"))
+        total = max(1, temp_ods_layer.featureCount())
+        for i, feature in enumerate(temp_ods_layer.getFeatures()):
+            if feedback.isCanceled():
+                break
+            match = matched.get(feature.id())
+            if match:
+                new_feature = QgsFeature(fields)
+                attributes = feature.attributes() + [None] * (fields.count() - len(feature.attributes()))
+                new_feature.setAttributes(attributes)
+                new_feature["Nom_init"] = match['nom_init']
+                new_feature["Nom_Insee"] = match['nom_insee']
+                new_feature["INSEE"] = match['insee']
+                new_feature.setGeometry(match['feature'].geometry().pointOnSurface())
+                sink.addFeature(new_feature, QgsFeatureSink.FastInsert)
+            feedback.setProgress(int((i + 1) / total * 100))
+        return {"OUTPUT": dest_id, "UNMATCHED": unmatched_count}
+
+
+class MonthlyLayersAlgorithmVisualisationConstats(ConstatsAlgorithmVisualisationConstats):
+    """Constats regroupés par mois et répartis en points dans leur commune (couches mensuelles)."""
+
+    def name(self):
+        return "couches_mensuelles"
+
+    def displayName(self):
+        return "Constats mensuels répartis dans les communes"
+
+    def shortHelpString(self):
+        return ("Apparie les constats aux communes, les regroupe par mois de constat et place chaque constat "
+                "en un point réparti dans sa commune. Les champs Annee et Mois identifient la couche mensuelle.")
+
+    def initAlgorithm(self, config=None):
+        self.add_input_parameters()
+        self.addParameter(QgsProcessingParameterFeatureSink("OUTPUT", "Constats mensuels", QgsProcessing.TypeVectorPoint))
+        self.addOutput(QgsProcessingOutputNumber("MONTHS", "Nombre de mois"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        matched, _, temp_ods_layer, communes = self.match(parameters, context, feedback)
+        data_by_month = DataProcessorVisualisationConstats().group_data_by_month(temp_ods_layer)
+        if not data_by_month:
+            raise QgsProcessingException("Aucun groupe mensuel créé")
+        layer_manager = LayerManagerVisualisationConstats(None)
+        layer_manager.prepare_conclusion_codes(temp_ods_layer)
+        fields = QgsFields(temp_ods_layer.fields())
+        for field in layer_manager.extra_fields(temp_ods_layer) + [QgsField("Annee", QVariant.Int), QgsField("Mois", QVariant.Int)]:
+            fields.append(field)
+        sink, dest_id = self.parameterAsSink(parameters, "OUTPUT", context, fields, QgsWkbTypes.Point, communes.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, "OUTPUT"))
+        year_idx, month_idx = fields.indexFromName("Annee"), fields.indexFromName("Mois")
+        months = sorted(data_by_month)
+        for i, (year, month) in enumerate(months):
+            if feedback.isCanceled():
+                break
+            features = layer_manager.month_features(fields, data_by_month[(year, month)], matched)
+            for feature in features:
+                feature.setAttribute(year_idx, year)
+                feature.setAttribute(month_idx, month)
+            sink.addFeatures(features, QgsFeatureSink.FastInsert)
+            feedback.pushInfo(f"{year}_{month:02d}: {len(features)} constats")
+            feedback.setProgress(int((i + 1) / len(months) * 100))
+        return {"OUTPUT": dest_id, "MONTHS": len(months)}
+
+
+class CrosstabAlgorithmVisualisationConstats(ConstatsAlgorithmVisualisationConstats):
+    """Tableau croisé dynamique des constats (espèce et année × conclusion) en CSV."""
+
+    def name(self):
+        return "tableau_croise"
+
+    def displayName(self):
+        return "Tableau croisé des constats"
+
+    def shortHelpString(self):
+        return "Exporte en CSV le tableau croisé des constats par espèce, année et conclusion technique."
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFile("INPUT_ODS", "Fichier des constats", fileFilter=ODS_FILTER))
+        self.addParameter(QgsProcessingParameterFileDestination("OUTPUT", "Tableau croisé", "CSV (*.csv)"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        ods_layer = self.load_ods(self.parameterAsFile(parameters, "INPUT_ODS", context))
+        output_path = self.parameterAsFileOutput(parameters, "OUTPUT", context)
+        write_crosstab_to_csv(generate_crosstab_data(ods_layer), output_path)
+        return {"OUTPUT": output_path}
+
+
+class AnimationExportAlgorithmVisualisationConstats(ConstatsAlgorithmVisualisationConstats):
+    """Export des cartes mensuelles en PNG ou de l'animation (MP4, WebM, GIF, APNG)."""
+
+    FORMATS = ["png"] + list(VIDEO_FORMATS)
+
+    def name(self):
+        return "export_animation"
+
+    def displayName(self):
+        return "Export de l'animation des constats"
+
+    def shortHelpString(self):
+        return ("Découpe les constats mensuels (champs Annee et Mois) en une frame par mois et exporte les cartes "
+                "en PNG ou l'animation en vidéo dans le dossier de sortie.")
+
+    def flags(self):
+        # Le rendu des layouts se fait dans le thread principal
+        return super().flags() | QgsProcessingAlgorithm.FlagNoThreading
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterVectorLayer(
+            "CONSTATS", "Constats mensuels (champs Annee, Mois)", [QgsProcessing.TypeVectorPoint]
+        ))
+        self.addParameter(QgsProcessingParameterVectorLayer("COMMUNES", "Communes", [QgsProcessing.TypeVectorPolygon]))
+        self.addParameter(QgsProcessingParameterEnum(
+            "FORMAT", "Format", ["PNG (une image par mois)"] + [f["label"] for f in VIDEO_FORMATS.values()], defaultValue=0
+        ))
+        self.addParameter(QgsProcessingParameterBoolean("CUMULATIVE", "Cumuler les mois", defaultValue=False))
+        self.addParameter(QgsProcessingParameterEnum(
+            "PRESET", "Qualité", [p["label"] for p in EXPORT_PRESETS.values()], defaultValue=0
+        ))
+        self.addParameter(QgsProcessingParameterNumber(
+            "FRAMERATE", "Images par seconde (vidéo)", QgsProcessingParameterNumber.Double, 2, minValue=0.01
+        ))
+        self.addParameter(QgsProcessingParameterFolderDestination("OUTPUT_FOLDER", "Dossier de sortie"))
+        self.addOutput(QgsProcessingOutputFile("OUTPUT_FILE", "Vidéo"))
+
+    def monthly_layers(self, constats_layer, feedback):
+        """Une couche mémoire stylée par mois, triée chronologiquement."""
+        fields = constats_layer.fields()
+        if fields.indexFromName("Annee") < 0 or fields.indexFromName("Mois") < 0:
+            raise QgsProcessingException("La couche des constats doit avoir les champs Annee et Mois")
+        months = set()
+        for feature in constats_layer.getFeatures(QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)):
+            if feature["Annee"] is not None and feature["Mois"] is not None:
+                months.add((int(feature["Annee"]), int(feature["Mois"])))
+        layer_manager = LayerManagerVisualisationConstats(None)
+        layers = []
+        for year, month in sorted(months):
+            request = QgsFeatureRequest().setFilterExpression(f'"Annee" = {year} AND "Mois" = {month}')
+            layer = constats_layer.materialize(request)
+            layer.setName(f"constats_{year}_{month:02d}")
+            layer_manager.apply_combined_styling(layer)
+            layers.append((year, month, layer))
+        feedback.pushInfo(f"{len(layers)} couches mensuelles")
+        return layers
+
+    def processAlgorithm(self, parameters, context, feedback):
+        constats_layer = self.parameterAsVectorLayer(parameters, "CONSTATS", context)
+        communes_layer = self.parameterAsVectorLayer(parameters, "COMMUNES", context)
+        output_dir = self.parameterAsString(parameters, "OUTPUT_FOLDER", context)
+        fmt = self.FORMATS[self.parameterAsEnum(parameters, "FORMAT", context)]
+        preset = list(EXPORT_PRESETS)[self.parameterAsEnum(parameters, "PRESET", context)]
+        cumulative = self.parameterAsBool(parameters, "CUMULATIVE", context)
+        os.makedirs(output_dir, exist_ok=True)
+        layers = self.monthly_layers(constats_layer, feedback)
+
+        def progress(value):
+            if feedback.isCanceled():
+                raise QgsProcessingException("Export annulé")
+            feedback.setProgress(value)
+
+        exporter = AnimationExporterVisualisationConstats(None)
+        output_file = ""
+        if fmt == "png":
+            done = exporter.record_animation_to_png(layers, None, output_dir, progress, preset=preset,
+                                                    cumulative=cumulative, communes_layer=communes_layer)
+        else:
+            encoding = {"format": fmt, "framerate": self.parameterAsDouble(parameters, "FRAMERATE", context)}
+            output_file = os.path.join(output_dir, f"animation_constats_loup.{encoding_extension(encoding)}")
+            done = exporter.record_animation_to_mp4(layers, None, output_file, progress, preset=preset, encoding=encoding,
+                                                    cumulative=cumulative, communes_layer=communes_layer)
+        if not done:
+            raise QgsProcessingException("Export non effectué")
+        return {"OUTPUT_FOLDER": output_dir, "OUTPUT_FILE": output_file}
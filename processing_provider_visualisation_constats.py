@@ -0,0 +1,30 @@
+# processing_provider_visualisation_constats.py
+from qgis.core import QgsProcessingProvider
+from PyQt5.QtGui import QIcon
+import os
+from .processing_algorithms_visualisation_constats import (
+    JoinCommunesAlgorithmVisualisationConstats, MonthlyLayersAlgorithmVisualisationConstats,
+    CrosstabAlgorithmVisualisationConstats, AnimationExportAlgorithmVisualisationConstats
+)
+
+
+class ProcessingProviderVisualisationConstats(QgsProcessingProvider):
+    """Fournisseur Processing : étapes de la chaîne utilisables dans qgis_process, le modeleur et le traitement par lot."""
+
+    def loadAlgorithms(self):
+        for algorithm in (
+            JoinCommunesAlgorithmVisualisationConstats,
+            MonthlyLayersAlgorithmVisualisationConstats,
+            CrosstabAlgorithmVisualisationConstats,
+            AnimationExportAlgorithmVisualisationConstats
+        ):
+            self.addAlgorithm(algorithm())
+
+    def id(self):
+        return "visualisation_constats_loup"
+
+    def name(self):
+        return "Visualisation Constats Loup"
+
+    def icon(self):
+        return QIcon(os.path.join(os.path.dirname(__file__), "loup1.ico"))
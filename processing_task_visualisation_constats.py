@@ -0,0 +1,126 @@
+# processing_task_visualisation_constats.py
+from qgis.core import QgsApplication, QgsTask
+import traceback
+from .aggregation_cube_visualisation_constats import AggregationCubeVisualisationConstats
+
+# Étapes de calcul et part de la progression (en %) atteinte à la fin de chacune
+PROCESSING_STAGES = [
+    ("chargement", 10),
+    ("normalisation et jointure", 50),
+    ("regroupement par mois", 55),
+    ("cube d'agrégation", 60),
+    ("placement des constats", 90),
+    ("placement global", 100),
+]
+
+
+class ProcessingTaskVisualisationConstats(QgsTask):
+    """Étapes de calcul de run_processing (chargement, normalisation, jointure, regroupement, cube d'agrégation, placement) hors du fil de l'interface.
+
+    Aucune couche n'est ajoutée au projet ici : on_finished(task, result) est appelé dans le fil principal,
+    qui crée et enregistre les couches à partir des constats placés.
+    """
+
+    def __init__(self, ods_path, shp_path, data_processor, layer_manager, on_finished=None):
+        super().__init__("Traitement des constats loup", QgsTask.CanCancel)
+        self.ods_path = ods_path
+        self.shp_path = shp_path
+        self.data_processor = data_processor
+        self.layer_manager = layer_manager
+        self.on_finished = on_finished
+        self.stage_name = None
+        self.error = None
+        self.error_critical = False
+        self.ods_layer = None
+        self.communes_layer = None
+        self.temp_ods_layer = None
+        self.matched_features = {}
+        self.unmatched_count = 0
+        self.data_by_month = {}
+        self.cube = AggregationCubeVisualisationConstats()
+        self.placed = None
+        self.global_features = None
+
+    def start_stage(self, index):
+        """Passe à l'étape index ; retourne False si la tâche a été annulée."""
+        self.stage_name = PROCESSING_STAGES[index][0]
+        self.setProgress(PROCESSING_STAGES[index - 1][1] if index else 0)
+        print(f"Traitement : étape {self.stage_name}")
+        return not self.isCanceled()
+
+    def stage_progress(self, index, percent):
+        """Progression à l'intérieur de l'étape index (percent de 0 à 100)."""
+        start = PROCESSING_STAGES[index - 1][1] if index else 0
+        self.setProgress(start + (PROCESSING_STAGES[index][1] - start) * percent / 100)
+
+    def fail(self, message, critical=False):
+        self.error = message
+        self.error_critical = critical
+        return False
+
+    def run(self):
+        try:
+            if not self.start_stage(0):
+                return False
+            self.ods_layer, self.communes_layer = self.data_processor.load_data(self.ods_path, self.shp_path)
+            if not self.ods_layer or not self.communes_layer:
+                return self.fail("Couches ODS ou SHP non valides", critical=True)
+            if self.ods_layer.featureCount() == 0:
+                return self.fail("La couche ODS est vide")
+            if self.communes_layer.featureCount() == 0:
+                return self.fail("La couche Communes est vide")
+            print(f"ODS chargé: {self.ods_layer.featureCount()} entités")
+
+            if not self.start_stage(1):
+                return False
+            self.matched_features, self.unmatched_count, self.temp_ods_layer = self.data_processor.process_data(
+                self.ods_layer, self.communes_layer, lambda percent: self.stage_progress(1, percent), self.isCanceled
+            )
+            if self.isCanceled():
+                return False
+            if self.temp_ods_layer is None:
+                return self.fail("Jointure des constats impossible", critical=True)
+            print(f"Features appariées: {len(self.matched_features)}")
+
+            if not self.start_stage(2):
+                return False
+            self.data_by_month = self.data_processor.group_data_by_month(self.temp_ods_layer)
+            print(f"Groupes mensuels: {len(self.data_by_month)}")
+            if not self.data_by_month:
+                return self.fail("Aucun groupe mensuel créé")
+
+            if not self.start_stage(3):
+                return False
+            self.cube.build(self.matched_features, self.data_by_month)
+
+            if not self.start_stage(4):
+                return False
+            self.placed = self.layer_manager.place_monthly_features(
+                self.temp_ods_layer, self.matched_features, self.data_by_month,
+                lambda percent: self.stage_progress(4, percent), self.isCanceled
+            )
+            if self.placed is None:
+                return False
+
+            if not self.start_stage(5):
+                return False
+            self.global_features = self.layer_manager.global_features(
+                self.layer_manager.layer_fields(self.temp_ods_layer), self.matched_features, self.data_by_month
+            )
+            self.setProgress(100)
+
+            # Les couches créées dans ce fil doivent appartenir au fil principal pour être ajoutées au projet
+            main_thread = QgsApplication.instance().thread()
+            for layer in (self.ods_layer, self.communes_layer, self.temp_ods_layer):
+                layer.moveToThread(main_thread)
+            return not self.isCanceled()
+        except Exception as e:
+            print(f"ERREUR ProcessingTask ({self.stage_name}): {str(e)}")
+            traceback.print_exc()
+            return self.fail(f"Erreur pendant l'étape {self.stage_name} : {str(e)}", critical=True)
+
+    def finished(self, result):
+        if self.isCanceled():
+            print("Traitement annulé")
+        if self.on_finished:
+            self.on_finished(self, result)
@@ -0,0 +1,183 @@
+# render_pool_visualisation_constats.py
+from qgis.core import QgsProject, QgsVectorFileWriter
+import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import shutil
+import threading
+from .export_session_visualisation_constats import ExportCanceledVisualisationConstats
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "render_worker_visualisation_constats.py")
+
+
+class RenderPoolVisualisationConstats:
+    """Rendu des frames d'export par un pool de processus QGIS sans interface.
+
+    Le plan (couches de chaque frame, emprise, titre, filtre) est écrit sur disque avec les
+    couches en GeoPackage et leurs styles en QML ; chaque processus rend une frame sur N.
+    Une frame peut porter son propre filtre ("filter", variantes) : la couche n'est écrite qu'une fois.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = max(1, workers or (os.cpu_count() or 2) - 1)
+
+    def python_executable(self):
+        """Interpréteur Python de QGIS (sys.executable vaut qgis.exe sous Windows)."""
+        candidates = []
+        if os.path.basename(sys.executable).lower().startswith("python"):
+            candidates.append(sys.executable)
+        candidates += [
+            os.path.join(sys.exec_prefix, "python.exe"),
+            os.path.join(sys.exec_prefix, "python3.exe"),
+            os.path.join(sys.exec_prefix, "bin", "python3"),
+            os.path.join(sys.exec_prefix, "bin", "python"),
+        ]
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return candidate
+        return shutil.which("python3") or shutil.which("python") or sys.executable
+
+    def write_plan(self, plan, communes_layer, extent, outputs, work_dir, preset="final"):
+        """Écrit les couches utilisées par le plan et le fichier plan.json dans work_dir."""
+        exported = {}
+        files = {}
+        transform_context = QgsProject.instance().transformContext()
+
+        def export_layer(layer, layer_filter=None):
+            """Une entrée par couche et par filtre ; le fichier de la couche est partagé entre ses filtres."""
+            if layer_filter is None:
+                layer_filter = layer.subsetString()
+            if (layer.id(), layer_filter) in exported:
+                return exported[(layer.id(), layer_filter)]["key"]
+            if layer.id() not in files:
+                name = f"layer_{len(files):04d}"
+                path = os.path.join(work_dir, f"{name}.gpkg")
+                options = QgsVectorFileWriter.SaveVectorOptions()
+                options.driverName = "GPKG"
+                options.fileEncoding = "UTF-8"
+                result = QgsVectorFileWriter.writeAsVectorFormatV3(layer, path, transform_context, options)
+                if result[0] != QgsVectorFileWriter.NoError:
+                    raise RuntimeError(f"Écriture de {layer.name()} impossible : {result[1]}")
+                qml_path = os.path.join(work_dir, f"{name}.qml")
+                layer.saveNamedStyle(qml_path)
+                files[layer.id()] = (path, qml_path)
+            key = f"layer_{len(exported):04d}"
+            path, qml_path = files[layer.id()]
+            exported[(layer.id(), layer_filter)] = {
+                "key": key,
+                "name": layer.name(),
+                "path": path,
+                "qml": qml_path,
+                "filter": layer_filter
+            }
+            return key
+
+        communes_key = export_layer(communes_layer)
+        frames = []
+        for frame, output in zip(plan, outputs):
+            frames.append({
+                "index": frame["index"],
+                "title": frame["title"],
+                "date": frame["date"],
+                # Couches d'analyse (avec le filtre du mois) au-dessus des couches de constats
+                "layers": [export_layer(layer, expression) for layer, expression in frame.get("overlays", [])]
+                + [export_layer(layer, frame.get("filter")) for layer in frame["layers"]],
+                "output": output
+            })
+        job = {
+            "crs": communes_layer.crs().authid(),
+            "extent": [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()],
+            "preset": preset,
+            "basemap": [communes_key],
+            "layers": {info["key"]: info for info in exported.values()},
+            "frames": frames
+        }
+        plan_path = os.path.join(work_dir, "plan.json")
+        with open(plan_path, mode='w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False, indent=1)
+        print(f"Plan de rendu écrit: {plan_path}, {len(frames)} frames, {len(files)} couches, {len(exported)} filtres")
+        return plan_path
+
+    def render(self, plan, communes_layer, extent, outputs, progress_callback=None, preset="final", is_canceled=None,
+               rendered=None):
+        """Rend les frames du plan vers les chemins outputs ; progress_callback(frames_terminées, total).
+
+        Retourne l'ensemble des positions (dans plan) des frames signalées écrites par les processus ;
+        rendered, si fourni, est complété au fil du rendu et reste lisible après une annulation ou une erreur.
+        Si is_canceled() devient vrai, les processus sont arrêtés et ExportCanceledVisualisationConstats est levée.
+        """
+        rendered = set() if rendered is None else rendered
+        work_dir = tempfile.mkdtemp(prefix="rendu_constats_")
+        try:
+            plan_path = self.write_plan(plan, communes_layer, extent, outputs, work_dir, preset)
+            self.run(plan_path, len(plan), progress_callback, is_canceled, rendered)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return rendered
+
+    def run(self, plan_path, total, progress_callback=None, is_canceled=None, rendered=None):
+        """Lance les processus de rendu et relaie leur progression ; les frames écrites sont ajoutées à rendered."""
+        rendered = set() if rendered is None else rendered
+        workers = min(self.workers, max(1, total))
+        env = os.environ.copy()
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+        python = self.python_executable()
+        creationflags = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
+        messages = queue.Queue()
+        processes, errors = [], []
+
+        def read_stream(stream, is_error):
+            for line in stream:
+                if is_error:
+                    errors.append(line.rstrip())
+                else:
+                    messages.put(line.strip())
+            stream.close()
+
+        threads = []
+        for rank in range(workers):
+            process = subprocess.Popen(
+                [python, WORKER_SCRIPT, plan_path, str(rank), str(workers)],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                env=env, creationflags=creationflags
+            )
+            processes.append(process)
+            for stream, is_error in ((process.stdout, False), (process.stderr, True)):
+                thread = threading.Thread(target=read_stream, args=(stream, is_error), daemon=True)
+                thread.start()
+                threads.append(thread)
+        print(f"Pool de rendu démarré: {workers} processus ({python})")
+
+        done = 0
+        while any(process.poll() is None for process in processes) or not messages.empty():
+            if is_canceled and is_canceled():
+                for process in processes:
+                    if process.poll() is None:
+                        process.kill()
+                        process.wait()
+                print(f"Pool de rendu arrêté: {done}/{total} frames")
+                raise ExportCanceledVisualisationConstats()
+            try:
+                message = messages.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if message.startswith("FRAME "):
+                rendered.add(int(message.split()[1]))
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total)
+        for thread in threads:
+            thread.join(timeout=5)
+        while not messages.empty():
+            message = messages.get()
+            if message.startswith("FRAME "):
+                rendered.add(int(message.split()[1]))
+                done += 1
+        failed = [process.returncode for process in processes if process.returncode != 0]
+        if failed or done < total:
+            details = "\n".join(errors[-20:])
+            raise RuntimeError(f"Rendu parallèle incomplet ({done}/{total} frames) :\n{details}")
+        print(f"Pool de rendu terminé: {done} frames")
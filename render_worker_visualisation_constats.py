@@ -0,0 +1,62 @@
+# render_worker_visualisation_constats.py
+# Processus de rendu lancé par RenderPoolVisualisationConstats :
+#   python render_worker_visualisation_constats.py plan.json <rang> <nombre_de_processus>
+import importlib
+import json
+import os
+import sys
+
+
+def main(argv):
+    plan_path, rank, count = argv[1], int(argv[2]), int(argv[3])
+    from qgis.core import QgsApplication, QgsProject, QgsVectorLayer, QgsRectangle, QgsCoordinateReferenceSystem
+    app = QgsApplication([], True)
+    app.initQgis()
+    try:
+        # Importer la session d'export via le paquet du plugin pour partager le layout
+        plugin_dir = os.path.dirname(os.path.abspath(__file__))
+        sys.path.insert(0, os.path.dirname(plugin_dir))
+        package = importlib.import_module(os.path.basename(plugin_dir))
+        session_module = importlib.import_module(f"{package.__name__}.export_session_visualisation_constats")
+
+        with open(plan_path, encoding='utf-8') as f:
+            plan = json.load(f)
+        project = QgsProject.instance()
+        project.setCrs(QgsCoordinateReferenceSystem(plan["crs"]))
+        layers = {}
+        for key, info in plan["layers"].items():
+            layer = QgsVectorLayer(info["path"], info["name"], "ogr")
+            if not layer.isValid():
+                print(f"ERREUR couche {info['path']} non valide", file=sys.stderr, flush=True)
+                return 1
+            layer.loadNamedStyle(info["qml"])
+            if info["filter"]:
+                layer.setSubsetString(info["filter"])
+            project.addMapLayer(layer, False)
+            layers[key] = layer
+
+        session = session_module.ExportSessionVisualisationConstats(
+            QgsRectangle(*plan["extent"]), project=project, preset=plan.get("preset", "final")
+        )
+        session.set_basemap([layers[key] for key in plan["basemap"]])
+        frames = plan["frames"]
+        for position in range(rank, len(frames), count):
+            frame = frames[position]
+            image = session.render_frame(frame, [layers[key] for key in frame["layers"]])
+            # Écriture dans un fichier temporaire puis renommage : un processus arrêté ne laisse pas d'image tronquée
+            temp_path = frame["output"] + ".tmp"
+            try:
+                session.save_png(image, temp_path)
+                os.replace(temp_path, frame["output"])
+            except (IOError, OSError) as e:
+                print(f"ERREUR frame {frame['index']}: {e}", file=sys.stderr, flush=True)
+                return 1
+            # Position de la frame dans le plan (les index se répètent d'une variante à l'autre)
+            print(f"FRAME {position}", flush=True)
+        return 0
+    finally:
+        app.exitQgis()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
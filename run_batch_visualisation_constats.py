@@ -0,0 +1,33 @@
+# run_batch_visualisation_constats.py
+# Exécution sans interface de la chaîne complète (tâche planifiée) :
+#   python run_batch_visualisation_constats.py config.json
+# Exemple de config.json (chemins relatifs au fichier) :
+#   {"ods": "constats.ods", "shp": "communes.shp", "output_dir": "sorties",
+#    "departements": ["21"], "png": {"cumulative": true}, "video": {"encoding": {"format": "mp4", "crf": 28}}}
+import importlib
+import os
+import sys
+
+
+def main(argv):
+    if len(argv) != 2:
+        print(f"Usage : {os.path.basename(argv[0])} config.json", file=sys.stderr)
+        return 2
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from qgis.core import QgsApplication
+    app = QgsApplication([], True)
+    app.initQgis()
+    try:
+        # Importer le traitement via le paquet du plugin (imports relatifs)
+        plugin_dir = os.path.dirname(os.path.abspath(__file__))
+        sys.path.insert(0, os.path.dirname(plugin_dir))
+        package = importlib.import_module(os.path.basename(plugin_dir))
+        batch = importlib.import_module(f"{package.__name__}.batch_visualisation_constats")
+        config = batch.load_batch_config(argv[1])
+        return batch.BatchRunnerVisualisationConstats(config).run()
+    finally:
+        app.exitQgis()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
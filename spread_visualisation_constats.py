@@ -0,0 +1,198 @@
+# spread_visualisation_constats.py
+from qgis.core import (
+    QgsApplication, QgsCategorizedSymbolRenderer, QgsFeature, QgsField, QgsFillSymbol, QgsGeometry, QgsProject,
+    QgsRendererCategory, QgsSpatialIndex, QgsVectorLayer
+)
+from PyQt5.QtCore import QVariant
+from collections import deque
+import hashlib
+import json
+import os
+import numpy as np
+from .layer_manager_visualisation_constats import LayerManagerVisualisationConstats
+
+SPREAD_LAYER_NAME = "Front de propagation"
+# Catégories du front : commune nouvellement touchée voisine d'une commune déjà touchée, ou non
+FRONT_CATEGORIES = {
+    1: ("Contiguë à une commune déjà touchée", "#f28e2b"),
+    0: ("Isolée (saut)", "#7b3294"),
+}
+
+
+def adjacency_cache_dir():
+    """Dossier du cache des graphes d'adjacence, dans le profil QGIS (hors du répertoire du plugin)."""
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), "cache", "visualisation_constats", "adjacence")
+
+
+def shp_fingerprint(shp_path, insee_codes):
+    """Empreinte du SHP (chemin, taille et date des fichiers .shp/.dbf) et des communes retenues."""
+    digest = hashlib.sha1(os.path.abspath(shp_path).encode("utf-8"))
+    base = os.path.splitext(shp_path)[0]
+    for path in (shp_path, base + ".dbf"):
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    digest.update(",".join(sorted(insee_codes)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def commune_adjacency(layer, insee_rows):
+    """Graphe d'adjacence {INSEE: [INSEE voisins]} des communes de la couche.
+
+    Les candidats sont pris dans un index spatial (emprises qui se chevauchent) et testés par le moteur
+    de géométrie préparée de chaque commune : pas de comparaison de toutes les paires.
+    """
+    codes_by_fid = {int(fid): insee for insee, fid in insee_rows.items()}
+    geometries = {}
+    for feature in layer.getFeatures():
+        if feature.id() in codes_by_fid and not feature.geometry().isEmpty():
+            geometries[feature.id()] = feature.geometry()
+    index = QgsSpatialIndex()
+    for fid, geometry in geometries.items():
+        index.addFeature(fid, geometry.boundingBox())
+    adjacency = {insee: set() for insee in insee_rows}
+    for fid, geometry in geometries.items():
+        engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+        engine.prepareGeometry()
+        for other in index.intersects(geometry.boundingBox()):
+            if other <= fid:
+                continue
+            other_geometry = geometries[other].constGet()
+            # Les limites communales des SHP se recouvrent parfois légèrement : overlaps vaut alors contact
+            if engine.touches(other_geometry) or engine.overlaps(other_geometry):
+                adjacency[codes_by_fid[fid]].add(codes_by_fid[other])
+                adjacency[codes_by_fid[other]].add(codes_by_fid[fid])
+    return {insee: sorted(neighbours) for insee, neighbours in adjacency.items()}
+
+
+def load_adjacency(layer, insee_rows, shp_path):
+    """Graphe d'adjacence lu dans le cache du profil QGIS, ou calculé puis mis en cache."""
+    cache_dir = adjacency_cache_dir()
+    path = os.path.join(cache_dir, f"adjacence_{shp_fingerprint(shp_path, insee_rows)}.json")
+    if os.path.isfile(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                print(f"Graphe d'adjacence lu dans le cache: {path}")
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"ERREUR lecture cache adjacence: {str(e)}")
+    adjacency = commune_adjacency(layer, insee_rows)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(adjacency, f)
+        print(f"Graphe d'adjacence mis en cache: {path}")
+    except OSError as e:
+        print(f"ERREUR écriture cache adjacence: {str(e)}")
+    return adjacency
+
+
+def bfs_distances(adjacency, sources):
+    """Distance (en nombre de communes traversées) de chaque commune aux communes sources."""
+    distances = {insee: 0 for insee in sources}
+    queue = deque(sources)
+    while queue:
+        insee = queue.popleft()
+        for neighbour in adjacency.get(insee, []):
+            if neighbour not in distances:
+                distances[neighbour] = distances[insee] + 1
+                queue.append(neighbour)
+    return distances
+
+
+class SpreadFrontVisualisationConstats:
+    """Front de propagation : communes touchées pour la première fois à chaque mois.
+
+    Le premier mois de constat de chaque commune est lu sur la matrice communes × mois (filtres courants) ;
+    chaque nouvelle commune est marquée contiguë si elle borde une commune touchée les mois précédents,
+    avec sa distance dans le graphe d'adjacence aux premières communes touchées.
+    """
+
+    def __init__(self, commune_matrix):
+        self.commune_matrix = commune_matrix
+        self.adjacency = {}
+        self.layer = None
+        self.applied = None
+
+    def build(self, shp_path):
+        """Charge ou calcule le graphe d'adjacence des communes de la matrice."""
+        communes = self.commune_matrix.layer
+        if communes is None or not self.commune_matrix.insee_codes:
+            return False
+        insee_rows = {insee: int(fid) for insee, fid in zip(self.commune_matrix.insee_codes, self.commune_matrix.row_fids)}
+        self.adjacency = load_adjacency(communes, insee_rows, shp_path)
+        print(f"Graphe d'adjacence: {len(self.adjacency)} communes, "
+              f"{sum(len(v) for v in self.adjacency.values()) // 2} contacts")
+        return True
+
+    def compute(self):
+        """Front de chaque commune touchée : (indice du premier mois, contiguë, distance aux origines)."""
+        counts = self.commune_matrix.matrix()
+        affected = np.flatnonzero(counts.sum(axis=1) > 0)
+        first_month = {self.commune_matrix.insee_codes[row]: int(np.argmax(counts[row] > 0)) for row in affected}
+        if not first_month:
+            return {}
+        start = min(first_month.values())
+        distances = bfs_distances(self.adjacency, [insee for insee, m in first_month.items() if m == start])
+        front = {}
+        for insee, month in first_month.items():
+            contiguous = any(first_month.get(n, month) < month for n in self.adjacency.get(insee, []))
+            front[insee] = (month, int(contiguous), distances.get(insee, -1))
+        return front
+
+    def update_layer(self):
+        """Remplit la couche du front pour la sélection courante (créée et stylée au premier appel)."""
+        if self.commune_matrix.layer is None:
+            return None
+        layer = self.ensure_layer()
+        provider = layer.dataProvider()
+        provider.truncate()
+        geometries = {f.id(): f.geometry() for f in self.commune_matrix.layer.getFeatures()}
+        rows = self.commune_matrix.insee_rows
+        features = []
+        for insee, (month, contiguous, distance) in self.compute().items():
+            year, month_number = self.commune_matrix.months[month]
+            feature = QgsFeature(layer.fields())
+            feature.setGeometry(geometries.get(int(self.commune_matrix.row_fids[rows[insee]])))
+            feature.setAttributes([insee, year * 100 + month_number, contiguous, distance])
+            features.append(feature)
+        provider.addFeatures(features)
+        layer.updateExtents()
+        self.applied = None
+        layer.setSubsetString("")
+        layer.triggerRepaint()
+        print(f"Front de propagation: {len(features)} communes touchées")
+        return layer
+
+    def ensure_layer(self):
+        if self.layer is not None and QgsProject.instance().mapLayer(self.layer.id()):
+            return self.layer
+        crs = self.commune_matrix.layer.crs()
+        layer = QgsVectorLayer(f"Polygon?crs={crs.authid()}", SPREAD_LAYER_NAME, "memory")
+        layer.dataProvider().addAttributes([
+            QgsField("insee", QVariant.String),
+            QgsField("mois_front", QVariant.Int),
+            QgsField("contigu", QVariant.Int),
+            QgsField("distance", QVariant.Int),
+        ])
+        layer.updateFields()
+        categories = []
+        for value, (label, color) in FRONT_CATEGORIES.items():
+            symbol = QgsFillSymbol.createSimple({'color': color, 'outline_color': 'black', 'outline_width': '0.3'})
+            categories.append(QgsRendererCategory(value, symbol, label))
+        layer.setRenderer(QgsCategorizedSymbolRenderer("contigu", categories))
+        self.layer = LayerManagerVisualisationConstats.add_overlay_layer(layer)
+        return layer
+
+    def frame_expression(self, year, month, cumulative=False):
+        """Filtre des communes entrées dans le front au mois de la frame (ou avant, en mode cumulé)."""
+        key = year * 100 + month
+        return f'"mois_front" <= {key}' if cumulative else f'"mois_front" = {key}'
+
+    def update_frame(self, year, month, cumulative=False):
+        """Filtre la couche sur les communes du front de la frame (voir frame_expression)."""
+        if self.layer is None:
+            return None
+        expression = self.frame_expression(year, month, cumulative)
+        self.applied = LayerManagerVisualisationConstats.apply_frame_filter(self.layer, expression, self.applied)
+        return self.layer
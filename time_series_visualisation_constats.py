@@ -0,0 +1,114 @@
+# time_series_visualisation_constats.py
+from qgis.core import QgsField
+from PyQt5.QtCore import QVariant
+import csv
+import numpy as np
+from .utils_visualisation_constats import encode_column
+
+# Fenêtres glissantes (en mois) et champs écrits sur la couche Communes : (commune, département)
+ROLLING_WINDOWS = {
+    3: ("nb_3_mois", "dep_3_mois"),
+    12: ("nb_12_mois", "dep_12_mois"),
+}
+
+
+def rolling_sums(counts, window):
+    """Sommes glissantes sur window mois (se terminant au mois de la colonne), par différence de sommes cumulées."""
+    cumulative = np.zeros((counts.shape[0], counts.shape[1] + 1), dtype=np.int64)
+    np.cumsum(counts, axis=1, out=cumulative[:, 1:])
+    starts = np.maximum(np.arange(counts.shape[1]) + 1 - window, 0)
+    return cumulative[:, 1:] - cumulative[:, starts]
+
+
+class RollingCountsVisualisationConstats:
+    """Effectifs glissants sur 3 et 12 mois par commune et par département.
+
+    Calculés sur la matrice communes × mois du mode choroplèthe (filtres courants compris),
+    mis en cache par sélection, écrits sur la couche Communes à chaque frame.
+    """
+
+    def __init__(self, commune_matrix):
+        self.commune_matrix = commune_matrix
+        self.departments = []
+        self.department_rows = np.zeros(0, dtype=np.int64)
+        self.cache = {}
+        self.last_values = None
+
+    def build(self):
+        """Regroupe les lignes de la matrice par département (deux premiers caractères du code INSEE)."""
+        self.departments, self.department_rows = encode_column(
+            [insee[:2] for insee in self.commune_matrix.insee_codes]
+        )
+        self.cache = {}
+        self.last_values = None
+        return self.commune_matrix.layer is not None
+
+    def sums(self, window, by_department=False):
+        """Matrice (communes ou départements, mois) des sommes glissantes pour la sélection courante."""
+        key = self.commune_matrix.selection + (window, by_department)
+        if key not in self.cache:
+            counts = self.commune_matrix.matrix()
+            if by_department:
+                grouped = np.zeros((len(self.departments), counts.shape[1]), dtype=np.int64)
+                np.add.at(grouped, self.department_rows, counts)
+                counts = grouped
+            self.cache[key] = rolling_sums(counts, window)
+        return self.cache[key]
+
+    def frame_values(self, year, month):
+        """Valeurs des champs de ROLLING_WINDOWS pour chaque commune au mois donné."""
+        index = self.commune_matrix.month_index.get((year, month))
+        columns = []
+        for window in ROLLING_WINDOWS:
+            if index is None:
+                columns += [np.zeros(len(self.department_rows), dtype=np.int64)] * 2
+            else:
+                columns.append(self.sums(window)[:, index])
+                columns.append(self.sums(window, by_department=True)[self.department_rows, index])
+        return np.stack(columns, axis=1)
+
+    def update_layer(self, year, month):
+        """Écrit en un seul lot les effectifs glissants de la frame (communes modifiées uniquement)."""
+        layer = self.commune_matrix.layer
+        if layer is None:
+            return
+        names = [name for fields in ROLLING_WINDOWS.values() for name in fields]
+        missing = [name for name in names if layer.fields().indexFromName(name) < 0]
+        if missing:
+            layer.dataProvider().addAttributes([QgsField(name, QVariant.Int) for name in missing])
+            layer.updateFields()
+            self.last_values = None
+        indexes = [layer.fields().indexFromName(name) for name in names]
+        values = self.frame_values(year, month)
+        if self.last_values is None:
+            changed = np.arange(len(values))
+        else:
+            changed = np.flatnonzero((values != self.last_values).any(axis=1))
+        if len(changed):
+            fids = self.commune_matrix.row_fids
+            layer.dataProvider().changeAttributeValues({
+                int(fids[i]): {idx: int(v) for idx, v in zip(indexes, values[i])} for i in changed
+            })
+        self.last_values = values
+
+    def write_csv(self, path):
+        """Exporte, pour chaque commune et chaque département, les effectifs mensuels et glissants (lignes non nulles)."""
+        months = self.commune_matrix.months
+        monthly = self.commune_matrix.matrix()
+        by_department = np.zeros((len(self.departments), monthly.shape[1]), dtype=np.int64)
+        np.add.at(by_department, self.department_rows, monthly)
+        levels = [
+            ("Commune", self.commune_matrix.insee_codes, monthly, False),
+            ("Département", self.departments, by_department, True),
+        ]
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, delimiter=";")
+            writer.writerow(["Niveau", "Code", "Année", "Mois", "Constats"] + [f"Glissant {w} mois" for w in ROLLING_WINDOWS])
+            for level, codes, counts, grouped in levels:
+                rolling = [self.sums(window, grouped) for window in ROLLING_WINDOWS]
+                for row, column in zip(*np.nonzero(np.stack(rolling).sum(axis=0))):
+                    year, month = months[column]
+                    writer.writerow(
+                        [level, codes[row], year, month, int(counts[row, column])] + [int(r[row, column]) for r in rolling]
+                    )
+        print(f"Effectifs glissants exportés: {path}")
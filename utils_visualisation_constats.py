@@ -4,96 +4,99 @@ import re
 import difflib
 import csv
 import datetime  
-from collections import defaultdict
+import numpy as np
+from qgis.core import QgsFeatureRequest
+
+DATE_FIELDS = ["date du constat", "Date du constat", "DATE"]
+DATE_FORMATS = ["%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y"]
+
+def parse_date(date_str):
+    """Date du constat, ou None si le format n'est pas reconnu."""
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(date_str, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def parse_year(date_str):
+    """Année d'une date du constat, ou None si le format n'est pas reconnu."""
+    date = parse_date(date_str)
+    return date.year if date else None
+
+def encode_column(values):
+    """Code une colonne en entiers : retourne (valeurs distinctes triées, code de chaque ligne)."""
+    labels, codes = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+    return labels.tolist(), codes
 
 def generate_crosstab_data(ods_layer):
     """
     Génère les données pour un tableau croisé dynamique à partir de la couche ODS.
+    Les colonnes date, espèce et conclusion sont lues en une passe sans géométrie,
+    chaque valeur distincte n'est analysée qu'une fois, puis le cube est compté par bincount.
     Retourne un dictionnaire structuré comme suit :
     {
         "années": [2013, 2014, ...],
         "espèces": ["Bovins", "Ovin", ...],
         "conclusions": ["Loup non écarté", "Grands prédateurs écartés", ...],
-        "data": {
-            (année, espèce, conclusion): nombre_de_constats,
-            ...
-        },
-        "totaux_par_conclusion_et_année": {
-            (année, conclusion): total_toutes_espèces,
-            ...
-        }
+        "cube": tableau numpy (année, espèce, conclusion) -> nombre_de_constats
     }
     """
-    # Initialisation des structures de données
-    data = defaultdict(int)
-    totaux_par_conclusion_et_année = defaultdict(int)
-    espèces = set()
-    conclusions = set()
-    années = set()
-
-    # Champs de date possibles
-    date_fields = ["date du constat", "Date du constat", "DATE"]
-
-    for feature in ods_layer.getFeatures():
-        # Récupérer l'année
+    names = ods_layer.fields().names()
+    date_fields = [field for field in DATE_FIELDS if field in names]
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(date_fields + ["Elevage", "Conclusion technique"], ods_layer.fields())
+    dates, raw_species, conclusions = [], [], []
+    for feature in ods_layer.getFeatures(request):
+        # Première date non vide parmi les champs possibles
         date_str = ""
         for field in date_fields:
-            if field in feature.fields().names():
-                raw_date = feature[field]
-                date_str = str(raw_date or "").strip()
-                if date_str:
-                    break
-        if not date_str:
-            continue
-
-        # Extraire l'année
-        year = None
-        for fmt in ["%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y"]:
-            try:
-                date = datetime.datetime.strptime(date_str, fmt)
-                year = date.year
-                années.add(year)
+            date_str = str(feature[field] or "").strip()
+            if date_str:
                 break
-            except ValueError:
-                continue
-        if year is None:
-            continue
-
-        # Récupérer l'espèce et la conclusion
-        espèce = normalize_elevage(str(feature["Elevage"] or ""))
-        conclusion = str(feature["Conclusion technique"] or "")
-        if not espèce or not conclusion:
-            continue
-
-        espèces.add(espèce)
-        conclusions.add(conclusion)
-
-        # Incrémenter les compteurs
-        data[(year, espèce, conclusion)] += 1
-        totaux_par_conclusion_et_année[(year, conclusion)] += 1
-
+        dates.append(date_str)
+        raw_species.append(str(feature["Elevage"] or ""))
+        conclusions.append(str(feature["Conclusion technique"] or ""))
+
+    year_of = {date_str: parse_year(date_str) if date_str else None for date_str in set(dates)}
+    species_of = {raw: normalize_elevage(raw) for raw in set(raw_species)}
+    rows = [
+        (year_of[date_str], species_of[raw], conclusion)
+        for date_str, raw, conclusion in zip(dates, raw_species, conclusions)
+        if year_of[date_str] is not None and species_of[raw] and conclusion
+    ]
+    if not rows:
+        return {"années": [], "espèces": [], "conclusions": [], "cube": np.zeros((0, 0, 0), dtype=np.int64)}
+    years, species, conclusions = zip(*rows)
+    année_labels, year_codes = encode_column(years)
+    espèce_labels, species_codes = encode_column(species)
+    conclusion_labels, conclusion_codes = encode_column(conclusions)
+    shape = (len(année_labels), len(espèce_labels), len(conclusion_labels))
+    flat = np.ravel_multi_index((year_codes, species_codes, conclusion_codes), shape)
+    cube = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+    print(f"Tableau croisé: {len(rows)} constats, {shape[0]} années, {shape[1]} espèces, {shape[2]} conclusions")
     return {
-        "années": sorted(années),
-        "espèces": sorted(espèces),
-        "conclusions": sorted(conclusions),
-        "data": data,
-        "totaux_par_conclusion_et_année": totaux_par_conclusion_et_année
+        "années": année_labels,
+        "espèces": espèce_labels,
+        "conclusions": conclusion_labels,
+        "cube": cube
     }
 
 def write_crosstab_to_csv(crosstab_data, output_path):
     """
     Écrit le tableau croisé dynamique dans un fichier CSV.
     Structure du CSV :
-    - Une ligne par espèce.
-    - Une colonne par conclusion technique, avec le nombre de constats.
-    - Une colonne "Année" qui répète l'année pour chaque ligne.
-    - Une colonne "Total" avec le total toutes espèces confondues pour chaque conclusion et année.
+    - Une ligne par espèce et par année, avec le nombre de constats de chaque conclusion technique.
+    - Une colonne "Total" : total de la ligne, toutes conclusions confondues.
+    - Puis une ligne "Toutes espèces" par année (somme sur l'axe des espèces).
     """
     années = crosstab_data["années"]
     espèces = crosstab_data["espèces"]
     conclusions = crosstab_data["conclusions"]
-    data = crosstab_data["data"]
-    totaux = crosstab_data["totaux_par_conclusion_et_année"]
+    cube = crosstab_data["cube"]
+    totaux_lignes = cube.sum(axis=2)
+    toutes_espèces = cube.sum(axis=1)
 
     with open(output_path, mode='w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile, delimiter=';')
@@ -103,17 +106,11 @@ def write_crosstab_to_csv(crosstab_data, output_path):
         writer.writerow(header)
 
         # Écrire les données
-        for espèce in espèces:
-            for année in années:
-                row = [espèce, année]
-                total_row = 0
-                for conclusion in conclusions:
-                    count = data.get((année, espèce, conclusion), 0)
-                    row.append(count)
-                    total_row += count
-                # Ajouter le total pour la ligne (toutes espèces confondues)
-                row.append(totaux.get((année, conclusion), 0) if conclusion else 0)
-                writer.writerow(row)
+        for s, espèce in enumerate(espèces):
+            for y, année in enumerate(années):
+                writer.writerow([espèce, année] + cube[y, s].tolist() + [int(totaux_lignes[y, s])])
+        for y, année in enumerate(années):
+            writer.writerow(["Toutes espèces", année] + toutes_espèces[y].tolist() + [int(toutes_espèces[y].sum())])
 
     print(f"Tableau croisé dynamique sauvegardé dans : {output_path}")
  